@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Job queue benchmark for media-manager.
+
+Runs several worker processes against a JobQueue in a temporary directory,
+like hosts sharing a queue directory on a network mount. Jobs are submitted
+with old modification times, so a lease only survives if it is touched as
+it is taken. Workers crash now and then while holding a lease, and are
+restarted; their leases have to expire and be reclaimed by the other
+workers. Reports the throughput, and fails if a worker raised, a job is
+missing or failed, or a lease was left behind.
+
+Usage:
+python benchmarks/job_queue.py [--workers 4] [--jobs 200] [--work-ms 10]
+                               [--crash-every 25] [--lease-timeout 1]
+                               [--workdir DIRECTORY] [--output FILE]
+"""
+
+import os
+import sys
+import json
+import time
+import getopt
+import shutil
+import tempfile
+import multiprocessing
+from typing import List
+
+# library puts the repository on the path, so it is imported first
+import library  # noqa: F401
+
+from media_manager.job_queue import JobQueue
+
+# Exit code of a worker that crashed on purpose, holding a lease
+CRASHED = 3
+
+
+def run_worker(
+    directory: str,
+    lease_timeout: float,
+    work_seconds: float,
+    crash_every: int,
+) -> None:
+    """
+    Lease and complete jobs until the stop file appears.
+
+    Args:
+    - directory (str): Directory of the queue.
+    - lease_timeout (float): Seconds without a heartbeat after which a lease expires.
+    - work_seconds (float): Seconds each job takes.
+    - crash_every (int): Exit without completing every this many leases, or 0 to never.
+    """
+    queue = JobQueue(
+        directory,
+        lease_timeout=lease_timeout,
+        heartbeat_interval=lease_timeout / 5,
+        max_attempts=10,
+    )
+    stop = os.path.join(directory, "stop")
+    leased = 0
+    while not os.path.exists(stop):
+        lease = queue.lease()
+        if lease is None:
+            time.sleep(0.02)
+            continue
+        leased += 1
+        if crash_every and leased % crash_every == 0:
+            # Die like a host losing power: the lease stays until it expires
+            os._exit(CRASHED)
+        with queue.hold(lease):
+            time.sleep(work_seconds)
+        queue.complete(lease, {"job": lease.spec["job"]})
+
+
+def main(argv: List[str]) -> int:
+    workers = 4
+    jobs = 200
+    work_seconds = 0.01
+    crash_every = 25
+    lease_timeout = 1.0
+    workdir = None
+    output = None
+    try:
+        opts, _ = getopt.getopt(
+            argv,
+            "ho:",
+            [
+                "help",
+                "crash-every=",
+                "jobs=",
+                "lease-timeout=",
+                "output=",
+                "work-ms=",
+                "workdir=",
+                "workers=",
+            ],
+        )
+    except getopt.GetoptError as e:
+        print(f"Argument Error: {e}")
+        print(__doc__)
+        return 2
+    for opt, arg in opts:
+        if opt in ("-h", "--help"):
+            print(__doc__)
+            return 0
+        elif opt == "--crash-every":
+            crash_every = int(arg)
+        elif opt == "--jobs":
+            jobs = int(arg)
+        elif opt == "--lease-timeout":
+            lease_timeout = float(arg)
+        elif opt in ("-o", "--output"):
+            output = arg
+        elif opt == "--work-ms":
+            work_seconds = float(arg) / 1000
+        elif opt == "--workdir":
+            workdir = arg
+        elif opt == "--workers":
+            workers = max(1, int(arg))
+
+    directory = tempfile.mkdtemp(prefix="media-manager-queue-", dir=workdir)
+    context = multiprocessing.get_context("spawn")
+    arguments = (directory, lease_timeout, work_seconds, crash_every)
+    crashes = 0
+    errors = 0
+    try:
+        queue = JobQueue(directory, lease_timeout=lease_timeout)
+        job_ids = [queue.submit({"job": index}) for index in range(jobs)]
+        # Backdate the pending jobs, so a lease taken without touching the
+        # job first looks expired to the other workers straight away
+        for name in os.listdir(os.path.join(directory, "pending")):
+            old = time.time() - 10 * lease_timeout
+            os.utime(os.path.join(directory, "pending", name), (old, old))
+
+        start = time.perf_counter()
+        processes = [
+            context.Process(target=run_worker, args=arguments) for _ in range(workers)
+        ]
+        for process in processes:
+            process.start()
+        deadline = time.monotonic() + 60 + jobs * (work_seconds + lease_timeout)
+        while len(os.listdir(os.path.join(directory, "results"))) < jobs:
+            if time.monotonic() > deadline:
+                print("Timed out waiting for the jobs to finish")
+                errors += 1
+                break
+            for index, process in enumerate(processes):
+                if process.is_alive():
+                    continue
+                if process.exitcode == CRASHED:
+                    crashes += 1
+                else:
+                    errors += 1
+                    print(f"Worker exited with code {process.exitcode}")
+                # Bring the host back, its lease is left to expire
+                processes[index] = context.Process(target=run_worker, args=arguments)
+                processes[index].start()
+            time.sleep(0.05)
+        seconds = time.perf_counter() - start
+        open(os.path.join(directory, "stop"), "w").close()
+        for process in processes:
+            process.join()
+            if process.exitcode not in (0, CRASHED):
+                errors += 1
+                print(f"Worker exited with code {process.exitcode}")
+
+        results = [queue.result(job_id) for job_id in job_ids]
+        missing = sum(1 for result in results if result is None)
+        failed = sum(1 for result in results if result and result.get("failed"))
+        left = len(os.listdir(os.path.join(directory, "leased"))) + len(
+            os.listdir(os.path.join(directory, "pending"))
+        )
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    print(
+        f"{jobs} jobs on {workers} workers in {seconds:.2f} s "
+        f"({jobs / seconds:.1f} jobs/s)\n"
+        f"{crashes} crashes reclaimed, {missing} missing, {failed} failed, "
+        f"{left} left in the queue, {errors} worker errors"
+    )
+    if output:
+        with open(output, "w") as output_file:
+            json.dump(
+                {
+                    "workers": workers,
+                    "jobs": jobs,
+                    "work_seconds": work_seconds,
+                    "lease_timeout": lease_timeout,
+                    "seconds": seconds,
+                    "jobs_per_second": jobs / seconds,
+                    "crashes": crashes,
+                    "missing": missing,
+                    "failed": failed,
+                    "left": left,
+                    "errors": errors,
+                },
+                output_file,
+                indent=2,
+            )
+        print(f"Results written to {output}")
+    return 1 if missing or failed or left or errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,370 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Synthetic media library generator for the media-manager benchmarks.
+
+Builds a download directory the way torrent and usenet clients leave it:
+movie release folders with .nfo junk and Subs directories, season folders of
+series episodes, loose files in the root and music albums. Videos are tiny
+valid Matroska or MP4 files, so the native header reader and in-place tag
+editing work on them without ffmpeg. Music files are sparse.
+
+Usage:
+python benchmarks/library.py --files 1000 [--seed 0] [--no-music] DIRECTORY
+"""
+
+import os
+import sys
+import getopt
+import random
+import struct
+from typing import Dict, List
+
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPOSITORY not in sys.path:
+    sys.path.insert(0, REPOSITORY)
+
+from media_manager.containers import (  # noqa: E402
+    CLUSTER,
+    CODEC_ID,
+    DURATION,
+    EBML,
+    INFO,
+    PIXEL_HEIGHT,
+    PIXEL_WIDTH,
+    SEGMENT,
+    TIMESTAMP_SCALE,
+    TITLE,
+    TRACK_ENTRY,
+    TRACK_NUMBER,
+    TRACK_TYPE,
+    TRACK_UID,
+    TRACKS,
+    VIDEO,
+    VOID,
+    encode_box,
+    encode_element,
+)
+
+WORDS = (
+    "The Lion King Dark Knight Rises Return Empire Strikes Back Lost City "
+    "Blade Runner Matrix Reloaded Alien Covenant Mad Max Fury Road Last Night "
+    "Ocean Eleven Star Trek Beyond Inside Out Grand Budapest Hotel Green Mile "
+    "Silent Hill Iron Man Wild Robot Little Women Dune Part Two Arrival Heat"
+).split()
+QUALITIES = ("2160p", "1080p", "720p", "480p")
+SOURCES = ("BluRay", "WEB-DL", "WEBRip", "HDTV", "REMASTERED.BluRay", "EXTENDED.WEB")
+CODECS = ("x264", "x265", "H.264", "HEVC.10bit")
+GROUPS = ("YTS", "RARBG", "NTb", "FLUX", "SPARKS", "[TheBay]", "[eztv]")
+LANGUAGES = ("English", "Spanish", "French", "German")
+
+
+def matroska_stub(title: str = "") -> bytes:
+    """
+    Build a minimal Matroska file with one H.264 video track.
+
+    Args:
+    - title (str): Title stored in the segment info.
+
+    Returns:
+    - The file content.
+    """
+    ebml_header = encode_element(
+        EBML,
+        encode_element(0x4282, b"matroska")
+        + encode_element(0x4287, b"\x04")
+        + encode_element(0x4285, b"\x02"),
+    )
+    info = encode_element(
+        INFO,
+        encode_element(TIMESTAMP_SCALE, (1000000).to_bytes(3, "big"))
+        + encode_element(DURATION, struct.pack(">d", 5400000.0))
+        + (encode_element(TITLE, title.encode("utf-8")) if title else b""),
+    )
+    track = encode_element(
+        TRACK_ENTRY,
+        encode_element(TRACK_NUMBER, b"\x01")
+        + encode_element(TRACK_UID, b"\x01")
+        + encode_element(TRACK_TYPE, b"\x01")
+        + encode_element(CODEC_ID, b"V_MPEG4/ISO/AVC")
+        + encode_element(
+            VIDEO,
+            encode_element(PIXEL_WIDTH, (1920).to_bytes(2, "big"))
+            + encode_element(PIXEL_HEIGHT, (1080).to_bytes(2, "big")),
+        ),
+    )
+    # Room for the title and tags to be edited in place
+    void = encode_element(VOID, bytes(256))
+    cluster = encode_element(CLUSTER, encode_element(0xE7, b"\x00"))
+    segment = encode_element(
+        SEGMENT, info + void + encode_element(TRACKS, track) + cluster
+    )
+    return ebml_header + segment
+
+
+def mp4_stub() -> bytes:
+    """
+    Build a minimal MP4 file with one H.264 video track and no samples.
+
+    Returns:
+    - The file content.
+    """
+
+    def full_box(box_type: bytes, data: bytes) -> bytes:
+        return encode_box(box_type, b"\x00\x00\x00\x00" + data)
+
+    identity_matrix = struct.pack(">9I", 0x10000, 0, 0, 0, 0x10000, 0, 0, 0, 0x40000000)
+    mvhd = full_box(
+        b"mvhd",
+        struct.pack(">IIII", 0, 0, 1000, 5400000)
+        + struct.pack(">IH", 0x10000, 0x100)
+        + bytes(10)
+        + identity_matrix
+        + bytes(24)
+        + struct.pack(">I", 2),
+    )
+    tkhd = encode_box(
+        b"tkhd",
+        b"\x00\x00\x00\x03"
+        + struct.pack(">IIIII", 0, 0, 1, 0, 5400000)
+        + bytes(8)
+        + struct.pack(">hhhH", 0, 0, 0, 0)
+        + identity_matrix
+        + struct.pack(">II", 1920 << 16, 1080 << 16),
+    )
+    mdhd = full_box(
+        b"mdhd", struct.pack(">IIII", 0, 0, 24000, 0) + struct.pack(">HH", 0x55C4, 0)
+    )
+    hdlr = full_box(b"hdlr", bytes(4) + b"vide" + bytes(12) + b"VideoHandler\x00")
+    avc1 = encode_box(
+        b"avc1",
+        bytes(6)
+        + struct.pack(">H", 1)
+        + bytes(16)
+        + struct.pack(">HH", 1920, 1080)
+        + struct.pack(">II", 0x480000, 0x480000)
+        + bytes(4)
+        + struct.pack(">H", 1)
+        + bytes(32)
+        + struct.pack(">Hh", 0x18, -1),
+    )
+    stsd = full_box(b"stsd", struct.pack(">I", 1) + avc1)
+    stbl = encode_box(
+        b"stbl",
+        stsd
+        + full_box(b"stts", struct.pack(">I", 0))
+        + full_box(b"stsc", struct.pack(">I", 0))
+        + full_box(b"stsz", struct.pack(">II", 0, 0))
+        + full_box(b"stco", struct.pack(">I", 0)),
+    )
+    minf = encode_box(b"minf", full_box(b"vmhd", bytes(8)) + stbl)
+    trak = encode_box(b"trak", tkhd + encode_box(b"mdia", mdhd + hdlr + minf))
+    ftyp = encode_box(b"ftyp", b"isom\x00\x00\x02\x00isomiso2avc1mp41")
+    # Room for the title and tags to be edited in place
+    return (
+        ftyp
+        + encode_box(b"moov", mvhd + trak)
+        + encode_box(b"free", bytes(512))
+        + encode_box(b"mdat", b"")
+    )
+
+
+class LibraryGenerator:
+    """
+    Builds a reproducible synthetic download directory.
+
+    Attributes:
+    - seed: Seed of the random names.
+    - music: Flag indicating whether to include music albums.
+    - counts: Number of files written, by kind.
+    """
+
+    def __init__(self, seed: int = 0, music: bool = True):
+        """
+        Initialize the LibraryGenerator.
+
+        Args:
+        - seed (int): Seed of the random names.
+        - music (bool): Include music albums.
+        """
+        self.seed = seed
+        self.music = music
+        self.counts: Dict[str, int] = {}
+        self._random = random.Random(seed)
+        self._names: set = set()
+        self._matroska = matroska_stub()
+        self._mp4 = mp4_stub()
+
+    def _write(self, path: str, kind: str, data: bytes = b"", size: int = 0) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as media_file:
+            media_file.write(data)
+            if size:
+                media_file.truncate(size)
+        self.counts[kind] = self.counts.get(kind, 0) + 1
+
+    def _title(self, words: int) -> str:
+        return ".".join(self._random.sample(WORDS, words))
+
+    def _unique(self, name: str) -> bool:
+        if not name or name in self._names:
+            return False
+        self._names.add(name)
+        return True
+
+    def _video(self, path: str) -> None:
+        if path.endswith(".mkv"):
+            self._write(path, "video", self._matroska)
+        else:
+            self._write(path, "video", self._mp4)
+
+    def movie(self, root: str, loose: bool = False) -> int:
+        # Releases stay unique once cleaned, so no two of them are merged
+        movie = ""
+        while not self._unique(movie):
+            movie = (
+                f"{self._title(self._random.randint(2, 4))}."
+                f"{self._random.randint(1960, 2024)}."
+                f"{self._random.choice(QUALITIES)}"
+            )
+        release = (
+            f"{movie}.{self._random.choice(SOURCES)}."
+            f"{self._random.choice(CODECS)}-{self._random.choice(GROUPS)}"
+        )
+        extension = self._random.choice((".mkv", ".mkv", ".mp4"))
+        if loose:
+            self._video(os.path.join(root, f"{release}{extension}"))
+            return 1
+        folder = os.path.join(root, release)
+        self._video(os.path.join(folder, f"{release}{extension}"))
+        self._write(os.path.join(folder, f"{release}.nfo"), "junk", b"release notes\n")
+        if self._random.random() < 0.5:
+            for language in self._random.sample(LANGUAGES, 2):
+                self._write(
+                    os.path.join(folder, "Subs", f"{language}.srt"),
+                    "subtitle",
+                    b"1\n00:00:01,000 --> 00:00:02,000\nHello\n",
+                )
+        return 1
+
+    def season(self, root: str, episodes: int) -> int:
+        show = ""
+        season = 0
+        while not self._unique(f"{show}.S{season:02d}" if show else ""):
+            show = self._title(self._random.randint(1, 3))
+            season = self._random.randint(1, 12)
+        quality = self._random.choice(QUALITIES)
+        source = self._random.choice(SOURCES)
+        group = self._random.choice(GROUPS)
+        folder = os.path.join(root, f"{show}.S{season:02d}.{quality}.{source}-{group}")
+        extension = self._random.choice((".mkv", ".mp4"))
+        subtitles = self._random.random() < 0.5
+        for episode in range(1, episodes + 1):
+            name = f"{show}.S{season:02d}E{episode:02d}.{quality}.{source}-{group}"
+            self._video(os.path.join(folder, f"{name}{extension}"))
+            if subtitles:
+                self._write(
+                    os.path.join(folder, "Subs", name, "2_English.srt"),
+                    "subtitle",
+                    b"1\n00:00:01,000 --> 00:00:02,000\nHello\n",
+                )
+        self._write(os.path.join(folder, f"{show}.nfo"), "junk", b"release notes\n")
+        return episodes
+
+    def album(self, root: str, tracks: int) -> int:
+        artist = album = ""
+        while not self._unique(f"{artist} - {album}" if artist else ""):
+            artist = self._title(2).replace(".", " ")
+            album = self._title(2).replace(".", " ")
+        folder = os.path.join(root, f"{artist} - {album} (FLAC)")
+        for track in range(1, tracks + 1):
+            self._write(
+                os.path.join(folder, f"{track:02d} Track {track}.mp3"),
+                "music",
+                b"ID3\x04\x00\x00\x00\x00\x00\x00",
+                size=4 * 1024 * 1024,
+            )
+        return tracks
+
+    def generate(self, root: str, files: int) -> Dict[str, int]:
+        """
+        Write a library with about the given number of media files.
+
+        Roughly 40% of the files are movies, 5% loose movies in the root, 45%
+        series episodes and 10% music, or 50% episodes without music.
+
+        Args:
+        - root (str): Directory to write the library to.
+        - files (int): Number of media files to write.
+
+        Returns:
+        - Number of files written, by kind.
+        """
+        os.makedirs(root, exist_ok=True)
+        written = 0
+        while written < files:
+            remaining = files - written
+            roll = self._random.random()
+            if roll < 0.40:
+                written += self.movie(root)
+            elif roll < 0.45:
+                written += self.movie(root, loose=True)
+            elif roll < 0.90 or not self.music:
+                written += self.season(
+                    root, min(remaining, self._random.randint(6, 24))
+                )
+            else:
+                written += self.album(root, min(remaining, self._random.randint(8, 16)))
+        return dict(self.counts)
+
+
+def generate_library(
+    root: str, files: int, seed: int = 0, music: bool = True
+) -> Dict[str, int]:
+    """
+    Write a synthetic media library.
+
+    Args:
+    - root (str): Directory to write the library to.
+    - files (int): Number of media files to write.
+    - seed (int): Seed of the random names, the same seed gives the same tree.
+    - music (bool): Include music albums.
+
+    Returns:
+    - Number of files written, by kind.
+    """
+    return LibraryGenerator(seed=seed, music=music).generate(root, files)
+
+
+def main(argv: List[str]) -> int:
+    files = 1000
+    seed = 0
+    music = True
+    try:
+        opts, args = getopt.getopt(argv, "h", ["help", "files=", "seed=", "no-music"])
+    except getopt.GetoptError as e:
+        print(f"Argument Error: {e}")
+        print(__doc__)
+        return 2
+    for opt, arg in opts:
+        if opt in ("-h", "--help"):
+            print(__doc__)
+            return 0
+        elif opt == "--files":
+            files = int(arg)
+        elif opt == "--seed":
+            seed = int(arg)
+        elif opt == "--no-music":
+            music = False
+    if len(args) != 1:
+        print(__doc__)
+        return 2
+    counts = generate_library(args[0], files, seed=seed, music=music)
+    for kind, count in sorted(counts.items()):
+        print(f"{kind}: {count}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
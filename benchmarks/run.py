@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark suite for media-manager.
+
+Generates synthetic libraries (see library.py) and times find_media,
+media_detection, clean_file_name, an end-to-end clean_media run and
+move_media on each of them. Results are written as JSON, and can be compared
+against the results of an earlier version.
+
+Usage:
+python benchmarks/run.py [--sizes 1000,10000,100000] [--repeat 1] [--jobs 1]
+                         [--seed 0] [--workdir DIRECTORY] [--output FILE]
+                         [--compare BASELINE] [--tolerance 10]
+"""
+
+import os
+import sys
+import json
+import time
+import getopt
+import shutil
+import platform
+import tempfile
+import statistics
+import subprocess
+import contextlib
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+# library puts the repository on the path, so it is imported first
+from library import REPOSITORY, generate_library
+from startup import import_times
+
+from media_manager.media_job import MediaJob
+from media_manager.media_manager import MediaManager
+from media_manager.probe_cache import ProbeCache
+from media_manager.version import __version__
+
+BENCHMARKS = (
+    "find_media",
+    "media_detection",
+    "clean_file_name",
+    "clean_media",
+    "move_media",
+)
+
+
+def timed(function: Callable[[], Any]) -> float:
+    """
+    Run a function with its output discarded.
+
+    Args:
+    - function (Callable): Function to run.
+
+    Returns:
+    - Wall time in seconds.
+    """
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        function()
+        return time.perf_counter() - start
+
+
+def new_manager(directory: str, jobs: int) -> MediaManager:
+    manager = MediaManager()
+    manager.set_media_directory(media_directory=directory)
+    manager.set_jobs(jobs=jobs)
+    manager.set_probe_cache(ProbeCache())
+    return manager
+
+
+def run_size(files: int, seed: int, jobs: int, workdir: str) -> Dict[str, float]:
+    """
+    Run every benchmark once on freshly generated libraries.
+
+    Args:
+    - files (int): Number of media files in the libraries.
+    - seed (int): Seed of the library generator.
+    - jobs (int): Number of media files processed concurrently.
+    - workdir (str): Directory to generate the libraries in.
+
+    Returns:
+    - Wall time in seconds, by benchmark.
+    """
+    results = {}
+
+    library = os.path.join(workdir, "scan")
+    generate_library(library, files, seed=seed)
+    manager = new_manager(library, jobs)
+    results["find_media"] = timed(lambda: manager.find_media(prefetch=False))
+    media_jobs = [
+        MediaJob(entry, manager.movie_filters)
+        for entry in manager.media_index.pending()
+        if os.path.splitext(entry.path)[1][1:] in manager.supported_video_types
+    ]
+
+    def detect():
+        for job in media_jobs:
+            manager.media_detection(job)
+
+    def clean_names():
+        for job in media_jobs:
+            manager.clean_file_name(job)
+
+    results["media_detection"] = timed(detect)
+    results["clean_file_name"] = timed(clean_names)
+    manager.probe_cache.close()
+    shutil.rmtree(library)
+
+    # Music needs network recognition, so the end to end run is video only
+    library = os.path.join(workdir, "clean")
+    movies = os.path.join(workdir, "movies")
+    series = os.path.join(workdir, "series")
+    generate_library(library, files, seed=seed, music=False)
+    os.makedirs(movies)
+    os.makedirs(series)
+    manager = new_manager(library, jobs)
+
+    def clean():
+        manager.find_media(lazy=True)
+        manager.clean_media()
+
+    def move():
+        manager.move_media(target_directory=movies, media_type="media")
+        manager.move_media(target_directory=series, media_type="series")
+
+    results["clean_media"] = timed(clean)
+    results["move_media"] = timed(move)
+    manager.probe_cache.close()
+    for directory in (library, movies, series):
+        shutil.rmtree(directory, ignore_errors=True)
+    return results
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=REPOSITORY,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> int:
+    """
+    Print the change of every benchmark against a baseline.
+
+    Args:
+    - results (Dict[str, Any]): Results of this run.
+    - baseline (Dict[str, Any]): Results of an earlier run.
+    - tolerance (float): Slowdown in percent reported as a regression.
+
+    Returns:
+    - Number of regressions.
+    """
+    previous = {
+        (result["benchmark"], result["files"]): result["seconds"]
+        for result in baseline["results"]
+    }
+    regressions = 0
+    print(
+        f"\nCompared to {baseline.get('version')} ({(baseline.get('commit') or '')[:10]}):"
+    )
+    for result in results["results"]:
+        seconds = previous.get((result["benchmark"], result["files"]))
+        if not seconds:
+            continue
+        change = (result["seconds"] / seconds - 1) * 100
+        regression = change > tolerance
+        regressions += regression
+        print(
+            f"\t{result['benchmark']:<16} {result['files']:>7} files: "
+            f"{seconds:9.3f} s -> {result['seconds']:9.3f} s ({change:+6.1f}%)"
+            f"{'  REGRESSION' if regression else ''}"
+        )
+    return regressions
+
+
+def main(argv: List[str]) -> int:
+    sizes = [1000, 10000, 100000]
+    repeat = 1
+    jobs = 1
+    seed = 0
+    workdir = None
+    output = None
+    baseline_file = None
+    tolerance = 10.0
+    try:
+        opts, _ = getopt.getopt(
+            argv,
+            "ho:",
+            [
+                "help",
+                "compare=",
+                "jobs=",
+                "output=",
+                "repeat=",
+                "seed=",
+                "sizes=",
+                "tolerance=",
+                "workdir=",
+            ],
+        )
+    except getopt.GetoptError as e:
+        print(f"Argument Error: {e}")
+        print(__doc__)
+        return 2
+    for opt, arg in opts:
+        if opt in ("-h", "--help"):
+            print(__doc__)
+            return 0
+        elif opt == "--compare":
+            baseline_file = arg
+        elif opt == "--jobs":
+            jobs = int(arg)
+        elif opt in ("-o", "--output"):
+            output = arg
+        elif opt == "--repeat":
+            repeat = max(1, int(arg))
+        elif opt == "--seed":
+            seed = int(arg)
+        elif opt == "--sizes":
+            sizes = [int(size) for size in arg.split(",")]
+        elif opt == "--tolerance":
+            tolerance = float(arg)
+        elif opt == "--workdir":
+            workdir = arg
+
+    results: Dict[str, Any] = {
+        "version": __version__,
+        "commit": git_commit(),
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "seed": seed,
+        "jobs": jobs,
+        "startup": {
+            "import_ms": statistics.median(import_times()[0] for _ in range(5))
+        },
+        "results": [],
+    }
+    print(f"import media_manager: {results['startup']['import_ms']:.1f} ms")
+    for files in sizes:
+        runs: Dict[str, List[float]] = {name: [] for name in BENCHMARKS}
+        for _ in range(repeat):
+            directory = tempfile.mkdtemp(prefix="media-manager-bench-", dir=workdir)
+            try:
+                for name, seconds in run_size(files, seed, jobs, directory).items():
+                    runs[name].append(seconds)
+            finally:
+                shutil.rmtree(directory, ignore_errors=True)
+        for name in BENCHMARKS:
+            seconds = statistics.median(runs[name])
+            results["results"].append(
+                {
+                    "benchmark": name,
+                    "files": files,
+                    "seconds": seconds,
+                    "files_per_second": files / seconds if seconds else None,
+                    "runs": runs[name],
+                }
+            )
+            print(
+                f"{name:<16} {files:>7} files: {seconds:9.3f} s "
+                f"({files / seconds if seconds else 0:,.0f} files/s)"
+            )
+
+    if output:
+        with open(output, "w") as output_file:
+            json.dump(results, output_file, indent=2)
+        print(f"Results written to {output}")
+    if baseline_file:
+        with open(baseline_file, "r") as baseline:
+            if compare(results, json.load(baseline), tolerance):
+                return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
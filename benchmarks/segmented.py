@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Segmented encode benchmark for media-manager.
+
+Generates a test video with ffmpeg, then transcodes it to HEVC in one piece
+and with the SegmentedEncoder split into each number of segments, and
+reports the wall time and speedup of each. Segments only pay off with free
+cores, so run it on the machine the library is optimized on.
+
+Usage:
+python benchmarks/segmented.py [--segments 2,4,8] [--duration 600] [--size 1280x720]
+                               [--crf 28] [--preset medium] [--repeat 1]
+                               [--workdir DIRECTORY] [--output FILE]
+"""
+
+import os
+import sys
+import json
+import time
+import getopt
+import shutil
+import tempfile
+import statistics
+from typing import Any, Dict, List
+
+# library puts the repository on the path, so it is imported first
+import library  # noqa: F401
+
+import ffmpeg
+
+from media_manager.probe_cache import ProbeCache
+from media_manager.segmented import SegmentedEncoder
+
+
+def generate_video(path: str, duration: float, size: str) -> None:
+    """
+    Write a test video with moving content and a sine wave audio track.
+
+    Args:
+    - path (str): Path of the video.
+    - duration (float): Length of the video in seconds.
+    - size (str): Frame size, e.g. '1280x720'.
+    """
+    video = ffmpeg.input(f"testsrc2=size={size}:rate=24", f="lavfi", t=duration)
+    audio = ffmpeg.input("sine=frequency=440", f="lavfi", t=duration)
+    ffmpeg.output(
+        video,
+        audio,
+        path,
+        vcodec="libx264",
+        preset="veryfast",
+        crf=18,
+        acodec="aac",
+        audio_bitrate="128k",
+    ).overwrite_output().run(capture_stdout=True, capture_stderr=True)
+
+
+def main(argv: List[str]) -> int:
+    segment_counts = [2, 4, 8]
+    duration = 600.0
+    size = "1280x720"
+    crf = 28
+    preset = "medium"
+    repeat = 1
+    workdir = None
+    output = None
+    try:
+        opts, _ = getopt.getopt(
+            argv,
+            "ho:",
+            [
+                "help",
+                "crf=",
+                "duration=",
+                "output=",
+                "preset=",
+                "repeat=",
+                "segments=",
+                "size=",
+                "workdir=",
+            ],
+        )
+    except getopt.GetoptError as e:
+        print(f"Argument Error: {e}")
+        print(__doc__)
+        return 2
+    for opt, arg in opts:
+        if opt in ("-h", "--help"):
+            print(__doc__)
+            return 0
+        elif opt == "--crf":
+            crf = int(arg)
+        elif opt == "--duration":
+            duration = float(arg)
+        elif opt in ("-o", "--output"):
+            output = arg
+        elif opt == "--preset":
+            preset = arg
+        elif opt == "--repeat":
+            repeat = max(1, int(arg))
+        elif opt == "--segments":
+            segment_counts = [int(count) for count in arg.split(",")]
+        elif opt == "--size":
+            size = arg
+        elif opt == "--workdir":
+            workdir = arg
+
+    directory = tempfile.mkdtemp(prefix="media-manager-segmented-", dir=workdir)
+    probe_cache = ProbeCache()
+    video_parameters = {"c:v": "libx265", "crf": crf, "preset": preset}
+    runs: Dict[int, List[float]] = {count: [] for count in [1] + segment_counts}
+    try:
+        source = os.path.join(directory, "source.mp4")
+        print(f"Generating a {duration:.0f} s {size} test video...")
+        generate_video(source, duration, size)
+        probe = probe_cache.probe(source)
+        destination = os.path.join(directory, "encoded.mp4")
+        for _ in range(repeat):
+            for count in runs:
+                start = time.perf_counter()
+                if count == 1:
+                    ffmpeg.input(source).output(
+                        destination, map=0, c="copy", **video_parameters
+                    ).overwrite_output().run(capture_stdout=True, capture_stderr=True)
+                else:
+                    SegmentedEncoder(segments=count).encode(
+                        source,
+                        destination,
+                        probe,
+                        0,
+                        video_parameters,
+                        {"map": 0, "c": "copy"},
+                        probe_function=probe_cache.probe,
+                    )
+                runs[count].append(time.perf_counter() - start)
+                os.remove(destination)
+    finally:
+        probe_cache.close()
+        shutil.rmtree(directory, ignore_errors=True)
+
+    baseline = statistics.median(runs[1])
+    results: List[Dict[str, Any]] = []
+    for count, times in runs.items():
+        seconds = statistics.median(times)
+        results.append(
+            {
+                "segments": count,
+                "seconds": seconds,
+                "speedup": baseline / seconds,
+                "runs": times,
+            }
+        )
+        print(f"{count:>3} segments {seconds:9.2f} s {baseline / seconds:6.2f}x")
+    if output:
+        with open(output, "w") as output_file:
+            json.dump(
+                {
+                    "duration": duration,
+                    "size": size,
+                    "crf": crf,
+                    "preset": preset,
+                    "cpus": os.cpu_count(),
+                    "results": results,
+                },
+                output_file,
+                indent=2,
+            )
+        print(f"Results written to {output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Startup benchmark for media-manager.
+
+Measures the import time of media_manager.media_manager with
+python -X importtime, and the wall time of running the CLI with --help, in
+fresh interpreters. Fails when the median import time is over budget, or when
+an optional dependency that only music or transcoding runs need is imported.
+
+Usage:
+python benchmarks/startup.py [--runs 10] [--budget-ms 100] [--top 10]
+"""
+
+import os
+import sys
+import getopt
+import statistics
+import subprocess
+import time
+from typing import Dict, List, Tuple
+
+MODULE = "media_manager.media_manager"
+LAZY_MODULES = ("asyncio", "ffmpeg", "http.client", "music_tag", "shazamio")
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_python(code: str, *options: str) -> subprocess.CompletedProcess:
+    """
+    Run code in a fresh interpreter with the repository on the path.
+
+    Args:
+    - code (str): Code to run.
+    - options (str): Interpreter options.
+
+    Returns:
+    - The completed process.
+    """
+    environment = dict(os.environ)
+    environment["PYTHONPATH"] = os.pathsep.join(
+        filter(None, [REPOSITORY, environment.get("PYTHONPATH")])
+    )
+    return subprocess.run(
+        [sys.executable, *options, "-c", code],
+        capture_output=True,
+        text=True,
+        env=environment,
+        cwd=REPOSITORY,
+    )
+
+
+def import_times() -> Tuple[float, Dict[str, float]]:
+    """
+    Import the module once with -X importtime.
+
+    Returns:
+    - Tuple of the cumulative import time of the module in milliseconds, and
+      the self time in milliseconds of every imported module.
+    """
+    result = run_python(f"import {MODULE}", "-X", "importtime")
+    total = 0.0
+    self_times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        fields = line[len("import time:") :].split("|")
+        try:
+            self_time, cumulative = int(fields[0]), int(fields[1])
+        except ValueError:
+            continue
+        name = fields[2].strip()
+        self_times[name] = self_time / 1000
+        if name == MODULE:
+            total = cumulative / 1000
+    return total, self_times
+
+
+def help_time() -> float:
+    """
+    Run the CLI with --help.
+
+    Returns:
+    - Wall time in milliseconds, including interpreter startup.
+    """
+    start = time.perf_counter()
+    run_python(
+        "from media_manager.media_manager import media_manager\n"
+        "try:\n"
+        "    media_manager(['--help'])\n"
+        "except SystemExit:\n"
+        "    pass\n"
+    )
+    return (time.perf_counter() - start) * 1000
+
+
+def loaded_lazy_modules() -> List[str]:
+    """
+    Get the optional dependencies imported along with the module.
+
+    Returns:
+    - Names of the lazily loaded modules found in sys.modules.
+    """
+    result = run_python(
+        f"import sys, {MODULE}\n"
+        f"print(','.join(m for m in {LAZY_MODULES!r} if m in sys.modules))"
+    )
+    return [name for name in result.stdout.strip().split(",") if name]
+
+
+def main(argv: List[str]) -> int:
+    runs = 10
+    budget = 100.0
+    top = 10
+    try:
+        opts, _ = getopt.getopt(argv, "h", ["help", "runs=", "budget-ms=", "top="])
+    except getopt.GetoptError as e:
+        print(f"Argument Error: {e}")
+        print(__doc__)
+        return 2
+    for opt, arg in opts:
+        if opt in ("-h", "--help"):
+            print(__doc__)
+            return 0
+        elif opt == "--runs":
+            runs = int(arg)
+        elif opt == "--budget-ms":
+            budget = float(arg)
+        elif opt == "--top":
+            top = int(arg)
+
+    totals = []
+    self_times: Dict[str, List[float]] = {}
+    for _ in range(runs):
+        total, modules = import_times()
+        totals.append(total)
+        for name, self_time in modules.items():
+            self_times.setdefault(name, []).append(self_time)
+    help_times = [help_time() for _ in range(runs)]
+    import_median = statistics.median(totals)
+    lazy = loaded_lazy_modules()
+
+    print(f"import {MODULE}: median {import_median:.1f} ms, max {max(totals):.1f} ms")
+    print(f"media-manager --help: median {statistics.median(help_times):.1f} ms")
+    print("Slowest modules (median self time):")
+    slowest = sorted(
+        ((statistics.median(times), name) for name, times in self_times.items()),
+        reverse=True,
+    )
+    for self_time, name in slowest[:top]:
+        print(f"\t{self_time:7.2f} ms  {name}")
+
+    failed = False
+    if import_median > budget:
+        print(f"FAIL: import time over the {budget:.0f} ms budget")
+        failed = True
+    if lazy:
+        print(f"FAIL: optional modules imported at startup: {', '.join(lazy)}")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Transfer benchmark for media-manager.
+
+Moves a generated directory of media-sized files from a source directory to a
+target directory, with the copy-then-delete shutil.move() does across file
+systems, and with the TransferEngine serially and in parallel, with and
+without verification. Put the source and target directories on different
+file systems (e.g. /dev/shm and a disk, or a disk and a NAS mount) to measure
+real cross-device moves.
+
+Usage:
+python benchmarks/transfer.py [--files 8] [--size-mb 256] [--jobs 4] [--repeat 1]
+                              [--source-dir DIRECTORY] [--target-dir DIRECTORY]
+                              [--output FILE]
+"""
+
+import os
+import sys
+import json
+import time
+import getopt
+import shutil
+import tempfile
+import statistics
+from typing import Callable, Dict, List
+
+# library puts the repository on the path, so it is imported first
+import library  # noqa: F401
+
+from media_manager.transfer import TransferEngine
+
+
+def generate_files(directory: str, files: int, size: int) -> None:
+    """
+    Write files of random data.
+
+    Args:
+    - directory (str): Directory to write the files in.
+    - files (int): Number of files.
+    - size (int): Size of each file in bytes.
+    """
+    os.makedirs(directory)
+    block = os.urandom(1024 * 1024)
+    for index in range(files):
+        path = os.path.join(directory, f"Episode {index + 1:02d}.mkv")
+        with open(path, "wb") as media_file:
+            written = 0
+            while written < size:
+                media_file.write(block[: min(len(block), size - written)])
+                written += len(block)
+
+
+def shutil_move(source: str, destination: str) -> None:
+    # What shutil.move() does when the rename fails across file systems
+    shutil.copytree(source, destination, symlinks=True)
+    shutil.rmtree(source)
+
+
+def engine_move(jobs: int, verify: bool) -> Callable[[str, str], None]:
+    def move(source: str, destination: str) -> None:
+        TransferEngine(jobs=jobs, verify=verify).move_tree(source, destination)
+
+    return move
+
+
+def main(argv: List[str]) -> int:
+    files = 8
+    size = 256 * 1024 * 1024
+    jobs = 4
+    repeat = 1
+    source_directory = None
+    target_directory = None
+    output = None
+    try:
+        opts, _ = getopt.getopt(
+            argv,
+            "ho:",
+            [
+                "help",
+                "files=",
+                "jobs=",
+                "output=",
+                "repeat=",
+                "size-mb=",
+                "source-dir=",
+                "target-dir=",
+            ],
+        )
+    except getopt.GetoptError as e:
+        print(f"Argument Error: {e}")
+        print(__doc__)
+        return 2
+    for opt, arg in opts:
+        if opt in ("-h", "--help"):
+            print(__doc__)
+            return 0
+        elif opt == "--files":
+            files = int(arg)
+        elif opt == "--jobs":
+            jobs = int(arg)
+        elif opt in ("-o", "--output"):
+            output = arg
+        elif opt == "--repeat":
+            repeat = max(1, int(arg))
+        elif opt == "--size-mb":
+            size = int(float(arg) * 1024 * 1024)
+        elif opt == "--source-dir":
+            source_directory = arg
+        elif opt == "--target-dir":
+            target_directory = arg
+
+    methods = {
+        "shutil.move": shutil_move,
+        "engine, 1 job": engine_move(1, True),
+        f"engine, {jobs} jobs": engine_move(jobs, True),
+        f"engine, {jobs} jobs, no verify": engine_move(jobs, False),
+    }
+    source_root = tempfile.mkdtemp(prefix="media-manager-source-", dir=source_directory)
+    target_root = tempfile.mkdtemp(prefix="media-manager-target-", dir=target_directory)
+    cross_device = os.stat(source_root).st_dev != os.stat(target_root).st_dev
+    total = files * size
+    print(
+        f"Moving {files} files of {size / 1e6:.0f} MB "
+        f"({'across file systems' if cross_device else 'within one file system'})"
+    )
+    runs: Dict[str, List[float]] = {name: [] for name in methods}
+    try:
+        for _ in range(repeat):
+            for name, move in methods.items():
+                source = os.path.join(source_root, "Season")
+                destination = os.path.join(target_root, "Season")
+                generate_files(source, files, size)
+                start = time.perf_counter()
+                move(source, destination)
+                runs[name].append(time.perf_counter() - start)
+                shutil.rmtree(destination)
+    finally:
+        shutil.rmtree(source_root, ignore_errors=True)
+        shutil.rmtree(target_root, ignore_errors=True)
+
+    results = []
+    for name, times in runs.items():
+        seconds = statistics.median(times)
+        results.append(
+            {
+                "method": name,
+                "seconds": seconds,
+                "mb_per_second": total / seconds / 1e6,
+                "runs": times,
+            }
+        )
+        print(f"{name:<28} {seconds:8.3f} s {total / seconds / 1e6:9.1f} MB/s")
+    if output:
+        with open(output, "w") as output_file:
+            json.dump(
+                {
+                    "files": files,
+                    "size": size,
+                    "cross_device": cross_device,
+                    "results": results,
+                },
+                output_file,
+                indent=2,
+            )
+        print(f"Results written to {output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -3,6 +3,7 @@
 
 from media_manager.version import __version__, __author__, __credits__
 from media_manager.media_manager import media_manager, main, MediaManager
+from media_manager.media_job import MediaJob
 
 """
 media-manager
@@ -14,4 +15,4 @@
 __author__ = __author__
 __credits__ = __credits__
 
-__all__ = ["media_manager", "main", "MediaManager"]
+__all__ = ["media_manager", "main", "MediaManager", "MediaJob"]
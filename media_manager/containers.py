@@ -0,0 +1,1186 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import mmap
+import struct
+import zlib
+from fractions import Fraction
+from typing import Any, BinaryIO, Dict, List, Optional, Tuple
+
+
+class ContainerError(ValueError):
+    """
+    Raised when a media file is not a Matroska or MP4 file this module can parse.
+    """
+
+
+# Matroska element IDs
+EBML = 0x1A45DFA3
+SEGMENT = 0x18538067
+SEEK_HEAD = 0x114D9B74
+SEEK = 0x4DBB
+SEEK_ID = 0x53AB
+SEEK_POSITION = 0x53AC
+INFO = 0x1549A966
+TIMESTAMP_SCALE = 0x2AD7B1
+DURATION = 0x4489
+TITLE = 0x7BA9
+TRACKS = 0x1654AE6B
+TRACK_ENTRY = 0xAE
+TRACK_NUMBER = 0xD7
+TRACK_UID = 0x73C5
+TRACK_TYPE = 0x83
+FLAG_DEFAULT = 0x88
+DEFAULT_DURATION = 0x23E383
+NAME = 0x536E
+LANGUAGE = 0x22B59C
+LANGUAGE_BCP47 = 0x22B59D
+CODEC_ID = 0x86
+VIDEO = 0xE0
+PIXEL_WIDTH = 0xB0
+PIXEL_HEIGHT = 0xBA
+AUDIO = 0xE1
+SAMPLING_FREQUENCY = 0xB5
+CHANNELS = 0x9F
+TAGS = 0x1254C367
+TAG = 0x7373
+TARGETS = 0x63C0
+TARGET_TYPE_VALUE = 0x68CA
+TAG_TRACK_UID = 0x63C5
+SIMPLE_TAG = 0x67C8
+TAG_NAME = 0x45A3
+TAG_STRING = 0x4487
+CLUSTER = 0x1F43B675
+VOID = 0xEC
+CRC32 = 0xBF
+UNKNOWN_SIZE = -1
+
+# MP4 padding boxes and the ilst items holding the title and comment
+MP4_FREE_TYPES = (b"free", b"skip")
+MP4_TITLE = b"\xa9nam"
+MP4_COMMENT = b"\xa9cmt"
+
+# Names ffprobe reports for the codecs found in Matroska and MP4 files
+MATROSKA_TRACK_TYPES = {1: "video", 2: "audio", 17: "subtitle"}
+MATROSKA_CODECS = {
+    "V_MPEGH/ISO/HEVC": "hevc",
+    "V_MPEG4/ISO/AVC": "h264",
+    "V_AV1": "av1",
+    "V_VP9": "vp9",
+    "V_VP8": "vp8",
+    "V_MPEG4/ISO/ASP": "mpeg4",
+    "V_MPEG4/ISO/SP": "mpeg4",
+    "V_MPEG4/ISO/AP": "mpeg4",
+    "V_MPEG2": "mpeg2video",
+    "V_MPEG1": "mpeg1video",
+    "V_THEORA": "theora",
+    "A_AAC": "aac",
+    "A_AC3": "ac3",
+    "A_EAC3": "eac3",
+    "A_DTS": "dts",
+    "A_TRUEHD": "truehd",
+    "A_OPUS": "opus",
+    "A_VORBIS": "vorbis",
+    "A_FLAC": "flac",
+    "A_MPEG/L3": "mp3",
+    "A_MPEG/L2": "mp2",
+    "A_PCM/INT/LIT": "pcm_s16le",
+    "S_TEXT/UTF8": "subrip",
+    "S_TEXT/SSA": "ssa",
+    "S_TEXT/ASS": "ass",
+    "S_TEXT/WEBVTT": "webvtt",
+    "S_HDMV/PGS": "hdmv_pgs_subtitle",
+    "S_VOBSUB": "dvd_subtitle",
+    "S_DVBSUB": "dvb_subtitle",
+}
+MP4_HANDLERS = {
+    b"vide": "video",
+    b"soun": "audio",
+    b"sbtl": "subtitle",
+    b"subt": "subtitle",
+    b"text": "subtitle",
+}
+MP4_CODECS = {
+    b"hvc1": "hevc",
+    b"hev1": "hevc",
+    b"avc1": "h264",
+    b"avc3": "h264",
+    b"av01": "av1",
+    b"vp09": "vp9",
+    b"mp4v": "mpeg4",
+    b"ac-3": "ac3",
+    b"ec-3": "eac3",
+    b"Opus": "opus",
+    b"fLaC": "flac",
+    b".mp3": "mp3",
+    b"alac": "alac",
+    b"tx3g": "mov_text",
+    b"wvtt": "webvtt",
+    b"stpp": "ttml",
+    b"c608": "eia_608",
+}
+# MPEG-4 object types of the audio carried in mp4a sample entries
+MP4_OBJECT_TYPES = {
+    0x40: "aac",
+    0x66: "aac",
+    0x67: "aac",
+    0x68: "aac",
+    0x69: "mp3",
+    0x6B: "mp3",
+    0xA5: "ac3",
+    0xA6: "eac3",
+    0xA9: "dts",
+    0xAD: "opus",
+}
+MP4_TAGS = {
+    b"\xa9nam": "title",
+    b"\xa9cmt": "comment",
+    b"\xa9too": "encoder",
+    b"\xa9ART": "artist",
+    b"\xa9alb": "album",
+    b"\xa9day": "date",
+    b"\xa9gen": "genre",
+    b"desc": "description",
+}
+
+
+def set_title_tags(path: str, title: str, comment: Optional[str] = None) -> bool:
+    """
+    Set the title, and optionally the comment, of a Matroska or MP4 file in place.
+
+    Only the header structures that hold the tags are rewritten. Padding
+    (Matroska Void elements, MP4 free boxes) next to them is used to absorb a
+    change in size, and structures at the end of the file are allowed to grow
+    the file. Nothing is written unless every change fits.
+
+    Args:
+    - path (str): Path of the media file.
+    - title (str): Title to set.
+    - comment (Optional[str]): Comment to set, or None to leave it unchanged.
+
+    Returns:
+    - True if the tags were written, False if the header has no room for them.
+
+    Raises:
+    - ContainerError: If the file cannot be read, or is not a Matroska or MP4
+      file that can be parsed.
+    """
+    with open(path, "r+b") as media_file:
+        magic = media_file.read(12)
+        if magic[:4] == b"\x1a\x45\xdf\xa3":
+            writes = _matroska_title_writes(media_file, title, comment)
+        elif magic[4:8] in (b"ftyp", b"moov", b"free", b"skip", b"wide", b"mdat"):
+            writes = _mp4_title_writes(media_file, title, comment)
+        else:
+            raise ContainerError(f"Unsupported container: {path}")
+        if writes is None:
+            return False
+        patches, truncate = writes
+        for offset, data in patches:
+            media_file.seek(offset)
+            media_file.write(data)
+        if truncate is not None:
+            media_file.truncate(truncate)
+        media_file.flush()
+        os.fsync(media_file.fileno())
+    return True
+
+
+def read_container(path: str) -> Dict[str, Any]:
+    """
+    Read the stream and tag information of a Matroska or MP4 file without ffprobe.
+
+    The file is memory mapped and only the header structures are parsed, so
+    this touches a few pages of the file instead of spawning a process.
+
+    Args:
+    - path (str): Path of the media file.
+
+    Returns:
+    - Dictionary in the same format as ffmpeg.probe(), with 'format' and 'streams'.
+
+    Raises:
+    - ContainerError: If the file cannot be read, or is not a Matroska or MP4
+      file that can be parsed.
+    """
+    try:
+        media_file = open(path, "rb")
+    except OSError as e:
+        raise ContainerError(f"Unable to open {path}: {e}")
+    with media_file:
+        try:
+            data = mmap.mmap(media_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, OSError) as e:
+            raise ContainerError(f"Unable to map {path}: {e}")
+        with data:
+            try:
+                if data[:4] == b"\x1a\x45\xdf\xa3":
+                    probe = _read_matroska(data)
+                elif data[4:8] in (
+                    b"ftyp",
+                    b"moov",
+                    b"free",
+                    b"skip",
+                    b"wide",
+                    b"mdat",
+                ):
+                    probe = _read_mp4(data)
+                else:
+                    raise ContainerError(f"Unsupported container: {path}")
+            except ContainerError:
+                raise
+            except (IndexError, ValueError, OSError, struct.error) as e:
+                # ValueError also covers seeks past the end of a truncated file
+                # and UnicodeDecodeError
+                raise ContainerError(f"Unable to parse {path}: {e}")
+            size = len(data)
+    probe["format"]["filename"] = path
+    probe["format"]["nb_streams"] = len(probe["streams"])
+    probe["format"]["size"] = str(size)
+    duration = float(probe["format"].get("duration", 0))
+    if duration > 0:
+        probe["format"]["bit_rate"] = str(int(size * 8 / duration))
+    return probe
+
+
+# EBML helpers
+
+
+def read_vint(data: bytes, position: int, mask: bool = True) -> Tuple[int, int]:
+    """
+    Read an EBML variable length integer.
+
+    Args:
+    - data (bytes): Buffer to read from.
+    - position (int): Offset of the integer.
+    - mask (bool): Strip the length marker, as for sizes. IDs keep it.
+
+    Returns:
+    - Tuple of (value, length in bytes). Sizes with every bit set are UNKNOWN_SIZE.
+    """
+    if position >= len(data):
+        raise ContainerError("Truncated EBML integer")
+    first = data[position]
+    length = 1
+    while length <= 8 and not first & (0x80 >> (length - 1)):
+        length += 1
+    if length > 8 or position + length > len(data):
+        raise ContainerError("Invalid EBML integer")
+    value = int.from_bytes(data[position : position + length], "big")
+    if not mask:
+        return value, length
+    value &= (1 << (7 * length)) - 1
+    if value == (1 << (7 * length)) - 1:
+        return UNKNOWN_SIZE, length
+    return value, length
+
+
+def encode_size(size: int, length: Optional[int] = None) -> bytes:
+    """
+    Encode an EBML element size.
+
+    Args:
+    - size (int): Size to encode.
+    - length (Optional[int]): Number of bytes to use, defaults to the fewest possible.
+
+    Returns:
+    - The encoded size.
+    """
+    if length is None:
+        length = 1
+        while size >= (1 << (7 * length)) - 1:
+            length += 1
+    if length > 8 or size >= (1 << (7 * length)) - 1:
+        raise ContainerError(f"Size {size} does not fit in {length} bytes")
+    return ((1 << (7 * length)) | size).to_bytes(length, "big")
+
+
+def encode_element(
+    element_id: int, data: bytes, size_length: Optional[int] = None
+) -> bytes:
+    """
+    Encode an EBML element.
+
+    Args:
+    - element_id (int): ID of the element, including its length marker.
+    - data (bytes): Content of the element.
+    - size_length (Optional[int]): Number of bytes used for the size.
+
+    Returns:
+    - The encoded element.
+    """
+    return (
+        element_id.to_bytes((element_id.bit_length() + 7) // 8, "big")
+        + encode_size(len(data), size_length)
+        + data
+    )
+
+
+def iter_elements(data: bytes, start: int = 0, end: Optional[int] = None):
+    """
+    Iterate over the EBML elements in a buffer.
+
+    Args:
+    - data (bytes): Buffer holding the elements.
+    - start (int): Offset of the first element.
+    - end (Optional[int]): Offset where the elements end, defaults to the end of the buffer.
+
+    Returns:
+    - Iterator of (id, element offset, data offset, data size) tuples.
+    """
+    end = len(data) if end is None else end
+    position = start
+    while position < end:
+        element_id, id_length = read_vint(data, position, mask=False)
+        size, size_length = read_vint(data, position + id_length)
+        data_start = position + id_length + size_length
+        if size == UNKNOWN_SIZE:
+            size = end - data_start
+        yield element_id, position, data_start, size
+        position = data_start + size
+
+
+def _void(length: int) -> bytes:
+    # Header of a Void element spanning exactly length bytes, which must be 0 or
+    # at least 2. The content of a Void is never read, so it is not written.
+    if length == 0:
+        return b""
+    if length - 2 < 127:
+        return bytes([VOID]) + encode_size(length - 2, 1)
+    return bytes([VOID]) + encode_size(length - 9, 8)
+
+
+def _fit_element(
+    element_id: int, content: bytes, room: Optional[int]
+) -> Optional[bytes]:
+    # Encode an element to fill exactly room bytes, padding with a Void element.
+    # A wider size field absorbs a gap too small to hold a Void.
+    if room is None:
+        return encode_element(element_id, content)
+    for size_length in range(1, 9):
+        try:
+            element = encode_element(element_id, content, size_length)
+        except ContainerError:
+            continue
+        gap = room - len(element)
+        if gap == 0 or gap >= 2:
+            return element + _void(gap)
+        if gap < 0:
+            return None
+    return None
+
+
+def _with_crc(children: List[Tuple[int, bytes]]) -> bytes:
+    # Join child elements, recomputing a leading CRC-32 element if there is one
+    body = b"".join(
+        encode_element(child_id, child)
+        for child_id, child in children
+        if child_id != CRC32
+    )
+    if children and children[0][0] == CRC32:
+        return encode_element(CRC32, struct.pack("<I", zlib.crc32(body))) + body
+    return body
+
+
+def _children(data: bytes) -> List[Tuple[int, bytes]]:
+    return [
+        (element_id, data[data_start : data_start + size])
+        for element_id, _, data_start, size in iter_elements(data)
+    ]
+
+
+class _MatroskaLayout:
+    """
+    Positions of the top level elements of a Matroska segment.
+    """
+
+    def __init__(self, media_file: BinaryIO):
+        media_file.seek(0, os.SEEK_END)
+        self.file_size = media_file.tell()
+        self.media_file = media_file
+        header = self.read(0, 64)
+        element_id, id_length = read_vint(header, 0, mask=False)
+        if element_id != EBML:
+            raise ContainerError("Missing EBML header")
+        size, size_length = read_vint(header, id_length)
+        position = id_length + size_length + size
+        header = self.read(position, 12)
+        element_id, id_length = read_vint(header, 0, mask=False)
+        if element_id != SEGMENT:
+            raise ContainerError("Missing Matroska segment")
+        size, size_length = read_vint(header, id_length)
+        self.segment_size_offset = position + id_length
+        self.segment_size_length = size_length
+        self.segment_start = position + id_length + size_length
+        self.segment_sized = size != UNKNOWN_SIZE
+        self.segment_end = (
+            self.segment_start + size if self.segment_sized else self.file_size
+        )
+        self.elements: List[Tuple[int, int, int, int]] = []
+        self.seek_entries: List[Tuple[int, int]] = []
+        self.seek_head_crc = False
+        self._scan()
+
+    def read(self, offset: int, length: int) -> bytes:
+        self.media_file.seek(offset)
+        return self.media_file.read(length)
+
+    def _scan(self) -> None:
+        # Read top level elements up to the first cluster, then follow the
+        # SeekHead to the ones written after the media data, such as Tags
+        position = self.segment_start
+        while position < self.segment_end:
+            header = self.read(position, 12)
+            if len(header) < 2:
+                break
+            element_id, id_length = read_vint(header, 0, mask=False)
+            size, size_length = read_vint(header, id_length)
+            data_start = position + id_length + size_length
+            if size == UNKNOWN_SIZE:
+                size = self.segment_end - data_start
+            self.elements.append((element_id, position, data_start, size))
+            if element_id == SEEK_HEAD and not self.seek_entries:
+                self._read_seek_head(self.read(data_start, size))
+            if element_id == CLUSTER:
+                break
+            position = data_start + size
+        known = {offset for _, offset, _, _ in self.elements}
+        for element_id, offset in self.seek_entries:
+            if element_id not in (INFO, TRACKS, TAGS):
+                continue
+            if offset in known or offset >= self.file_size:
+                continue
+            header = self.read(offset, 12)
+            found_id, id_length = read_vint(header, 0, mask=False)
+            size, size_length = read_vint(header, id_length)
+            if found_id == element_id and size != UNKNOWN_SIZE:
+                self.elements.append(
+                    (found_id, offset, offset + id_length + size_length, size)
+                )
+        self.elements.sort(key=lambda element: element[1])
+
+    def _read_seek_head(self, data: bytes) -> None:
+        for element_id, _, data_start, size in iter_elements(data):
+            if element_id == CRC32:
+                self.seek_head_crc = True
+            if element_id != SEEK:
+                continue
+            seek_id = seek_position = None
+            for child_id, _, child_start, child_size in iter_elements(
+                data, data_start, data_start + size
+            ):
+                value = data[child_start : child_start + child_size]
+                if child_id == SEEK_ID:
+                    seek_id = int.from_bytes(value, "big")
+                elif child_id == SEEK_POSITION:
+                    seek_position = int.from_bytes(value, "big")
+            if seek_id is not None and seek_position is not None:
+                self.seek_entries.append((seek_id, self.segment_start + seek_position))
+
+    def find(self, element_id: int) -> Optional[Tuple[int, int, int, int]]:
+        for element in self.elements:
+            if element[0] == element_id:
+                return element
+        return None
+
+    def room(self, element: Tuple[int, int, int, int]) -> Tuple[Optional[int], bool]:
+        """
+        Get the bytes an element may be rewritten into: itself plus any Void
+        elements right after it, or unlimited at the end of the file.
+        """
+        _, offset, data_start, size = element
+        end = data_start + size
+        for element_id, other_offset, other_start, other_size in self.elements:
+            if other_offset == end and element_id == VOID:
+                end = other_start + other_size
+        at_end = end >= self.segment_end and self.segment_end >= self.file_size
+        return (None if at_end else end - offset), at_end
+
+
+def _matroska_title_writes(media_file, title, comment):
+    layout = _MatroskaLayout(media_file)
+    info = layout.find(INFO)
+    if info is None:
+        raise ContainerError("Missing Matroska Info element")
+    contents = {INFO: _set_matroska_title(layout.read(info[2], info[3]), title)}
+    values = {"TITLE": title}
+    if comment is not None:
+        values["COMMENT"] = comment
+    tags = layout.find(TAGS)
+    tags_data = _set_matroska_tags(
+        layout.read(tags[2], tags[3]) if tags else b"",
+        values,
+        add=comment is not None,
+    )
+    if tags_data is not None:
+        contents[TAGS] = tags_data
+
+    # Rewrite each element where it is, using the Void space after it
+    patches = []
+    file_end = None
+    for element_id, content in contents.items():
+        element = layout.find(element_id)
+        if element is None:
+            break
+        room, at_end = layout.room(element)
+        encoded = _fit_element(element_id, content, room)
+        if encoded is None:
+            break
+        patches.append((element[1], encoded))
+        if at_end:
+            file_end = element[1] + len(encoded)
+    else:
+        if file_end is not None and file_end != layout.file_size:
+            if layout.segment_sized:
+                patches.append(
+                    (
+                        layout.segment_size_offset,
+                        encode_size(
+                            file_end - layout.segment_start,
+                            layout.segment_size_length,
+                        ),
+                    )
+                )
+            return patches, file_end
+        return patches, None
+    return _repack_matroska_header(layout, contents)
+
+
+def _repack_matroska_header(layout: _MatroskaLayout, contents: dict):
+    # Lay the elements before the first cluster out again, dropping the Void
+    # elements between them and moving changed elements found elsewhere into
+    # the freed space. The SeekHead is rewritten to match.
+    cluster = layout.find(CLUSTER)
+    if cluster is None:
+        return None
+    block_start = layout.segment_start
+    block_end = cluster[1]
+    block = [element for element in layout.elements if element[1] < block_end]
+    seek_head = bool(block) and block[0][0] == SEEK_HEAD
+    if seek_head:
+        block.pop(0)
+    if any(element[0] == SEEK_HEAD for element in block):
+        return None
+    contents = dict(contents)
+    patches = []
+    # Elements of the new block, as [id, encoded element, previous offset]
+    encoded = []
+    for element_id, offset, data_start, size in block:
+        if element_id == VOID:
+            continue
+        if element_id in contents:
+            data = encode_element(element_id, contents.pop(element_id))
+        else:
+            data = layout.read(offset, data_start + size - offset)
+        encoded.append([element_id, data, offset])
+    for element_id, content in contents.items():
+        old = layout.find(element_id)
+        if old is not None:
+            patches.append((old[1], _void(old[2] + old[3] - old[1])))
+        encoded.append(
+            [element_id, encode_element(element_id, content), old and old[1]]
+        )
+
+    seek_entries = list(layout.seek_entries) if seek_head else []
+    seek_entries += [
+        (element_id, block_start) for element_id, _, old in encoded if old is None
+    ]
+    width = max(
+        4,
+        (
+            (
+                max([block_end] + [position for _, position in seek_entries])
+                - block_start
+            ).bit_length()
+            + 7
+        )
+        // 8,
+    )
+
+    def encode_seek_head(entries) -> bytes:
+        children = [(CRC32, b"")] if layout.seek_head_crc else []
+        children += [
+            (
+                SEEK,
+                encode_element(
+                    SEEK_ID, seek_id.to_bytes((seek_id.bit_length() + 7) // 8, "big")
+                )
+                + encode_element(
+                    SEEK_POSITION, (position - block_start).to_bytes(width, "big")
+                ),
+            )
+            for seek_id, position in entries
+        ]
+        return encode_element(SEEK_HEAD, _with_crc(children))
+
+    position = block_start + (len(encode_seek_head(seek_entries)) if seek_head else 0)
+    relocated = {}
+    created = []
+    for element_id, data, old in encoded:
+        if old is None:
+            created.append((element_id, position))
+        else:
+            relocated[old] = position
+        position += len(data)
+    gap = block_end - position
+    if gap < 0:
+        return None
+    if gap == 1:
+        # Too small for a Void, widen the size field of the last element instead
+        element_id, data, _ = encoded[-1]
+        id_length = read_vint(data, 0, mask=False)[1]
+        size, size_length = read_vint(data, id_length)
+        if size_length == 8:
+            return None
+        encoded[-1][1] = encode_element(
+            element_id, data[id_length + size_length :], size_length + 1
+        )
+        gap = 0
+    header = b""
+    if seek_head:
+        header = encode_seek_head(
+            [
+                (seek_id, relocated.get(position, position))
+                for seek_id, position in layout.seek_entries
+            ]
+            + created
+        )
+    header += b"".join(data for _, data, _ in encoded)
+    patches.append((block_start, header + _void(gap)))
+    return patches, None
+
+
+def _set_matroska_title(data: bytes, title: str) -> bytes:
+    # Content of an Info element with its Title set, and any Void space dropped
+    encoded_title = title.encode("utf-8")
+    children = [child for child in _children(data) if child[0] != VOID]
+    if any(child_id == TITLE for child_id, _ in children):
+        children = [
+            (child_id, encoded_title if child_id == TITLE else value)
+            for child_id, value in children
+        ]
+    else:
+        children.append((TITLE, encoded_title))
+    return _with_crc(children)
+
+
+def _set_matroska_tags(data: bytes, values: dict, add: bool) -> Optional[bytes]:
+    # Set global SimpleTags in the content of a Tags element, returning None if
+    # nothing changed. Missing tags are only created when add is set.
+    remaining = dict(values)
+    changed = False
+    tags = []
+    global_tag = None
+    for tag_id, tag_value in _children(data):
+        if tag_id != TAG:
+            if tag_id != VOID:
+                tags.append((tag_id, tag_value))
+            continue
+        tag_children = _children(tag_value)
+        targets = [value for child_id, value in tag_children if child_id == TARGETS]
+        is_global = not targets or all(
+            child_id == TARGET_TYPE_VALUE for child_id, _ in _children(targets[0])
+        )
+        if is_global:
+            new_children = []
+            for child_id, value in tag_children:
+                if child_id == SIMPLE_TAG:
+                    simple_tag = _children(value)
+                    name = (
+                        next((v for i, v in simple_tag if i == TAG_NAME), b"")
+                        .decode("utf-8", "replace")
+                        .upper()
+                    )
+                    if name in remaining:
+                        encoded = remaining.pop(name).encode("utf-8")
+                        if any(i == TAG_STRING and v != encoded for i, v in simple_tag):
+                            changed = True
+                        value = _with_crc(
+                            [
+                                (i, encoded if i == TAG_STRING else v)
+                                for i, v in simple_tag
+                            ]
+                        )
+                new_children.append((child_id, value))
+            tag_children = new_children
+            if global_tag is None:
+                global_tag = len(tags)
+        tags.append((TAG, tag_children))
+    remaining.pop("TITLE", None)
+    if add and remaining:
+        changed = True
+        if global_tag is None:
+            tags.append((TAG, [(TARGETS, b"")]))
+            global_tag = len(tags) - 1
+        for name, value in remaining.items():
+            tags[global_tag][1].append(
+                (
+                    SIMPLE_TAG,
+                    encode_element(TAG_NAME, name.encode("utf-8"))
+                    + encode_element(TAG_STRING, value.encode("utf-8")),
+                )
+            )
+    if not changed:
+        return None
+    return b"".join(
+        encode_element(tag_id, _with_crc(value) if isinstance(value, list) else value)
+        for tag_id, value in tags
+    )
+
+
+# MP4 helpers
+
+
+def read_box_header(data: bytes, position: int, end: int) -> Tuple[bytes, int, int]:
+    """
+    Read the header of an MP4 box.
+
+    Args:
+    - data (bytes): Buffer to read from.
+    - position (int): Offset of the box.
+    - end (int): Offset where the enclosing box ends.
+
+    Returns:
+    - Tuple of (type, total size, header length).
+    """
+    if position + 8 > end:
+        raise ContainerError("Truncated MP4 box")
+    size, box_type = struct.unpack(">I4s", data[position : position + 8])
+    header_length = 8
+    if size == 1:
+        if position + 16 > end:
+            raise ContainerError("Truncated MP4 box")
+        size = struct.unpack(">Q", data[position + 8 : position + 16])[0]
+        header_length = 16
+    elif size == 0:
+        size = end - position
+    if size < header_length or position + size > end:
+        raise ContainerError(f"Invalid MP4 box size for {box_type!r}")
+    return box_type, size, header_length
+
+
+def iter_boxes(data: bytes, start: int = 0, end: Optional[int] = None):
+    """
+    Iterate over the MP4 boxes in a buffer.
+
+    Args:
+    - data (bytes): Buffer holding the boxes.
+    - start (int): Offset of the first box.
+    - end (Optional[int]): Offset where the boxes end, defaults to the end of the buffer.
+
+    Returns:
+    - Iterator of (type, box offset, data offset, data size) tuples.
+    """
+    end = len(data) if end is None else end
+    position = start
+    while position + 8 <= end:
+        box_type, size, header_length = read_box_header(data, position, end)
+        yield box_type, position, position + header_length, size - header_length
+        position += size
+
+
+def encode_box(box_type: bytes, data: bytes) -> bytes:
+    """
+    Encode an MP4 box.
+
+    Args:
+    - box_type (bytes): Four character type of the box.
+    - data (bytes): Content of the box.
+
+    Returns:
+    - The encoded box.
+    """
+    if len(data) + 8 > 0xFFFFFFFF:
+        return struct.pack(">I4sQ", 1, box_type, len(data) + 16) + data
+    return struct.pack(">I4s", len(data) + 8, box_type) + data
+
+
+class _Box:
+    """
+    An MP4 box on the path to the ilst, with its children kept as raw bytes.
+    """
+
+    def __init__(self, box_type: bytes, prefix: bytes = b"", children=None):
+        self.box_type = box_type
+        self.prefix = prefix
+        self.children: List[list] = children if children is not None else []
+
+    @classmethod
+    def parse(cls, box_type: bytes, data: bytes, prefix_length: int = 0) -> "_Box":
+        box = cls(box_type, data[:prefix_length])
+        for child_type, offset, data_start, size in iter_boxes(data, prefix_length):
+            box.children.append([child_type, data[data_start : data_start + size]])
+        return box
+
+    def child(self, box_type: bytes, create=None):
+        for position, (child_type, value) in enumerate(self.children):
+            if child_type == box_type:
+                return position
+        if create is None:
+            return None
+        self.children.append([box_type, create])
+        return len(self.children) - 1
+
+    def encode(self) -> bytes:
+        return self.prefix + b"".join(
+            encode_box(child_type, value.encode() if isinstance(value, _Box) else value)
+            for child_type, value in self.children
+        )
+
+
+def _mp4_item(text: str) -> bytes:
+    # Content of an ilst item holding a single UTF-8 data box
+    return encode_box(b"data", struct.pack(">II", 1, 0) + text.encode("utf-8"))
+
+
+def _mp4_title_writes(media_file, title, comment):
+    media_file.seek(0, os.SEEK_END)
+    file_size = media_file.tell()
+    boxes = []
+    position = 0
+    while position + 8 <= file_size:
+        media_file.seek(position)
+        header = media_file.read(16)
+        box_type, size, header_length = read_box_header(
+            header + b"\x00" * (16 - len(header)), 0, file_size - position
+        )
+        boxes.append((box_type, position, size, header_length))
+        position += size
+    moov = next((box for box in boxes if box[0] == b"moov"), None)
+    if moov is None:
+        raise ContainerError("Missing MP4 moov box")
+    _, moov_offset, moov_size, header_length = moov
+    media_file.seek(moov_offset + header_length)
+    moov_box = _Box.parse(b"moov", media_file.read(moov_size - header_length))
+
+    udta = moov_box.children[moov_box.child(b"udta", create=b"")]
+    udta[1] = _Box.parse(b"udta", udta[1])
+    meta = udta[1].children[udta[1].child(b"meta", create=b"\x00" * 4)]
+    # ISO meta boxes carry a version and flags, QuickTime ones do not
+    prefix_length = 0 if meta[1][4:8] == b"hdlr" else 4
+    meta[1] = _Box.parse(b"meta", meta[1], prefix_length)
+    meta[1].child(
+        b"hdlr",
+        create=b"\x00" * 8 + b"mdirappl" + b"\x00" * 9,
+    )
+    ilst = meta[1].children[meta[1].child(b"ilst", create=b"")]
+    ilst[1] = _Box.parse(b"ilst", ilst[1])
+    items = {MP4_TITLE: title}
+    if comment is not None:
+        items[MP4_COMMENT] = comment
+    for item_type, text in items.items():
+        position = ilst[1].child(item_type, create=b"")
+        ilst[1].children[position][1] = _mp4_item(text)
+
+    new_moov = encode_box(b"moov", moov_box.encode())
+    moov_end = moov_offset + moov_size
+    if moov_end >= file_size:
+        return [(moov_offset, new_moov)], moov_offset + len(new_moov)
+
+    # Free boxes right after the moov can be used, as can the ones inside it
+    room = moov_size
+    for box_type, offset, size, _ in boxes:
+        if offset == moov_offset + room and box_type in MP4_FREE_TYPES:
+            room += size
+    gap = room - len(new_moov)
+    if gap < 0 or 0 < gap < 8:
+        # Resize the free boxes inside the moov, which may shrink down to a bare header
+        free_boxes = [
+            box.children[position]
+            for box in (moov_box, udta[1], meta[1])
+            for position, (child_type, _) in enumerate(box.children)
+            if child_type in MP4_FREE_TYPES
+        ]
+        if gap > 0 and free_boxes:
+            free_boxes[0][1] = b"\x00" * (len(free_boxes[0][1]) + gap)
+            gap = 0
+        for free_box in free_boxes:
+            shrink = min(-gap, len(free_box[1]))
+            free_box[1] = b"\x00" * (len(free_box[1]) - shrink)
+            gap += shrink
+        if gap != 0:
+            return None
+        new_moov = encode_box(b"moov", moov_box.encode())
+    patches = [(moov_offset, new_moov)]
+    if gap:
+        # The content of a free box is never read, so only its header is written
+        patches.append((moov_offset + len(new_moov), struct.pack(">I4s", gap, b"free")))
+    return patches, None
+
+
+# Readers
+
+
+def _frame_rate(frames: int, duration: int, timescale: int) -> str:
+    # Frame rate as a fraction string like ffprobe's avg_frame_rate, snapped to
+    # the nearest common rate such as 24000/1001
+    if not frames or not duration or not timescale:
+        return "0/0"
+    rate = Fraction(frames * timescale, duration).limit_denominator(1001)
+    return f"{rate.numerator}/{rate.denominator}"
+
+
+def _ebml_uint(data: bytes) -> int:
+    return int.from_bytes(data, "big")
+
+
+def _ebml_string(data: bytes) -> str:
+    return data.decode("utf-8").rstrip("\x00")
+
+
+def _ebml_float(data: bytes) -> float:
+    if len(data) == 4:
+        return struct.unpack(">f", data)[0]
+    if len(data) == 8:
+        return struct.unpack(">d", data)[0]
+    return 0.0
+
+
+def _read_matroska(data) -> Dict[str, Any]:
+    layout = _MatroskaLayout(data)
+    info = layout.find(INFO)
+    tracks = layout.find(TRACKS)
+    if info is None or tracks is None:
+        raise ContainerError("Missing Matroska Info or Tracks element")
+    format_tags = {}
+    timestamp_scale = 1000000
+    duration = 0.0
+    for element_id, value in _children(layout.read(info[2], info[3])):
+        if element_id == TITLE:
+            format_tags["title"] = _ebml_string(value)
+        elif element_id == TIMESTAMP_SCALE:
+            timestamp_scale = _ebml_uint(value)
+        elif element_id == DURATION:
+            duration = _ebml_float(value)
+
+    streams = []
+    streams_by_uid = {}
+    for element_id, track in _children(layout.read(tracks[2], tracks[3])):
+        if element_id != TRACK_ENTRY:
+            continue
+        fields = dict(_children(track))
+        codec_type = MATROSKA_TRACK_TYPES.get(_ebml_uint(fields.get(TRACK_TYPE, b"")))
+        if codec_type is None:
+            continue
+        codec_id = _ebml_string(fields.get(CODEC_ID, b""))
+        codec_name = MATROSKA_CODECS.get(codec_id)
+        if codec_name is None and codec_id.startswith("A_AAC"):
+            codec_name = "aac"
+        if codec_name is None:
+            raise ContainerError(f"Unknown Matroska codec: {codec_id}")
+        stream = {
+            "index": len(streams),
+            "codec_name": codec_name,
+            "codec_type": codec_type,
+            "disposition": {"default": _ebml_uint(fields.get(FLAG_DEFAULT, b"\x01"))},
+            "tags": {},
+        }
+        if VIDEO in fields:
+            video = dict(_children(fields[VIDEO]))
+            stream["width"] = _ebml_uint(video.get(PIXEL_WIDTH, b""))
+            stream["height"] = _ebml_uint(video.get(PIXEL_HEIGHT, b""))
+            if DEFAULT_DURATION in fields:
+                stream["avg_frame_rate"] = _frame_rate(
+                    1, _ebml_uint(fields[DEFAULT_DURATION]), 1000000000
+                )
+        if AUDIO in fields:
+            audio = dict(_children(fields[AUDIO]))
+            stream["sample_rate"] = str(
+                int(_ebml_float(audio.get(SAMPLING_FREQUENCY, b"")) or 8000)
+            )
+            stream["channels"] = _ebml_uint(audio.get(CHANNELS, b"\x01"))
+        language = fields.get(LANGUAGE_BCP47) or fields.get(LANGUAGE)
+        if language:
+            stream["tags"]["language"] = _ebml_string(language)
+        if NAME in fields:
+            stream["tags"]["title"] = _ebml_string(fields[NAME])
+        streams.append(stream)
+        if TRACK_UID in fields:
+            streams_by_uid[_ebml_uint(fields[TRACK_UID])] = stream
+
+    tags = layout.find(TAGS)
+    if tags is not None:
+        for element_id, tag in _children(layout.read(tags[2], tags[3])):
+            if element_id != TAG:
+                continue
+            target = format_tags
+            simple_tags = []
+            for child_id, value in _children(tag):
+                if child_id == TARGETS:
+                    for target_id, target_value in _children(value):
+                        if target_id == TAG_TRACK_UID:
+                            stream = streams_by_uid.get(_ebml_uint(target_value))
+                            target = stream["tags"] if stream else {}
+                elif child_id == SIMPLE_TAG:
+                    simple_tags.append(dict(_children(value)))
+            for simple_tag in simple_tags:
+                if TAG_NAME in simple_tag and TAG_STRING in simple_tag:
+                    target.setdefault(
+                        _ebml_string(simple_tag[TAG_NAME]),
+                        _ebml_string(simple_tag[TAG_STRING]),
+                    )
+
+    probe_format = {"format_name": "matroska,webm", "tags": format_tags}
+    if duration:
+        probe_format["duration"] = f"{duration * timestamp_scale / 1e9:.6f}"
+    return {"streams": streams, "format": probe_format}
+
+
+def _box_children(data, start: int, end: int) -> Dict[bytes, List[Tuple[int, int]]]:
+    # Map of box type to the (data offset, data end) of every child box
+    children = {}
+    for box_type, _, data_start, size in iter_boxes(data, start, end):
+        children.setdefault(box_type, []).append((data_start, data_start + size))
+    return children
+
+
+def _box(children, *path: bytes) -> Optional[Tuple[int, int]]:
+    # Follow a path of box types, returning the data range of the first match
+    data, boxes = children
+    found = None
+    for box_type in path:
+        if box_type not in boxes:
+            return None
+        found = boxes[box_type][0]
+        boxes = _box_children(data, *found) if box_type != path[-1] else boxes
+    return found
+
+
+def _read_mp4(data) -> Dict[str, Any]:
+    top = _box_children(data, 0, len(data))
+    if b"moov" not in top:
+        raise ContainerError("Missing MP4 moov box")
+    moov_start, moov_end = top[b"moov"][0]
+    moov = _box_children(data, moov_start, moov_end)
+    format_tags = {}
+    if b"ftyp" in top:
+        start, end = top[b"ftyp"][0]
+        format_tags["major_brand"] = data[start : start + 4].decode("ascii", "replace")
+        format_tags["minor_version"] = str(
+            struct.unpack(">I", data[start + 4 : start + 8])[0]
+        )
+        format_tags["compatible_brands"] = data[start + 8 : end].decode(
+            "ascii", "replace"
+        )
+
+    probe_format = {"format_name": "mov,mp4,m4a,3gp,3g2,mj2", "tags": format_tags}
+    if b"mvhd" in moov:
+        start, _ = moov[b"mvhd"][0]
+        if data[start] == 1:
+            timescale, duration = struct.unpack(">IQ", data[start + 20 : start + 32])
+        else:
+            timescale, duration = struct.unpack(">II", data[start + 12 : start + 20])
+        if timescale:
+            probe_format["duration"] = f"{duration / timescale:.6f}"
+
+    streams = []
+    for trak_start, trak_end in moov.get(b"trak", []):
+        trak = (data, _box_children(data, trak_start, trak_end))
+        hdlr = _box(trak, b"mdia", b"hdlr")
+        mdhd = _box(trak, b"mdia", b"mdhd")
+        stsd = _box(trak, b"mdia", b"minf", b"stbl", b"stsd")
+        if hdlr is None or mdhd is None or stsd is None:
+            raise ContainerError("Incomplete MP4 track")
+        codec_type = MP4_HANDLERS.get(bytes(data[hdlr[0] + 8 : hdlr[0] + 12]))
+        if codec_type is None:
+            continue
+        # The first sample entry describes the codec
+        entry_type, _, entry_start, entry_size = next(
+            iter_boxes(data, stsd[0] + 8, stsd[1])
+        )
+        codec_name = MP4_CODECS.get(entry_type)
+        if entry_type == b"mp4a":
+            codec_name = _mp4a_codec(data, entry_start + 28, entry_start + entry_size)
+        if codec_name is None:
+            raise ContainerError(f"Unknown MP4 codec: {entry_type!r}")
+        if data[mdhd[0]] == 1:
+            timescale, duration = struct.unpack(
+                ">IQ", data[mdhd[0] + 20 : mdhd[0] + 32]
+            )
+            language_offset = mdhd[0] + 32
+        else:
+            timescale, duration = struct.unpack(
+                ">II", data[mdhd[0] + 12 : mdhd[0] + 20]
+            )
+            language_offset = mdhd[0] + 20
+        packed = struct.unpack(">H", data[language_offset : language_offset + 2])[0]
+        language = "".join(
+            chr(((packed >> shift) & 0x1F) + 0x60) for shift in (10, 5, 0)
+        )
+        tkhd = _box(trak, b"tkhd")
+        stream = {
+            "index": len(streams),
+            "codec_name": codec_name,
+            "codec_type": codec_type,
+            "disposition": {
+                "default": int(bool(tkhd and data[tkhd[0] + 3] & 0x01)),
+            },
+            "tags": {"language": language},
+        }
+        if codec_type == "video":
+            stream["width"], stream["height"] = struct.unpack(
+                ">HH", data[entry_start + 24 : entry_start + 28]
+            )
+            stsz = _box(trak, b"mdia", b"minf", b"stbl", b"stsz")
+            if stsz is not None and duration:
+                frames = struct.unpack(">I", data[stsz[0] + 8 : stsz[0] + 12])[0]
+                stream["avg_frame_rate"] = _frame_rate(frames, duration, timescale)
+        elif codec_type == "audio":
+            stream["channels"] = struct.unpack(
+                ">H", data[entry_start + 16 : entry_start + 18]
+            )[0]
+            stream["sample_rate"] = str(
+                struct.unpack(">I", data[entry_start + 24 : entry_start + 28])[0] >> 16
+            )
+        streams.append(stream)
+
+    ilst = _box((data, moov), b"udta", b"meta")
+    if ilst is not None:
+        # ISO meta boxes carry a version and flags, QuickTime ones do not
+        meta_start = (
+            ilst[0] if data[ilst[0] + 4 : ilst[0] + 8] == b"hdlr" else ilst[0] + 4
+        )
+        ilst = _box((data, _box_children(data, meta_start, ilst[1])), b"ilst")
+    if ilst is not None:
+        for item_type, _, item_start, item_size in iter_boxes(data, *ilst):
+            name = MP4_TAGS.get(bytes(item_type))
+            if name is None:
+                continue
+            for box_type, _, value_start, value_size in iter_boxes(
+                data, item_start, item_start + item_size
+            ):
+                if box_type == b"data":
+                    format_tags[name] = bytes(
+                        data[value_start + 8 : value_start + value_size]
+                    ).decode("utf-8")
+                    break
+    return {"streams": streams, "format": probe_format}
+
+
+def _mp4a_codec(data, start: int, end: int) -> Optional[str]:
+    # Codec of an mp4a sample entry, from the object type in its esds box
+    for box_type, _, data_start, size in iter_boxes(data, start, end):
+        if box_type != b"esds":
+            continue
+        position = data_start + 4
+        while position < data_start + size:
+            tag = data[position]
+            position += 1
+            while data[position] & 0x80:
+                position += 1
+            position += 1
+            if tag == 0x03:
+                flags = data[position + 2]
+                position += 3
+                if flags & 0x80:
+                    position += 2
+                if flags & 0x40:
+                    position += 1 + data[position]
+                if flags & 0x20:
+                    position += 2
+            elif tag == 0x04:
+                return MP4_OBJECT_TYPES.get(data[position])
+            else:
+                return None
+    return "aac"
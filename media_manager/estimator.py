@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import tempfile
+from typing import Any, Dict, List, Optional
+
+
+class SizeEstimate:
+    """
+    Projected outcome of transcoding a media file, extrapolated from samples.
+
+    Attributes:
+    - source_size: Size of the media file in bytes.
+    - duration: Length of the media file in seconds.
+    - predicted_size: Projected size of the transcoded file in bytes.
+    - predicted_seconds: Projected wall time of the transcode.
+    - samples: Number of segments encoded.
+    """
+
+    __slots__ = (
+        "source_size",
+        "duration",
+        "predicted_size",
+        "predicted_seconds",
+        "samples",
+    )
+
+    def __init__(
+        self,
+        source_size: int,
+        duration: float,
+        predicted_size: int,
+        predicted_seconds: float,
+        samples: int,
+    ):
+        """
+        Initialize the SizeEstimate.
+
+        Args:
+        - source_size (int): Size of the media file in bytes.
+        - duration (float): Length of the media file in seconds.
+        - predicted_size (int): Projected size of the transcoded file in bytes.
+        - predicted_seconds (float): Projected wall time of the transcode.
+        - samples (int): Number of segments encoded.
+        """
+        self.source_size = source_size
+        self.duration = duration
+        self.predicted_size = predicted_size
+        self.predicted_seconds = predicted_seconds
+        self.samples = samples
+
+    @property
+    def savings(self) -> int:
+        """
+        Projected bytes saved by the transcode, negative if the file grows.
+        """
+        return self.source_size - self.predicted_size
+
+    @property
+    def savings_ratio(self) -> float:
+        """
+        Projected bytes saved as a fraction of the size of the media file.
+        """
+        if not self.source_size:
+            return 0.0
+        return self.savings / self.source_size
+
+    def __str__(self) -> str:
+        return (
+            f"{self.predicted_size / 1e6:.1f} MB projected from "
+            f"{self.source_size / 1e6:.1f} MB ({-self.savings_ratio:+.0%}), "
+            f"{self.predicted_seconds:.0f} s to encode"
+        )
+
+
+def sample_starts(duration: float, samples: int, sample_seconds: float) -> List[float]:
+    """
+    Spread sample segments evenly over a media file, away from its start and
+    end, where intros and credits encode unlike the rest.
+
+    Args:
+    - duration (float): Length of the media file in seconds.
+    - samples (int): Number of segments.
+    - sample_seconds (float): Length of each segment in seconds.
+
+    Returns:
+    - Start of each segment in seconds.
+    """
+    return [
+        max(0.0, duration * (index + 1) / (samples + 1) - sample_seconds / 2)
+        for index in range(samples)
+    ]
+
+
+class SizeEstimator:
+    """
+    Pre-flight estimator deciding whether transcoding a media file pays off.
+
+    A few short segments of the file are encoded with the same parameters as
+    the full transcode, and their size and encode time are extrapolated to
+    the length of the file. The transcode is worth it when the projected
+    savings reach either threshold. Files too short for the samples to save
+    time are always transcoded.
+
+    Attributes:
+    - samples: Number of segments encoded.
+    - sample_seconds: Length of each segment in seconds.
+    - min_savings_ratio: Fraction of the size to save for a transcode to be
+      worth it, or None.
+    - min_savings_bytes: Bytes to save for a transcode to be worth it, or None.
+    """
+
+    def __init__(
+        self,
+        samples: int = 3,
+        sample_seconds: float = 10.0,
+        min_savings_ratio: Optional[float] = None,
+        min_savings_bytes: Optional[int] = None,
+    ):
+        """
+        Initialize the SizeEstimator.
+
+        Args:
+        - samples (int): Number of segments encoded.
+        - sample_seconds (float): Length of each segment in seconds.
+        - min_savings_ratio (Optional[float]): Fraction of the size to save, e.g. 0.2.
+        - min_savings_bytes (Optional[int]): Bytes to save.
+        """
+        self.samples = samples
+        self.sample_seconds = sample_seconds
+        self.min_savings_ratio = min_savings_ratio
+        self.min_savings_bytes = min_savings_bytes
+
+    @property
+    def enabled(self) -> bool:
+        """
+        Flag indicating whether a savings threshold is set.
+        """
+        return self.min_savings_ratio is not None or self.min_savings_bytes is not None
+
+    def estimate(
+        self, path: str, probe: Dict[str, Any], output_parameters: Dict[str, Any]
+    ) -> Optional[SizeEstimate]:
+        """
+        Encode samples of a media file and extrapolate the transcode.
+
+        Args:
+        - path (str): Path of the media file.
+        - probe (Dict[str, Any]): ffprobe result of the media file.
+        - output_parameters (Dict[str, Any]): ffmpeg output parameters of the transcode.
+
+        Returns:
+        - The SizeEstimate, or None if the file is too short to sample.
+
+        Raises:
+        - ffmpeg.Error: If a sample fails to encode.
+        """
+        import ffmpeg
+
+        try:
+            duration = float(probe["format"]["duration"])
+        except (KeyError, TypeError, ValueError):
+            return None
+        # Below this, the samples would cost a good part of the transcode
+        if duration < self.samples * self.sample_seconds * 4:
+            return None
+        source_size = os.path.getsize(path)
+        handle, sample_path = tempfile.mkstemp(
+            prefix="media-manager-sample-", suffix=os.path.splitext(path)[1]
+        )
+        os.close(handle)
+        sample_size = 0
+        sample_time = 0.0
+        try:
+            for start in sample_starts(duration, self.samples, self.sample_seconds):
+                started = time.perf_counter()
+                ffmpeg.input(path, ss=start, t=self.sample_seconds).output(
+                    sample_path, **output_parameters
+                ).overwrite_output().run(capture_stdout=True, capture_stderr=True)
+                sample_time += time.perf_counter() - started
+                sample_size += os.path.getsize(sample_path)
+        finally:
+            os.remove(sample_path)
+        sampled = self.samples * self.sample_seconds
+        return SizeEstimate(
+            source_size=source_size,
+            duration=duration,
+            predicted_size=int(sample_size / sampled * duration),
+            predicted_seconds=sample_time / sampled * duration,
+            samples=self.samples,
+        )
+
+    def worth_it(self, estimate: SizeEstimate) -> bool:
+        """
+        Check whether the projected savings of a transcode reach either threshold.
+
+        Args:
+        - estimate (SizeEstimate): Projected outcome of the transcode.
+
+        Returns:
+        - True if the file should be transcoded.
+        """
+        if (
+            self.min_savings_ratio is not None
+            and estimate.savings_ratio >= self.min_savings_ratio
+        ):
+            return True
+        if (
+            self.min_savings_bytes is not None
+            and estimate.savings >= self.min_savings_bytes
+        ):
+            return True
+        return False
@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import re
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+# Causes of an ffmpeg failure, by the messages ffmpeg writes to stderr. The
+# first pattern matching wins, so the more specific causes come first.
+FAILURE_PATTERNS: List[Tuple[str, Tuple[str, ...]]] = [
+    ("interrupted", (r"received signal", r"received > 3 system signals")),
+    ("disk_full", (r"no space left on device", r"disk quota exceeded")),
+    ("permission", (r"permission denied", r"read-only file system")),
+    ("encoder", (r"unknown encoder", r"encoder not found")),
+    (
+        "subtitle",
+        (
+            r"subtitle encoding currently only possible from text to text or bitmap to bitmap",
+            r"subtitle codec \S+ is not supported",
+            r"could not find tag for codec (?:subrip|ass|ssa|webvtt|mov_text"
+            r"|hdmv_pgs_subtitle|dvd_subtitle|dvb_subtitle)",
+            r"\.(?:srt|ass|ssa|vtt)'?: invalid data found when processing input",
+            r"error opening input file .*\.(?:srt|ass|ssa|vtt)\.",
+            r"subtitle streams other than .* not implemented",
+        ),
+    ),
+    (
+        "container",
+        (
+            r"could not find tag for codec",
+            r"codec not currently supported in container",
+            r"not supported in container",
+            r"incompatible with output codec id",
+            r"could not write header",
+        ),
+    ),
+    ("mapping", (r"matches no streams", r"invalid stream specifier")),
+    (
+        "input",
+        (
+            r"invalid data found when processing input",
+            r"moov atom not found",
+            r"no such file or directory",
+            r"error while decoding stream",
+            r"invalid nal unit size",
+        ),
+    ),
+]
+# Causes no command can work around
+ENVIRONMENT_FAILURES = ("interrupted", "disk_full", "permission", "encoder")
+# What to try next for each cause, in order; causes not listed are final,
+# no other command can fix a full disk or a corrupt source
+FALLBACKS = {
+    "subtitle": ("without_subtitles",),
+    "container": ("media_streams", "encode"),
+    "mapping": ("media_streams",),
+    "unknown": ("encode",),
+}
+# Parameters selecting codecs, replaced when falling back to an encode
+CODEC_PARAMETER = re.compile(r"^(?:c|codec|vcodec|acodec)(?::[va](?::\d+)?)?$")
+
+
+def classify_failure(stderr: Optional[bytes]) -> str:
+    """
+    Classify the cause of an ffmpeg failure from its error output.
+
+    Args:
+    - stderr (Optional[bytes]): Error output of ffmpeg.
+
+    Returns:
+    - Cause of the failure: 'interrupted', 'disk_full', 'permission',
+      'encoder', 'subtitle', 'container', 'mapping', 'input' or 'unknown'.
+    """
+    text = (stderr or b"").decode("utf-8", errors="replace").casefold()
+    for cause, patterns in FAILURE_PATTERNS:
+        for pattern in patterns:
+            if re.search(pattern, text):
+                return cause
+    return "unknown"
+
+
+def last_line(error: Exception) -> str:
+    """
+    Get the last line ffmpeg wrote before failing, which names the error.
+
+    Args:
+    - error (Exception): ffmpeg.Error, or any other exception.
+
+    Returns:
+    - The last line of the error output, or the exception as text.
+    """
+    stderr = getattr(error, "stderr", None) or b""
+    lines = stderr.decode("utf-8", errors="replace").strip().splitlines()
+    return lines[-1] if lines else str(error)
+
+
+class FfmpegJob:
+    """
+    Every change one media file needs, written by a single ffmpeg run.
+
+    Tags, codec changes and the subtitle files to add are collected into one
+    command, instead of rewriting the file once per change. When the run
+    fails, fallback() gives the command to try next for the cause of the
+    failure, so a command is only retried when a different strategy can
+    succeed.
+
+    Attributes:
+    - source: Path of the media file.
+    - destination: Path ffmpeg writes the new file to.
+    - parameters: ffmpeg output parameters: tags, codecs and their settings.
+    - subtitles: (language code, path) of each subtitle file to add.
+    - subtitle_codec: Codec of the subtitles added, e.g. 'mov_text' for MP4.
+    - subtitle_offset: Number of subtitle streams of the file itself.
+    - encode_parameters: Codec parameters of the full encode fallen back to.
+    - strategy: Strategies applied so far, e.g. ['plan', 'media_streams'].
+    - media_streams_only: Flag indicating whether only video, audio and
+      subtitle streams are kept, leaving out data streams and attachments.
+    """
+
+    def __init__(
+        self,
+        source: str,
+        destination: str,
+        parameters: Dict[str, Any],
+        subtitles: Sequence[Tuple[str, str]] = (),
+        subtitle_codec: Optional[str] = None,
+        subtitle_offset: int = 0,
+        encode_parameters: Optional[Dict[str, Any]] = None,
+    ):
+        """
+        Initialize the FfmpegJob.
+
+        Args:
+        - source (str): Path of the media file.
+        - destination (str): Path ffmpeg writes the new file to.
+        - parameters (Dict[str, Any]): ffmpeg output parameters. Streams are
+          mapped by the job, so 'map' is ignored.
+        - subtitles (Sequence[Tuple[str, str]]): (language code, path) of each
+          subtitle file to add.
+        - subtitle_codec (Optional[str]): Codec of the subtitles added.
+        - subtitle_offset (int): Number of subtitle streams of the file itself.
+        - encode_parameters (Optional[Dict[str, Any]]): Codec parameters of the
+          full encode to fall back to, or None to never fall back to one.
+        """
+        self.source = source
+        self.destination = destination
+        self.parameters = {
+            key: value for key, value in parameters.items() if key != "map"
+        }
+        self.subtitles = list(subtitles)
+        self.subtitle_codec = subtitle_codec
+        self.subtitle_offset = subtitle_offset
+        self.encode_parameters = encode_parameters
+        self.strategy = ["plan"]
+        self.media_streams_only = False
+
+    @property
+    def encodes_video(self) -> bool:
+        """
+        Flag indicating whether the video is encoded rather than copied.
+        """
+        return any(
+            value != "copy"
+            for key, value in self.parameters.items()
+            if key in ("vcodec", "c:v") or key.startswith("c:v:")
+        )
+
+    def build(self) -> Any:
+        """
+        Build the ffmpeg command.
+
+        Returns:
+        - Output of the ffmpeg command, see ffmpeg.output().
+        """
+        import ffmpeg
+
+        source = ffmpeg.input(self.source)
+        if self.media_streams_only:
+            streams = [source["v?"], source["a?"], source["s?"]]
+        else:
+            streams = [source]
+        parameters = dict(self.parameters)
+        for index, (language, path) in enumerate(self.subtitles):
+            streams.append(ffmpeg.input(path)["s"])
+            parameters[f"metadata:s:s:{self.subtitle_offset + index}"] = (
+                f"language={language}"
+            )
+        if self.subtitles and self.subtitle_codec:
+            parameters["scodec"] = self.subtitle_codec
+        return ffmpeg.output(*streams, self.destination, **parameters)
+
+    def fallback(self, failure: str) -> Optional["FfmpegJob"]:
+        """
+        Get the command to try after a failure.
+
+        Args:
+        - failure (str): Cause of the failure, see classify_failure().
+
+        Returns:
+        - The FfmpegJob to run next, or None if no other strategy can succeed.
+        """
+        for strategy in FALLBACKS.get(failure, ()):
+            if strategy in self.strategy:
+                continue
+            job = FfmpegJob(
+                self.source,
+                self.destination,
+                self.parameters,
+                subtitles=self.subtitles,
+                subtitle_codec=self.subtitle_codec,
+                subtitle_offset=self.subtitle_offset,
+                encode_parameters=self.encode_parameters,
+            )
+            job.strategy = self.strategy + [strategy]
+            job.media_streams_only = self.media_streams_only
+            if strategy == "without_subtitles":
+                if not self.subtitles and not self.subtitle_offset:
+                    continue
+                # Drop the subtitles that could not be written, added or copied
+                job.subtitles = []
+                job.parameters["sn"] = None
+            elif strategy == "media_streams":
+                if self.media_streams_only:
+                    continue
+                job.media_streams_only = True
+            elif strategy == "encode":
+                if self.encode_parameters is None:
+                    continue
+                job.parameters = {
+                    key: value
+                    for key, value in self.parameters.items()
+                    if not CODEC_PARAMETER.match(key)
+                }
+                job.parameters.update(self.encode_parameters)
+            return job
+        return None
+
+    def __str__(self) -> str:
+        return " + ".join(self.strategy)
@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import time
+import uuid
+import socket
+import threading
+import contextlib
+from typing import Any, Dict, Iterator, Optional
+
+
+class Lease:
+    """
+    A job leased by a worker from a JobQueue.
+
+    Attributes:
+    - job_id: ID of the job.
+    - path: Path of the lease file, touched by heartbeats.
+    - spec: Job specification, as submitted.
+    - lost: Event set once the lease is found to be reclaimed by another host,
+      which then runs the job again.
+    """
+
+    __slots__ = ("job_id", "path", "spec", "lost")
+
+    def __init__(self, job_id: str, path: str, spec: Dict[str, Any]):
+        """
+        Initialize the Lease.
+
+        Args:
+        - job_id (str): ID of the job.
+        - path (str): Path of the lease file.
+        - spec (Dict[str, Any]): Job specification.
+        """
+        self.job_id = job_id
+        self.path = path
+        self.spec = spec
+        self.lost = threading.Event()
+
+    def __repr__(self) -> str:
+        return f"Lease({self.job_id!r})"
+
+
+class JobQueue:
+    """
+    Durable job queue kept as files in a directory on a shared file system.
+
+    Several hosts mounting the same directory can share the queue without a
+    broker. Every state change is an atomic rename, so exactly one worker
+    wins a job: submitted jobs wait in pending/, a worker leases one by
+    renaming it into leased/ and touches the lease as a heartbeat while it
+    works, and writes the outcome to results/. A lease that has not been
+    touched within the lease timeout belongs to a worker that crashed or
+    lost the mount; any host may then put the job back in pending/, up to a
+    maximum number of attempts. Ages are measured against the clock of the
+    file system rather than of the host, so hosts need not agree on time.
+
+    A worker cut off long enough to lose its lease must stop working on the
+    job, as the host that reclaimed it runs it again: the lease is checked
+    before each change the job makes, see heartbeat(), and the outcome of a
+    lost lease is dropped by complete().
+
+    Attributes:
+    - directory: Directory of the queue.
+    - worker_id: ID of this host and process in lease file names.
+    - lease_timeout: Seconds without a heartbeat after which a lease expires.
+    - heartbeat_interval: Seconds between heartbeats of a lease held.
+    - max_attempts: Number of leases a job may expire in before it fails.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        lease_timeout: float = 120.0,
+        heartbeat_interval: float = 15.0,
+        max_attempts: int = 3,
+    ):
+        """
+        Open, or create, a queue.
+
+        Args:
+        - directory (str): Directory of the queue, on the shared file system.
+        - lease_timeout (float): Seconds without a heartbeat after which a lease expires.
+        - heartbeat_interval (float): Seconds between heartbeats of a lease held.
+        - max_attempts (int): Number of leases a job may expire in before it fails.
+        """
+        self.directory = os.path.abspath(directory)
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}"
+        self.lease_timeout = lease_timeout
+        self.heartbeat_interval = heartbeat_interval
+        self.max_attempts = max_attempts
+        for name in ("pending", "leased", "reclaim", "results", "tmp"):
+            os.makedirs(os.path.join(self.directory, name), exist_ok=True)
+
+    def _path(self, state: str, name: str) -> str:
+        return os.path.join(self.directory, state, name)
+
+    def _write(self, path: str, data: Dict[str, Any]) -> None:
+        # Written aside and renamed in, so readers never see a partial file
+        temporary = self._path("tmp", f"{uuid.uuid4().hex}.json")
+        with open(temporary, "w") as temporary_file:
+            json.dump(data, temporary_file)
+            temporary_file.flush()
+            os.fsync(temporary_file.fileno())
+        os.replace(temporary, path)
+
+    def now(self) -> float:
+        """
+        Read the current time of the file system clock.
+
+        Returns:
+        - Seconds since the epoch, as the file system stamps modifications.
+        """
+        clock = self._path("tmp", f"clock-{self.worker_id}")
+        with open(clock, "w"):
+            pass
+        try:
+            return os.stat(clock).st_mtime
+        finally:
+            os.remove(clock)
+
+    def submit(self, spec: Dict[str, Any]) -> str:
+        """
+        Submit a job.
+
+        Args:
+        - spec (Dict[str, Any]): Job specification, serializable as JSON.
+
+        Returns:
+        - ID of the job.
+        """
+        # IDs sort in submission order, so jobs are leased first in first out
+        job_id = f"{time.time_ns():020d}-{uuid.uuid4().hex[:12]}"
+        self._write(
+            self._path("pending", f"{job_id}.json"), {"attempts": 0, "spec": spec}
+        )
+        return job_id
+
+    def lease(self) -> Optional[Lease]:
+        """
+        Lease the oldest pending job, reclaiming expired leases first.
+
+        Returns:
+        - The Lease, or None if no job is pending.
+        """
+        self.reclaim_expired()
+        for name in sorted(os.listdir(os.path.join(self.directory, "pending"))):
+            if not name.endswith(".json"):
+                continue
+            job_id = name[: -len(".json")]
+            pending = self._path("pending", name)
+            path = self._path("leased", f"{job_id}@{self.worker_id}.json")
+            try:
+                # Touched before the rename, so the lease never shows up in
+                # leased/ with the age of the pending job and looks expired
+                os.utime(pending, None)
+                os.rename(pending, path)
+                with open(path, "r") as lease_file:
+                    spec = json.load(lease_file)["spec"]
+            except FileNotFoundError:
+                # Another worker won this job, or reclaimed the lease already
+                continue
+            return Lease(job_id, path, spec)
+        return None
+
+    def heartbeat(self, lease: Lease) -> bool:
+        """
+        Renew a lease, checking it is still held.
+
+        Args:
+        - lease (Lease): Lease held.
+
+        Returns:
+        - False if the lease expired and was reclaimed meanwhile, in which case
+          lease.lost is set.
+        """
+        if lease.lost.is_set():
+            return False
+        try:
+            os.utime(lease.path, None)
+        except FileNotFoundError:
+            lease.lost.set()
+            return False
+        return True
+
+    @contextlib.contextmanager
+    def hold(self, lease: Lease) -> Iterator[Lease]:
+        """
+        Renew a lease in the background while the block runs.
+
+        If the lease is lost, lease.lost is set and the block is expected to
+        stop its work.
+
+        Args:
+        - lease (Lease): Lease held.
+
+        Returns:
+        - Context manager yielding the lease.
+        """
+        stop = threading.Event()
+
+        def beat() -> None:
+            while not stop.wait(self.heartbeat_interval):
+                if not self.heartbeat(lease):
+                    return
+
+        thread = threading.Thread(target=beat, daemon=True)
+        thread.start()
+        try:
+            yield lease
+        finally:
+            stop.set()
+            thread.join()
+
+    def complete(self, lease: Lease, result: Dict[str, Any]) -> bool:
+        """
+        Report the outcome of a job and end its lease.
+
+        Args:
+        - lease (Lease): Lease of the job.
+        - result (Dict[str, Any]): Outcome of the job, serializable as JSON.
+
+        Returns:
+        - False if the lease was lost, in which case the outcome is dropped,
+          as the job belongs to the host that reclaimed it.
+        """
+        if not self.heartbeat(lease):
+            return False
+        path = self._path("results", f"{lease.job_id}.json")
+        if not os.path.exists(path):
+            self._write(path, {"worker": self.worker_id, **result})
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(lease.path)
+        return True
+
+    def release(self, lease: Lease) -> None:
+        """
+        Give a job back unfinished, e.g. when the worker is stopped.
+
+        Args:
+        - lease (Lease): Lease of the job.
+        """
+        with contextlib.suppress(FileNotFoundError):
+            os.rename(lease.path, self._path("pending", f"{lease.job_id}.json"))
+
+    def reclaim_expired(self) -> int:
+        """
+        Put the jobs of expired leases back in the queue, or fail them once
+        they used up their attempts.
+
+        Returns:
+        - Number of leases reclaimed.
+        """
+        reclaimed = 0
+        now = self.now()
+        for name in os.listdir(os.path.join(self.directory, "leased")):
+            path = self._path("leased", name)
+            try:
+                if now - os.stat(path).st_mtime < self.lease_timeout:
+                    continue
+                # Only one host wins the rename, so a job is reclaimed once
+                claimed = self._path("reclaim", name)
+                os.rename(path, claimed)
+            except FileNotFoundError:
+                continue
+            job_id, _, worker_id = name[: -len(".json")].partition("@")
+            with open(claimed, "r") as claimed_file:
+                job = json.load(claimed_file)
+            job["attempts"] += 1
+            if job["attempts"] >= self.max_attempts:
+                self._write(
+                    self._path("results", f"{job_id}.json"),
+                    {
+                        "worker": worker_id,
+                        "failed": True,
+                        "error": f"Lease expired {job['attempts']} times",
+                    },
+                )
+            else:
+                self._write(self._path("pending", f"{job_id}.json"), job)
+            os.remove(claimed)
+            reclaimed += 1
+        return reclaimed
+
+    def result(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Get the outcome of a job.
+
+        Args:
+        - job_id (str): ID of the job.
+
+        Returns:
+        - The outcome, or None if the job is not finished.
+        """
+        try:
+            with open(self._path("results", f"{job_id}.json"), "r") as result_file:
+                return json.load(result_file)
+        except FileNotFoundError:
+            return None
+
+    def wait(self, job_id: str, poll_interval: float = 1.0) -> Dict[str, Any]:
+        """
+        Wait for the outcome of a job and remove it from the queue, reclaiming
+        expired leases meanwhile.
+
+        Args:
+        - job_id (str): ID of the job.
+        - poll_interval (float): Seconds between checks.
+
+        Returns:
+        - The outcome of the job.
+        """
+        last_reclaim = 0.0
+        while True:
+            result = self.result(job_id)
+            if result is not None:
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(self._path("results", f"{job_id}.json"))
+                return result
+            if time.monotonic() - last_reclaim >= self.heartbeat_interval:
+                self.reclaim_expired()
+                last_reclaim = time.monotonic()
+            time.sleep(poll_interval)
@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+
+class MediaEntry:
+    """
+    A single media file tracked by the MediaIndex.
+
+    Attributes:
+    - path: Current normalized path of the media file.
+    - completed: Flag indicating whether the file has been processed.
+    - removed: Flag indicating whether the file has left the index.
+    """
+
+    __slots__ = ("path", "completed", "removed")
+
+    def __init__(self, path: str):
+        self.path = path
+        self.completed = False
+        self.removed = False
+
+    @property
+    def directory(self) -> str:
+        return os.path.dirname(self.path)
+
+    def __repr__(self) -> str:
+        return f"MediaEntry({self.path!r}, completed={self.completed})"
+
+
+class MediaIndex:
+    """
+    In-memory index of the media files discovered in a single run.
+
+    The index is built once by a scan and then updated in place by the rename,
+    merge, move and transcode steps, so the source tree never has to be
+    rescanned while media is being processed. Entries keep their discovery
+    order, and every entry is handed out by pending() exactly once. The index
+    can also be filled lazily from a streaming scan, see stream().
+
+    Attributes:
+    - total: Number of media files added to the index.
+    - completed: Number of media files marked as completed.
+    - on_batch: Called with the entries added from each batch of a streaming
+      scan, or None.
+    """
+
+    def __init__(self):
+        """
+        Initialize an empty MediaIndex.
+        """
+        self._entries: List[MediaEntry] = []
+        self._by_path: Dict[str, MediaEntry] = {}
+        self._by_directory: Dict[str, Dict[str, MediaEntry]] = {}
+        self._source: Optional[Iterator[Iterable[str]]] = None
+        self.total = 0
+        self.completed = 0
+        self.on_batch: Optional[Callable[[List[MediaEntry]], Any]] = None
+
+    def __len__(self) -> int:
+        return len(self._by_path)
+
+    def __contains__(self, path: str) -> bool:
+        return os.path.normpath(path) in self._by_path
+
+    def __bool__(self) -> bool:
+        return bool(self._by_path)
+
+    def get(self, path: str) -> Optional[MediaEntry]:
+        """
+        Get the entry for a media file.
+
+        Args:
+        - path (str): Path of the media file.
+
+        Returns:
+        - The MediaEntry, or None if the path is not indexed.
+        """
+        return self._by_path.get(os.path.normpath(path))
+
+    def add(self, path: str) -> Optional[MediaEntry]:
+        """
+        Add a media file to the index.
+
+        Args:
+        - path (str): Path of the media file.
+
+        Returns:
+        - The new MediaEntry, or None if the path was already indexed.
+        """
+        path = os.path.normpath(path)
+        if path in self._by_path:
+            return None
+        entry = MediaEntry(path)
+        self._entries.append(entry)
+        self._link(entry)
+        self.total += 1
+        return entry
+
+    def remove(self, path: str) -> None:
+        """
+        Remove a media file from the index.
+
+        Args:
+        - path (str): Path of the media file.
+        """
+        entry = self._by_path.get(os.path.normpath(path))
+        if entry is None:
+            return
+        self._unlink(entry)
+        entry.removed = True
+
+    def complete(self, path: str) -> None:
+        """
+        Mark a media file as completed so it is not handed out again.
+
+        Args:
+        - path (str): Path of the media file.
+        """
+        entry = self._by_path.get(os.path.normpath(path))
+        if entry is not None and not entry.completed:
+            entry.completed = True
+            self.completed += 1
+
+    def relocate(self, old_path: str, new_path: str) -> None:
+        """
+        Record that a media file was renamed or moved.
+
+        Args:
+        - old_path (str): Previous path of the media file.
+        - new_path (str): New path of the media file.
+        """
+        old_path = os.path.normpath(old_path)
+        new_path = os.path.normpath(new_path)
+        entry = self._by_path.get(old_path)
+        if entry is None or old_path == new_path:
+            return
+        self._unlink(entry)
+        entry.path = new_path
+        self._link(entry)
+
+    def relocate_directory(self, old_directory: str, new_directory: str) -> None:
+        """
+        Record that a directory, and everything beneath it, was renamed or moved.
+
+        Args:
+        - old_directory (str): Previous path of the directory.
+        - new_directory (str): New path of the directory.
+        """
+        old_directory = os.path.normpath(old_directory)
+        new_directory = os.path.normpath(new_directory)
+        if old_directory == new_directory:
+            return
+        for entry in self._entries_under(old_directory):
+            self._unlink(entry)
+            entry.path = new_directory + entry.path[len(old_directory) :]
+            self._link(entry)
+
+    def remove_directory(self, directory: str) -> None:
+        """
+        Remove every media file in, or beneath, a directory from the index.
+
+        Args:
+        - directory (str): Path of the directory.
+        """
+        for entry in self._entries_under(os.path.normpath(directory)):
+            self._unlink(entry)
+            entry.removed = True
+
+    def stream(self, source: Iterator[Iterable[str]]) -> None:
+        """
+        Attach a lazy source of media file paths.
+
+        The source yields batches of paths, normally one batch per scanned
+        directory. Batches are only pulled when pending() runs out of entries,
+        so processing can start before the scan has finished.
+
+        Args:
+        - source (Iterator[Iterable[str]]): Iterator of path batches.
+        """
+        self._source = source
+
+    def drain(self) -> None:
+        """
+        Pull every remaining batch from the attached source into the index.
+        """
+        while self._pull():
+            pass
+
+    @property
+    def streaming(self) -> bool:
+        return self._source is not None
+
+    def pending(self) -> Iterator[MediaEntry]:
+        """
+        Iterate over media files that have not been processed yet.
+
+        Entries added while iterating are picked up, and entries completed or
+        removed while iterating are skipped.
+
+        Returns:
+        - Iterator of pending MediaEntry objects, in discovery order.
+        """
+        position = 0
+        while position < len(self._entries) or self._pull():
+            entry = self._entries[position]
+            position += 1
+            if not entry.completed and not entry.removed:
+                yield entry
+
+    def paths(self) -> List[str]:
+        """
+        Get the paths of all pending media files found so far.
+
+        Returns:
+        - List of media file paths.
+        """
+        return [
+            entry.path
+            for entry in self._entries
+            if not entry.completed and not entry.removed
+        ]
+
+    def completed_paths(self) -> List[str]:
+        """
+        Get the paths of all completed media files.
+
+        Returns:
+        - List of media file paths.
+        """
+        return [
+            entry.path
+            for entry in self._entries
+            if entry.completed and not entry.removed
+        ]
+
+    def directories(self) -> List[str]:
+        """
+        Get the directories that contain indexed media files.
+
+        Returns:
+        - Sorted list of directory paths.
+        """
+        return sorted(self._by_directory)
+
+    def files_in_directory(self, directory: str) -> List[str]:
+        """
+        Get the indexed media files directly inside a directory.
+
+        Args:
+        - directory (str): Path of the directory.
+
+        Returns:
+        - List of media file paths.
+        """
+        return list(self._by_directory.get(os.path.normpath(directory), {}))
+
+    def _pull(self) -> bool:
+        # Add the next non-empty batch from the source, returning False once it is exhausted
+        while self._source is not None:
+            try:
+                batch = next(self._source)
+            except StopIteration:
+                self._source = None
+                return False
+            added = [entry for entry in map(self.add, batch) if entry is not None]
+            if added:
+                if self.on_batch is not None:
+                    self.on_batch(added)
+                return True
+        return False
+
+    def _entries_under(self, directory: str) -> List[MediaEntry]:
+        prefix = os.path.join(directory, "")
+        entries = []
+        for key in list(self._by_directory):
+            if key == directory or key.startswith(prefix):
+                entries.extend(self._by_directory[key].values())
+        return entries
+
+    def _link(self, entry: MediaEntry) -> None:
+        self._by_path[entry.path] = entry
+        self._by_directory.setdefault(entry.directory, {})[entry.path] = entry
+
+    def _unlink(self, entry: MediaEntry) -> None:
+        self._by_path.pop(entry.path, None)
+        directory = self._by_directory.get(entry.directory)
+        if directory is not None:
+            directory.pop(entry.path, None)
+            if not directory:
+                del self._by_directory[entry.directory]
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+from typing import Any, Dict, Optional
+
+from media_manager.media_index import MediaEntry
+
+
+def belongs_to_media(file_name: str, folder_name: str, media_name: str) -> bool:
+    """
+    Check whether a file next to a media file moves into the media's new
+    folder along with it, e.g. its subtitles or artwork.
+
+    Args:
+    - file_name (str): Name of the file.
+    - folder_name (str): Name of the folder the media file moves into.
+    - media_name (str): Current name of the media file, without extension.
+
+    Returns:
+    - True if the file belongs to the media file, or is the media file itself.
+    """
+    return folder_name in file_name or file_name.startswith(f"{media_name}.")
+
+
+class MediaJob:
+    """
+    Per-file state carried through the clean pipeline.
+
+    A MediaManager holds only configuration and shared caches, so any number
+    of jobs can run through it at once.
+
+    Attributes:
+    - entry: Index entry of the media file.
+    - directory: Current directory.
+    - parent_directory: Parent directory.
+    - folder_name: Folder name.
+    - media_file: Media file name.
+    - file_name: File name.
+    - file_extension: File extension.
+    - new_file_name: New file name.
+    - new_media_file_path: New media file path.
+    - temporary_media_file_path: Temporary media file path.
+    - media_type: Type of media ('media', 'series', 'music').
+    - filters: Current set of filters.
+    - audio_tags: Tags for audio files.
+    - output_parameters: Output parameters for media processing.
+    - failed: Flag indicating whether processing the file failed.
+    - skipped: Reason the file was left as it is, without failing, so it is
+      not recorded as clean, or an empty string.
+    - processed_video_codec: Video codec of the file after processing.
+    - working_directory: Directory marked as in use while metadata is set.
+    - lease: Lease of the queued job the file is processed for, or None when
+      it is processed for this run, see JobQueue.
+    """
+
+    __slots__ = (
+        "entry",
+        "directory",
+        "parent_directory",
+        "folder_name",
+        "media_file",
+        "file_name",
+        "file_extension",
+        "new_file_name",
+        "new_media_file_path",
+        "temporary_media_file_path",
+        "media_type",
+        "filters",
+        "audio_tags",
+        "output_parameters",
+        "failed",
+        "skipped",
+        "processed_video_codec",
+        "working_directory",
+        "lease",
+    )
+
+    def __init__(self, entry: MediaEntry, filters: Dict[str, str]):
+        """
+        Initialize a job for a media file.
+
+        Args:
+        - entry (MediaEntry): Index entry of the media file.
+        - filters (Dict[str, str]): Default set of filters.
+        """
+        self.entry = entry
+        self.directory = ""
+        self.parent_directory = ""
+        self.folder_name = ""
+        self.media_file = os.path.basename(entry.path)
+        self.file_name, self.file_extension = os.path.splitext(self.media_file)
+        self.new_file_name = self.file_name
+        self.new_media_file_path = ""
+        self.temporary_media_file_path = ""
+        self.media_type = "media"
+        self.filters = filters
+        self.audio_tags: Optional[Any] = None
+        self.output_parameters: Dict[str, Any] = {}
+        self.failed = False
+        self.skipped = ""
+        self.processed_video_codec = ""
+        self.working_directory = ""
+        self.lease: Optional[Any] = None
+        self.refresh_directory()
+
+    @property
+    def extension(self) -> str:
+        """
+        File extension without the leading dot, lowercased to match the
+        supported types, e.g. 'mkv' for 'Movie.MKV'.
+        """
+        return self.file_extension[1:].lower()
+
+    def refresh_directory(self) -> None:
+        """
+        Point the current directory at wherever the media file lives now.
+        """
+        self.directory = os.path.normpath(os.path.dirname(self.entry.path))
+        if not self.directory.endswith(os.path.sep):
+            self.directory += os.path.sep
+        self.parent_directory = os.path.dirname(os.path.normpath(self.directory))
+
+    def __repr__(self) -> str:
+        return f"MediaJob({self.entry.path!r}, media_type={self.media_type!r})"
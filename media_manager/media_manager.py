@@ -1,91 +1,188 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import io
 import os
 import sys
 import re
 import getopt
 import logging
-from typing import Optional, List
+import threading
+import time
+from functools import lru_cache, partial
+from concurrent.futures import ThreadPoolExecutor
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    Optional,
+    List,
+    Tuple,
+)
 
-import ffmpeg
 import shutil
 import glob
-import json
 from media_manager.version import __version__, __author__, __credits__
+from media_manager.media_index import MediaEntry, MediaIndex
+from media_manager.media_scanner import MediaScanner
+from media_manager.state_store import StateStore, FileState, file_identity
+from media_manager.probe_cache import ProbeCache
+from media_manager.metrics import Metrics, tree_size
+from media_manager.progress import FileProgress, ProgressTracker, parse_progress
+from media_manager.transfer import TransferEngine
+from media_manager.stream_plan import (
+    DEFAULT_BITS_PER_PIXEL,
+    StreamDecision,
+    StreamPlan,
+    plan_streams,
+)
+from media_manager.estimator import SizeEstimator
+from media_manager.segmented import SegmentedEncoder
+from media_manager.job_queue import JobQueue, Lease
+from media_manager.watcher import DownloadWatcher
+from media_manager.subtitle_index import SubtitleIndex, language_code
+from media_manager.ffmpeg_job import (
+    ENVIRONMENT_FAILURES,
+    FfmpegJob,
+    classify_failure,
+    last_line,
+)
+from media_manager.media_job import MediaJob, belongs_to_media
+from media_manager.music_cache import (
+    ArtworkCache,
+    ConnectionPool,
+    RecognitionCache,
+    audio_content_hash,
+)
+from media_manager.planner import MediaPlan, MediaPlanner, PlanExecutor
+from media_manager.containers import ContainerError, set_title_tags
 
-try:
-    import music_tag
-    from shazamio import Shazam
-    import asyncio
-    from urllib.request import urlopen
 
-    music_feature = True
-except (ModuleNotFoundError, ImportError):
-    print("Music managing disabled")
-    music_feature = False
+@lru_cache(maxsize=None)
+def load_music_modules() -> Optional[Tuple[Any, Any]]:
+    """
+    Import the optional music dependencies the first time a music file is
+    found, so runs without music do not pay for them at startup.
+
+    Returns:
+    - Tuple of the music_tag module and the Shazam class, or None if they are not installed.
+    """
+    try:
+        import music_tag
+        from shazamio import Shazam
+    except (ModuleNotFoundError, ImportError):
+        print("Music managing disabled")
+        return None
+    return music_tag, Shazam
+
+
+def music_feature() -> bool:
+    """
+    Check if music managing is available.
+
+    Returns:
+    - True if the optional music dependencies are installed.
+    """
+    return load_music_modules() is not None
+
+
+@lru_cache(maxsize=None)
+def compile_filter(pattern: str) -> re.Pattern:
+    """
+    Compile a file name filter once, so cleaning many names does not re-parse it.
+
+    Args:
+    - pattern (str): Regular expression of the filter.
+
+    Returns:
+    - The compiled pattern.
+    """
+    return re.compile(pattern)
 
 
 class MediaManager:
     """
     Class for managing media files.
 
+    The manager holds configuration and the caches shared by every file. The
+    state of a single file lives in a MediaJob, so many files can be processed
+    at once.
+
     Attributes:
-    - media_files: List of media files.
-    - completed_media_files: List of completed media files.
-    - media_file_directories: List of media file directories.
+    - media_index: Index of media files discovered in the media directory.
+    - media_scanner: Directory walker used to discover media files.
+    - subtitle_index: Index of the subtitle files found by the last scan.
+    - max_depth: Maximum depth of media files below the media directory.
+    - state_store: Persistent store of processed files, or None to disable.
+    - probe_cache: Cache of ffprobe results shared by all processing steps.
+    - jobs: Number of media files processed concurrently.
+    - music_jobs: Number of music recognition requests in flight at once.
+    - recognition_rate: Maximum music recognition requests started per second, or None.
+    - recognizer: Coroutine function recognizing music files, or None to use Shazam.
+    - excerpt_duration: Length in seconds of the excerpts recognized instead of whole music files, or None.
+    - excerpt_starts: Start of each excerpt window tried, as a fraction of the track length.
+    - recognition_cache: Cache of music recognition results, or None to disable.
+    - artwork_cache: Cache of downloaded album art, or None to disable.
+    - connection_pool: Keep-alive HTTP connections used to download album art.
+    - metrics: Per-stage timing instrumentation, disabled unless an output is set.
+    - progress: Progress of the ffmpeg runs, with the queue ETA of the transcodes.
+    - transfer: Engine moving media to the target directories, across file systems.
+    - remove_junk: Flag indicating whether scans remove junk files.
+    - layout_lock: Condition guarding renames, merges and moves in the media directory.
+    - directory_users: Number of jobs working on files in each directory.
     - media_directory: Media directory path.
-    - directory: Current directory.
-    - parent_directory: Parent directory.
-    - folder_name: Folder name.
-    - media_file: Media file name.
-    - file_name: File name.
-    - file_extension: File extension.
-    - new_file_name: New file name.
-    - new_media_file_path: New media file path.
-    - temporary_media_file_path: Temporary media file path.
     - quiet: Flag indicating whether to print output.
-    - total_media_files: Total number of media files.
     - movie_filters: Dictionary of movie filters.
     - series_filters: Dictionary of series filters.
-    - filters: Current set of filters.
-    - media_type: Type of media ('media', 'series', 'music').
     - subtitle: Flag indicating whether to include subtitles.
+    - subtitle_languages: Languages of the subtitles included, in order.
     - optimize: Flag indicating whether to optimize media files.
-    - media_file_index: Index of the current media file.
-    - audio_tags: Tags for audio files.
     - terminal_width: Width of the terminal.
     - max_file_length: Maximum file length for display.
-    - shazam: Shazam instance.
+    - shazam: Shazam instance, created on first use.
     - supported_audio_types: List of supported audio types.
     - supported_video_types: List of supported video types.
     - video_codec: Video codec for optimization.
     - audio_codec: Audio codec for optimization.
-    - output_parameters: Output parameters for media processing.
     - preset: Optimization preset.
     - audio_bitrate: Audio bitrate for optimization.
     - crf: Constant Rate Factor for optimization.
+    - bits_per_pixel: Video bits per pixel below which optimizing copies the video.
+    - estimator: Sample encoder skipping transcodes that would not pay off.
+    - segmented_encoder: Encoder splitting long videos into segments encoded concurrently.
+    - job_queue: Shared queue video metadata is handed to workers through, or None.
     """
 
     def __init__(self):
         """
         Initialize the MediaManager class with default values.
         """
-        self.media_files = []
-        self.completed_media_files = []
-        self.media_file_directories = []
+        self.media_index = MediaIndex()
+        self.media_scanner = None
+        self.subtitle_index = SubtitleIndex(self.clean_subtitle_name)
+        self.max_depth = 3
+        self.state_store = None
+        self.probe_cache = ProbeCache()
+        self.jobs = 1
+        self.music_jobs = 4
+        self.recognition_rate = None
+        self.recognizer = None
+        self.excerpt_duration = None
+        self.excerpt_starts = (0.3, 0.6)
+        self.recognition_cache = None
+        self.artwork_cache = None
+        self.connection_pool = ConnectionPool()
+        self.metrics = Metrics()
+        self.progress = ProgressTracker()
+        self.transfer = TransferEngine()
+        self.remove_junk = True
+        self.layout_lock = threading.Condition(threading.RLock())
+        self.directory_users = {}
         self.media_directory = ""
-        self.directory = ""
-        self.parent_directory = ""
-        self.folder_name = ""
-        self.media_file = ""
-        self.file_name = ""
-        self.file_extension = ""
-        self.new_file_name = ""
-        self.new_media_file_path = ""
-        self.temporary_media_file_path = ""
         self.quiet = True
-        self.total_media_files = 0
         self.movie_filters = {
             "2160p.*$": "2160p",
             "1080p.*$": "1080p",
@@ -152,22 +249,16 @@ def __init__(self):
             r"s([0-9][0-9]*)e([0-9][0-9]*)": r"S\1E\2",
             r" - -": " -",
         }
-        self.filters = self.movie_filters
-        self.media_type = "media"
         self.subtitle = False
+        self.subtitle_languages = ["English"]
         self.optimize = False
-        self.media_file_index = 0
-        self.audio_tags = None
         try:
             columns, rows = os.get_terminal_size(0)
         except Exception:
             columns = 50
         self.terminal_width = columns
         self.max_file_length = self.terminal_width - 21
-        if music_feature:
-            self.shazam = Shazam()
-        else:
-            self.shazam = None
+        self._shazam = None
         self.supported_audio_types = [
             "mp3",
             "m4a",
@@ -184,10 +275,13 @@ def __init__(self):
         self.video_codec = "copy"
         self.audio_codec = "copy"
         self.subtitle_codec = "copy"
-        self.output_parameters = {}
         self.preset = "medium"
         self.audio_bitrate = "128k"
         self.crf = 28
+        self.bits_per_pixel = DEFAULT_BITS_PER_PIXEL
+        self.estimator = SizeEstimator()
+        self.segmented_encoder = SegmentedEncoder()
+        self.job_queue = None
 
     def set_verbose(self, quiet=True) -> None:
         """
@@ -207,6 +301,20 @@ def set_subtitle(self, subtitle: bool) -> None:
         """
         self.subtitle = subtitle
 
+    def set_subtitle_languages(self, subtitle_languages: List[str]) -> None:
+        """
+        Set the languages of the subtitles included.
+
+        Args:
+        - subtitle_languages (List[str]): Language names, e.g. ['English', 'Spanish'],
+          in the order their subtitle streams are added.
+        """
+        self.subtitle_languages = [
+            language.strip().capitalize()
+            for language in subtitle_languages
+            if language.strip()
+        ]
+
     def set_optimize(self, optimize: bool) -> None:
         """
         Set the optimization flag.
@@ -219,30 +327,31 @@ def set_optimize(self, optimize: bool) -> None:
             self.video_codec = "libx265"
             self.audio_codec = "aac"
             self.subtitle_codec = "copy"
-            self.output_parameters["crf"] = self.crf
-            self.output_parameters["audio_bitrate"] = self.audio_bitrate
-            self.output_parameters["preset"] = self.preset
         else:
             self.video_codec = "copy"
             self.audio_codec = "copy"
             self.subtitle_codec = "copy"
-            self.output_parameters.pop("crf", None)
-            self.output_parameters.pop("audio_bitrate", None)
-            self.output_parameters.pop("preset", None)
 
-    def build_output_parameters(self) -> None:
+    def build_output_parameters(self, job: MediaJob) -> None:
         """
         Build output parameters for media processing.
+
+        Args:
+        - job (MediaJob): Media file being processed.
         """
-        self.output_parameters = {
+        job.output_parameters = {
             "map_metadata": 0,
             "map": 0,
             "vcodec": self.video_codec,
             "acodec": self.audio_codec,
             "scodec": self.subtitle_codec,
-            "metadata:g:0": f"title={self.new_file_name}",
-            "metadata:g:1": f"comment={self.new_file_name}",
+            "metadata:g:0": f"title={job.new_file_name}",
+            "metadata:g:1": f"comment={job.new_file_name}",
         }
+        if self.optimize:
+            job.output_parameters["crf"] = self.crf
+            job.output_parameters["audio_bitrate"] = self.audio_bitrate
+            job.output_parameters["preset"] = self.preset
 
     def set_crf(self, crf) -> None:
         """
@@ -271,6 +380,513 @@ def set_audio_bitrate(self, audio_bitrate) -> None:
         """
         self.audio_bitrate = audio_bitrate
 
+    def set_bits_per_pixel(self, bits_per_pixel: float) -> None:
+        """
+        Set the video bits per pixel below which optimizing copies the video.
+
+        Args:
+        - bits_per_pixel (float): Bitrate per pixel per frame, e.g. 0.05.
+        """
+        self.bits_per_pixel = bits_per_pixel
+
+    def plan_streams(self, probe: Dict[str, Any]) -> StreamPlan:
+        """
+        Decide which streams of a media file optimizing encodes.
+
+        Args:
+        - probe (Dict[str, Any]): ffprobe result of the media file.
+
+        Returns:
+        - The StreamPlan of the media file.
+        """
+        return plan_streams(
+            probe,
+            video_encoder=self.video_codec,
+            audio_encoder=self.audio_codec,
+            audio_bitrate=self.audio_bitrate,
+            bits_per_pixel=self.bits_per_pixel,
+        )
+
+    def set_estimator(self, estimator: SizeEstimator) -> None:
+        """
+        Set the estimator deciding whether transcodes pay off.
+
+        Args:
+        - estimator (SizeEstimator): Estimator, without thresholds to transcode every file.
+        """
+        self.estimator = estimator
+
+    def estimate_transcode(
+        self, job: MediaJob, probe: Dict[str, Any], output_parameters: Dict[str, Any]
+    ) -> Tuple[bool, Optional[int]]:
+        """
+        Estimate whether transcoding a media file pays off, recording the
+        estimate in the state store.
+
+        Args:
+        - job (MediaJob): Media file being processed.
+        - probe (Dict[str, Any]): ffprobe result of the media file.
+        - output_parameters (Dict[str, Any]): ffmpeg output parameters of the transcode.
+
+        Returns:
+        - Tuple of whether to transcode the file and the ID of the recorded
+          estimate, or None if nothing was recorded.
+        """
+        try:
+            with self.metrics.stage("estimate", job.new_media_file_path) as stage:
+                stage.subprocesses = self.estimator.samples
+                estimate = self.estimator.estimate(
+                    job.new_media_file_path, probe, output_parameters
+                )
+        except Exception as e:
+            self.print(f"\t\tUnable to estimate the transcode: {e}")
+            return True, None
+        if estimate is None:
+            return True, None
+        worth_it = self.estimator.worth_it(estimate)
+        self.print(
+            f"\t\tEstimate: {estimate}, "
+            f"{'transcoding' if worth_it else 'not worth transcoding'}"
+        )
+        estimate_id = None
+        if self.state_store:
+            estimate_id = self.state_store.record_estimate(
+                path=job.new_media_file_path,
+                source_size=estimate.source_size,
+                duration=estimate.duration,
+                predicted_size=estimate.predicted_size,
+                predicted_seconds=estimate.predicted_seconds,
+                transcode=worth_it,
+            )
+        return worth_it, estimate_id
+
+    def set_segments(self, segments: int) -> None:
+        """
+        Set the number of segments long videos are split into and encoded concurrently.
+
+        Args:
+        - segments (int): Number of segments, 1 to encode videos in one piece.
+        """
+        self.segmented_encoder = SegmentedEncoder(segments=segments)
+
+    def segmented_video(
+        self, probe: Dict[str, Any], plan: Optional[StreamPlan]
+    ) -> Optional[StreamDecision]:
+        """
+        Find the video stream to encode in segments, if the file qualifies.
+
+        Args:
+        - probe (Dict[str, Any]): ffprobe result of the media file.
+        - plan (Optional[StreamPlan]): Stream plan of the media file, or None.
+
+        Returns:
+        - The decision of the only video stream encoded, or None to encode
+          the file in one piece.
+        """
+        if plan is None:
+            return None
+        videos = [
+            decision
+            for decision in plan.decisions
+            if decision.encoder and decision.codec_type == "video"
+        ]
+        try:
+            duration = float(probe["format"]["duration"])
+        except (KeyError, TypeError, ValueError):
+            return None
+        if len(videos) != 1 or not self.segmented_encoder.applies(duration):
+            return None
+        return videos[0]
+
+    def encode_segmented(
+        self, job: MediaJob, probe: Dict[str, Any], video: StreamDecision
+    ) -> None:
+        """
+        Transcode a media file with its video split into segments encoded concurrently.
+
+        Args:
+        - job (MediaJob): Media file being processed.
+        - probe (Dict[str, Any]): ffprobe result of the media file.
+        - video (StreamDecision): Decision of the video stream to encode.
+        """
+        segments = self.segmented_encoder.segments
+        self.print(f"\t\tEncoding the video in {segments} segments concurrently...")
+        output_parameters = dict(job.output_parameters)
+        output_parameters[f"c:{video.specifier}"] = "copy"
+        processes = self.segmented_encoder.encode(
+            job.new_media_file_path,
+            job.temporary_media_file_path,
+            probe,
+            video.index,
+            {"c:v": video.encoder, "crf": self.crf, "preset": self.preset},
+            output_parameters,
+            probe_function=self.probe_cache.probe,
+            on_segment=lambda finished, total: self.print(
+                f"\t{os.path.basename(job.new_media_file_path)[:30]}: "
+                f"{finished}/{total} segments encoded".ljust(self.terminal_width),
+                end="\r",
+                quiet=False,
+            ),
+        )
+        self.metrics.current().subprocesses += processes
+
+    def set_job_queue(self, job_queue: Optional[JobQueue]) -> None:
+        """
+        Set the shared queue video metadata is handed to workers through.
+
+        Args:
+        - job_queue (Optional[JobQueue]): Job queue, or None to process every file here.
+        """
+        self.job_queue = job_queue
+
+    def queue_settings(self) -> Dict[str, Any]:
+        """
+        Get the settings workers need to process a file as this run would.
+
+        Returns:
+        - Dictionary of settings, see apply_queue_settings().
+        """
+        return {
+            "subtitle": self.subtitle,
+            "subtitle_languages": self.subtitle_languages,
+            "optimize": self.optimize,
+            "crf": self.crf,
+            "preset": self.preset,
+            "audio_bitrate": self.audio_bitrate,
+            "bits_per_pixel": self.bits_per_pixel,
+            "segments": self.segmented_encoder.segments,
+            "min_savings_ratio": self.estimator.min_savings_ratio,
+            "min_savings_bytes": self.estimator.min_savings_bytes,
+        }
+
+    def apply_queue_settings(self, settings: Dict[str, Any]) -> None:
+        """
+        Apply the settings of the run that queued a job.
+
+        Args:
+        - settings (Dict[str, Any]): Settings returned by queue_settings().
+        """
+        self.set_subtitle(subtitle=settings["subtitle"])
+        self.set_subtitle_languages(subtitle_languages=settings["subtitle_languages"])
+        self.set_crf(crf=settings["crf"])
+        self.set_preset(preset=settings["preset"])
+        self.set_audio_bitrate(audio_bitrate=settings["audio_bitrate"])
+        self.set_optimize(optimize=settings["optimize"])
+        self.set_bits_per_pixel(bits_per_pixel=settings["bits_per_pixel"])
+        self.set_segments(segments=settings["segments"])
+        self.set_estimator(
+            SizeEstimator(
+                min_savings_ratio=settings["min_savings_ratio"],
+                min_savings_bytes=settings["min_savings_bytes"],
+            )
+        )
+
+    def queue_video_metadata(self, job: MediaJob) -> None:
+        """
+        Hand setting the metadata of a video file to a worker and wait for it.
+
+        Paths are queued relative to the queue directory, so hosts may mount
+        the shared file system in different places.
+
+        Args:
+        - job (MediaJob): Media file being processed.
+        """
+        job_id = self.job_queue.submit(
+            {
+                "path": os.path.relpath(
+                    job.new_media_file_path, self.job_queue.directory
+                ),
+                "name": job.new_file_name,
+                "folder_name": job.folder_name,
+                "media_type": job.media_type,
+                "settings": self.queue_settings(),
+            }
+        )
+        self.print(f"\tQueued {os.path.basename(job.new_media_file_path)}: {job_id}")
+        result = self.job_queue.wait(job_id)
+        job.failed = result.get("failed", True)
+        job.processed_video_codec = result.get("video_codec", "")
+        if result.get("error"):
+            self.print(
+                f"\tWorker {result.get('worker')} failed on "
+                f"{job.new_media_file_path}: {result['error']}",
+                quiet=False,
+            )
+        # The file was rewritten elsewhere
+        self.probe_cache.invalidate(job.new_media_file_path)
+
+    def process_queued_job(self, lease: Lease) -> Dict[str, Any]:
+        """
+        Set the metadata of a video file queued by another run.
+
+        The work stops as soon as the lease is lost, as the host that
+        reclaimed it runs the job again: a running ffmpeg is terminated, and
+        the media file is only replaced while the lease is still held.
+
+        Args:
+        - lease (Lease): Lease of the job, see queue_video_metadata().
+
+        Returns:
+        - Outcome of the job, reported back to the run that queued it.
+        """
+        started = time.perf_counter()
+        spec = lease.spec
+        self.apply_queue_settings(spec["settings"])
+        path = os.path.normpath(os.path.join(self.job_queue.directory, spec["path"]))
+        job = MediaJob(MediaEntry(path), self.movie_filters)
+        job.media_type = spec["media_type"]
+        job.folder_name = spec["folder_name"]
+        job.new_file_name = spec["name"]
+        job.new_media_file_path = path
+        job.lease = lease
+        # Named after the worker, so a worker that lost its lease never
+        # writes to the file of the worker running the job again
+        job.temporary_media_file_path = os.path.join(
+            os.path.dirname(path),
+            f"temp-{self.job_queue.worker_id}-{job.new_file_name}{job.file_extension}",
+        )
+        self.build_output_parameters(job)
+        try:
+            with self.metrics.stage("metadata", path):
+                self.set_video_metadata(job)
+        except Exception as e:
+            return {"failed": True, "error": str(e)}
+        finally:
+            self.progress.discard(job.entry)
+        if lease.lost.is_set():
+            return {"failed": True, "error": "Lease lost"}
+        return {
+            "failed": job.failed,
+            "video_codec": job.processed_video_codec,
+            "seconds": time.perf_counter() - started,
+        }
+
+    def run_worker(self, idle_timeout: Optional[float] = None) -> int:
+        """
+        Process jobs from the job queue until stopped.
+
+        A job interrupted by Ctrl+C goes back to the queue. A job whose worker
+        crashes goes back once its lease expires, see JobQueue.
+
+        Args:
+        - idle_timeout (Optional[float]): Seconds without a job after which to
+          stop, or None to run until stopped.
+
+        Returns:
+        - Number of jobs processed.
+        """
+        processed = 0
+        idle_since = time.monotonic()
+        self.print(
+            f"Worker {self.job_queue.worker_id} waiting for jobs in "
+            f"{self.job_queue.directory}...",
+            quiet=False,
+        )
+        while True:
+            lease = self.job_queue.lease()
+            if lease is None:
+                if (
+                    idle_timeout is not None
+                    and time.monotonic() - idle_since >= idle_timeout
+                ):
+                    return processed
+                time.sleep(1)
+                continue
+            self.print(f"Processing {lease.spec['path']}", quiet=False)
+            try:
+                with self.job_queue.hold(lease):
+                    result = self.process_queued_job(lease)
+            except BaseException:
+                self.job_queue.release(lease)
+                raise
+            if not self.job_queue.complete(lease, result):
+                self.print(
+                    f"Lease of {lease.spec['path']} was lost, another worker "
+                    f"runs the job again",
+                    quiet=False,
+                )
+                continue
+            processed += 1
+            idle_since = time.monotonic()
+
+    def record_transcode(
+        self, job: MediaJob, estimate_id: Optional[int], started: float
+    ) -> None:
+        """
+        Record the actual outcome of an estimated transcode.
+
+        Args:
+        - job (MediaJob): Media file that was transcoded.
+        - estimate_id (Optional[int]): ID of the estimate, or None if there is none.
+        - started (float): perf_counter() when the transcode started.
+        """
+        if estimate_id is None or not self.state_store:
+            return
+        self.state_store.record_estimate_result(
+            estimate_id,
+            actual_size=os.path.getsize(job.new_media_file_path),
+            actual_seconds=time.perf_counter() - started,
+        )
+
+    def set_max_depth(self, max_depth: Optional[int]) -> None:
+        """
+        Set the maximum depth of media files below the media directory.
+
+        Args:
+        - max_depth (Optional[int]): Maximum depth, or None for unlimited.
+        """
+        self.max_depth = max_depth
+
+    def set_state_store(self, state_store: Optional[StateStore]) -> None:
+        """
+        Set the persistent store used to skip files that are already clean.
+
+        Args:
+        - state_store (Optional[StateStore]): State store, or None to disable.
+        """
+        self.state_store = state_store
+
+    def set_probe_cache(self, probe_cache: ProbeCache) -> None:
+        """
+        Set the cache of ffprobe results.
+
+        Args:
+        - probe_cache (ProbeCache): Probe cache.
+        """
+        self.probe_cache = probe_cache
+        self.probe_cache.metrics = self.metrics
+
+    def set_metrics(self, metrics: Metrics) -> None:
+        """
+        Set the per-stage timing instrumentation.
+
+        Args:
+        - metrics (Metrics): Metrics recording the stages of each media file.
+        """
+        self.metrics = metrics
+        self.probe_cache.metrics = metrics
+
+    def set_excerpt(
+        self, excerpt_duration: Optional[float], excerpt_starts: List[float]
+    ) -> None:
+        """
+        Recognize music from short excerpts instead of the whole file.
+
+        Args:
+        - excerpt_duration (Optional[float]): Length of the excerpts in seconds, or None to recognize whole files.
+        - excerpt_starts (List[float]): Start of each window tried until one matches, as a fraction of the track length.
+        """
+        self.excerpt_duration = excerpt_duration
+        self.excerpt_starts = tuple(excerpt_starts)
+
+    def music_recognizer(self) -> Callable[[str], Awaitable[Dict[str, Any]]]:
+        """
+        Get the coroutine function used to recognize music files.
+
+        Returns:
+        - The configured recognizer, or Shazam's recognize_song(), wrapped in an
+          ExcerptRecognizer when excerpts are enabled.
+        """
+        recognizer = self.recognizer or self.shazam.recognize_song
+        if self.excerpt_duration:
+            from media_manager.music_pipeline import ExcerptRecognizer
+
+            recognizer = ExcerptRecognizer(
+                recognizer,
+                duration=self.excerpt_duration,
+                starts=self.excerpt_starts,
+                probe=self.probe_cache.probe,
+            )
+        return recognizer
+
+    @property
+    def shazam(self) -> Optional[Any]:
+        if self._shazam is None and music_feature():
+            self._shazam = load_music_modules()[1]()
+        return self._shazam
+
+    def set_recognition_cache(
+        self, recognition_cache: Optional[RecognitionCache]
+    ) -> None:
+        """
+        Set the cache of music recognition results.
+
+        Args:
+        - recognition_cache (Optional[RecognitionCache]): Recognition cache, or None to disable.
+        """
+        self.recognition_cache = recognition_cache
+
+    def set_artwork_cache(self, artwork_cache: Optional[ArtworkCache]) -> None:
+        """
+        Set the cache of downloaded album art.
+
+        Args:
+        - artwork_cache (Optional[ArtworkCache]): Artwork cache, or None to disable.
+        """
+        self.artwork_cache = artwork_cache
+
+    def set_progress_callback(
+        self, callback: Optional[Callable[[FileProgress], Any]]
+    ) -> None:
+        """
+        Set a function called with the progress of every ffmpeg run.
+
+        The function is called from the thread running ffmpeg, about twice a
+        second, and once more when ffmpeg exits.
+
+        Args:
+        - callback (Optional[Callable]): Function called with the FileProgress, or None.
+        """
+        self.progress.callback = callback
+
+    def set_transfer_jobs(self, transfer_jobs: int) -> None:
+        """
+        Set the number of files copied concurrently when moving media to
+        another file system.
+
+        Args:
+        - transfer_jobs (int): Number of concurrent copies.
+        """
+        self.transfer.jobs = max(1, int(transfer_jobs))
+
+    def set_jobs(self, jobs: int) -> None:
+        """
+        Set the number of media files processed concurrently.
+
+        Args:
+        - jobs (int): Number of concurrent jobs.
+        """
+        self.jobs = max(1, int(jobs))
+
+    def set_music_jobs(self, music_jobs: int) -> None:
+        """
+        Set the number of music recognition requests in flight at once.
+
+        Args:
+        - music_jobs (int): Number of concurrent recognition requests.
+        """
+        self.music_jobs = max(1, int(music_jobs))
+
+    def set_recognition_rate(self, recognition_rate: Optional[float]) -> None:
+        """
+        Set the maximum number of music recognition requests started per second.
+
+        Args:
+        - recognition_rate (Optional[float]): Requests per second, or None for no limit.
+        """
+        self.recognition_rate = recognition_rate
+
+    def set_recognizer(
+        self, recognizer: Optional[Callable[[str], Awaitable[Dict[str, Any]]]]
+    ) -> None:
+        """
+        Set the coroutine function used to recognize music files.
+
+        Args:
+        - recognizer (Optional[Callable]): Recognizer, or None to use Shazam.
+        """
+        self.recognizer = recognizer
+
     def set_media_directory(self, media_directory: str) -> None:
         """
         Set the media directory.
@@ -289,7 +905,7 @@ def get_media_list(self) -> List[str]:
         Returns:
         - List of media files.
         """
-        return self.media_files
+        return self.media_index.paths()
 
     def get_media_directory_list(self) -> List[str]:
         """
@@ -298,7 +914,7 @@ def get_media_directory_list(self) -> List[str]:
         Returns:
         - List of media file directories.
         """
-        return self.media_file_directories
+        return self.media_index.directories()
 
     def print(
         self, string: str, quiet: Optional[bool] = True, end: Optional[str] = "\n"
@@ -314,191 +930,285 @@ def print(
             print(string, end=end)
 
     # Detect if series or a movie
-    def media_detection(self) -> None:
+    def media_detection(self, job: MediaJob) -> None:
         """
         Detect the type of media (series, movie, or music).
+
+        Args:
+        - job (MediaJob): Media file being processed.
         """
-        self.parent_directory = os.path.dirname(os.path.normpath(self.directory))
-        self.folder_name = os.path.basename(os.path.normpath(self.directory))
-        if self.file_extension[1:] in self.supported_audio_types and music_feature:
-            self.media_type = "music"
-            self.audio_tags = None
+        job.parent_directory = os.path.dirname(os.path.normpath(job.directory))
+        job.folder_name = os.path.basename(os.path.normpath(job.directory))
+        if job.extension in self.supported_audio_types and music_feature():
+            music_tag = load_music_modules()[0]
+            job.media_type = "music"
+            job.audio_tags = None
             try:
-                self.audio_tags = music_tag.load_file(
-                    os.path.normpath(os.path.join(self.directory, self.media_file))
+                job.audio_tags = music_tag.load_file(
+                    os.path.normpath(os.path.join(job.directory, job.media_file))
                 )
             except Exception as e:
                 print(
-                    f"Unable to open file {os.path.normpath(os.path.join(self.directory, self.media_file))}: \n"
+                    f"Unable to open file {os.path.normpath(os.path.join(job.directory, job.media_file))}: \n"
                     f"{e}...\n\n"
-                    f"Trying new File Path: {self.new_media_file_path}..."
+                    f"Trying new File Path: {job.new_media_file_path}..."
                 )
                 try:
-                    self.audio_tags = music_tag.load_file(self.new_media_file_path)
+                    job.audio_tags = music_tag.load_file(job.new_media_file_path)
                 except Exception as e2:
                     print(f"Unable to open new file path: {e2}")
-            if not self.audio_tags:
+            if not job.audio_tags:
                 print("Audio file was not loaded")
                 sys.exit(2)
             self.print("\tDetected media type: Music")
-        elif self.file_extension[1:] in self.supported_video_types:
-            if bool(re.search("S[0-9][0-9]*E[0-9][0-9]*", self.file_name)) or bool(
-                re.search("s[0-9][0-9]*e[0-9][0-9]*", self.file_name)
-            ):
-                self.filters = self.series_filters
-                self.media_type = "series"
+        elif job.extension in self.supported_video_types:
+            job.media_type = self.detect_video_type(job.file_name)
+            if job.media_type == "series":
+                job.filters = self.series_filters
                 self.print("\tDetected media type: Series")
             else:
-                self.filters = self.movie_filters
-                self.media_type = "media"
+                job.filters = self.movie_filters
                 self.print("\tDetected media type: Media")
 
+    @staticmethod
+    def detect_video_type(file_name: str) -> str:
+        """
+        Detect whether a video file name belongs to a series or a movie.
+
+        Args:
+        - file_name (str): File name without extension.
+
+        Returns:
+        - 'series' or 'media'.
+        """
+        if bool(re.search("S[0-9][0-9]*E[0-9][0-9]*", file_name)) or bool(
+            re.search("s[0-9][0-9]*e[0-9][0-9]*", file_name)
+        ):
+            return "series"
+        return "media"
+
+    @staticmethod
+    def apply_filters(file_name: str, filters: dict) -> str:
+        """
+        Apply a set of filters to a file name.
+
+        Args:
+        - file_name (str): File name without extension.
+        - filters (dict): Mapping of regular expressions to replacements.
+
+        Returns:
+        - The cleaned file name.
+        """
+        for key in filters:
+            file_name = compile_filter(str(key)).sub(str(filters[key]), file_name)
+        return file_name
+
     # Clean filename
-    def clean_file_name(self) -> None:
+    def clean_file_name(self, job: MediaJob) -> None:
         """
         Clean the file name using specified filters.
+
+        Args:
+        - job (MediaJob): Media file being processed.
         """
-        for key in self.filters:
-            self.new_file_name = re.sub(
-                str(key), str(self.filters[key]), self.new_file_name
-            )
+        job.new_file_name = self.apply_filters(job.new_file_name, job.filters)
 
-    def verify_parent_directory(self) -> None:
+    def verify_parent_directory(self, job: MediaJob) -> None:
         """
         Verify and update the parent directory.
+
+        Args:
+        - job (MediaJob): Media file being processed.
         """
-        if self.media_type == "series":
-            self.folder_name = re.sub(" - S[0-9]+E[0-9]+", "", self.new_file_name)
-        elif self.media_type == "media":
-            self.folder_name = self.new_file_name
-        elif self.media_type == "music":
-            if self.audio_tags["artist"].value:
-                self.folder_name = self.audio_tags["artist"].value
+        if job.media_type == "series":
+            job.folder_name = re.sub(" - S[0-9]+E[0-9]+", "", job.new_file_name)
+        elif job.media_type == "media":
+            job.folder_name = job.new_file_name
+        elif job.media_type == "music":
+            if job.audio_tags["artist"].value:
+                job.folder_name = job.audio_tags["artist"].value
 
         # Check if media file does not have it's own folder, and create it if it does not
         self.print(
             f"\tVerifying Media Parent Directory:\n\t\t"
-            f"Current Directory: {os.path.normpath(os.path.join(self.directory, ''))}\n\t\t"
-            f"Parent Directory: {os.path.normpath(os.path.join(self.media_directory, self.folder_name, ''))}"
+            f"Current Directory: {os.path.normpath(os.path.join(job.directory, ''))}\n\t\t"
+            f"Parent Directory: {os.path.normpath(os.path.join(self.media_directory, job.folder_name, ''))}"
         )
-        if os.path.normpath(os.path.join(self.directory, "")) == os.path.normpath(
+        if os.path.normpath(os.path.join(job.directory, "")) == os.path.normpath(
             os.path.join(self.media_directory, "")
         ):
             # If parent folder does not exist, create it
-            self.parent_directory = os.path.normpath(
-                os.path.join(self.media_directory, self.folder_name, "")
+            job.parent_directory = os.path.normpath(
+                os.path.join(self.media_directory, job.folder_name, "")
             )
-            if not os.path.isdir(os.path.normpath(os.path.join(self.parent_directory))):
-                os.makedirs(os.path.join(self.parent_directory, ""))
+            if not os.path.isdir(os.path.normpath(os.path.join(job.parent_directory))):
+                os.makedirs(os.path.join(job.parent_directory, ""))
                 self.print(
-                    f"\tCreated new parent directory: {os.path.join(self.parent_directory, '')}"
+                    f"\tCreated new parent directory: {os.path.join(job.parent_directory, '')}"
                 )
-            for file_name in os.listdir(self.directory):
-                if self.folder_name in file_name:
+            for file_name in os.listdir(job.directory):
+                # The media file is not renamed yet, so match it and its sidecar
+                # files by its current name too
+                if belongs_to_media(file_name, job.folder_name, job.file_name):
                     # construct full file path
-                    source = os.path.normpath(os.path.join(self.directory, file_name))
+                    source = os.path.normpath(os.path.join(job.directory, file_name))
                     destination = os.path.normpath(
-                        os.path.join(self.parent_directory, file_name)
+                        os.path.join(job.parent_directory, file_name)
                     )
                     # move only files
                     if os.path.isfile(source):
                         shutil.move(source, destination)
-                if os.path.isdir(
-                    os.path.normpath(os.path.join(self.directory, "Subs"))
-                ):
-                    subtitles = glob.glob(f"{self.directory}/Subs/*/", recursive=True)
+                        self.media_index.relocate(source, destination)
+                if os.path.isdir(os.path.normpath(os.path.join(job.directory, "Subs"))):
+                    subtitles = glob.glob(
+                        f"{glob.escape(job.directory)}/Subs/*/", recursive=True
+                    )
                     for subtitle_directory in subtitles:
                         shutil.move(
                             f"{subtitle_directory}",
                             os.path.normpath(
-                                os.path.join(self.parent_directory, "Subs")
+                                os.path.join(job.parent_directory, "Subs")
                             ),
                         )
-                    os.rmdir(os.path.normpath(os.path.join(self.directory, "Subs")))
-                    os.rmdir(f"{self.directory}")
+                    os.rmdir(os.path.normpath(os.path.join(job.directory, "Subs")))
+                    os.rmdir(f"{job.directory}")
                 self.print(
-                    f"\tMerging parent directories: {os.path.join(self.parent_directory, '')}"
-                )
-            self.directory = self.parent_directory
-            self.new_media_file_path = os.path.normpath(
-                os.path.join(
-                    self.directory, f"{self.new_file_name}{self.file_extension}"
+                    f"\tMerging parent directories: {os.path.join(job.parent_directory, '')}"
                 )
+            job.directory = job.parent_directory
+            job.new_media_file_path = os.path.normpath(
+                os.path.join(job.directory, f"{job.new_file_name}{job.file_extension}")
             )
-            self.media_file = self.new_media_file_path
-            print(f"New Media Path: {self.new_media_file_path}")
-            self.parent_directory = os.path.join(self.parent_directory, os.pardir)
+            job.media_file = job.new_media_file_path
+            print(f"New Media Path: {job.new_media_file_path}")
+            job.parent_directory = os.path.join(job.parent_directory, os.pardir)
         else:
-            self.print(f"\tParent directory already exists: {self.directory}")
+            self.print(f"\tParent directory already exists: {job.directory}")
 
-    # Rediscover cleaned media
-    def find_media(self) -> None:
+    # Discover media
+    def find_media(
+        self,
+        lazy: bool = False,
+        prefetch: bool = True,
+        names: Optional[Iterable[str]] = None,
+    ) -> None:
         """
-        Scan for media files in the media directory.
+        Scan for media files in the media directory and build the media index.
+
+        The index is kept current by the processing steps afterwards, so this
+        only needs to run once per run.
+
+        Args:
+        - lazy (bool): Stream the scan into the index while media is processed
+          instead of enumerating the whole tree up front.
+        - prefetch (bool): Start probing video files as soon as they are found.
+        - names (Optional[Iterable[str]]): Only scan these entries of the media
+          directory, e.g. new downloads, or None to scan all of them.
         """
         self.print("\nScanning for media...")
-        # Check if running first time to capture the initial total of all files processed
-        # (To calculate percentage complete)
-        total_media = False
-        if not self.media_files:
-            total_media = True
-            self.total_media_files = 0
-        self.media_files = []
-        files = glob.glob(f"{self.media_directory}/*", recursive=True)
-        files = files + glob.glob(f"{self.media_directory}/*/*", recursive=True)
-        files = files + glob.glob(f"{self.media_directory}/*/*/*", recursive=True)
-        for file in files:
-            file_name, file_extension = os.path.splitext(file)
-            if (
-                file_extension[1:] in self.supported_video_types
-                or file_extension[1:] in self.supported_audio_types
-            ):
-                self.media_files.append(os.path.join(file))
-                self.media_file_directories.append(os.path.dirname(file))
-                self.media_file_directories = [*set(self.media_file_directories)]
-            elif file.endswith(".nfo") or file.endswith(".exe"):
-                os.remove(file)
-        self.media_files.sort()
-        for i in self.completed_media_files:
-            self.print(f"\t\tVerifying completed: {i}")
-            if i in self.media_files:
-                self.print(f"\t\tRemoving completed: {i}")
-                self.media_files.remove(i)
-        self.print(
-            f"Completed({len(self.completed_media_files)}): {self.completed_media_files}\n"
-            f"Detected Remaining({len(self.media_files)}): {self.media_files}"
+        self.media_index = MediaIndex()
+        self.subtitle_index = SubtitleIndex(self.clean_subtitle_name)
+        self.media_scanner = MediaScanner(
+            media_extensions=self.supported_video_types + self.supported_audio_types,
+            max_depth=self.max_depth,
         )
-        if total_media:
-            self.total_media_files = len(self.media_files)
-        self.print(f"\tMedia Found! ({len(self.media_file_directories)} files)")
+        self.media_index.stream(self.scan_media(prefetch=prefetch, names=names))
+        if not lazy:
+            self.media_index.drain()
 
-    def rename_file(self) -> None:
-        """
-        Rename the media file based on the cleaned file name.
+    def scan_media(
+        self, prefetch: bool = True, names: Optional[Iterable[str]] = None
+    ) -> Iterator[List[str]]:
         """
-        self.print("\tRenaming file...")
+        Walk the media directory once, removing junk files as they are found.
+
+        Args:
+        - prefetch (bool): Start probing video files as soon as they are found.
+        - names (Optional[Iterable[str]]): Only scan these entries of the media
+          directory, or None to scan all of them.
+
+        Returns:
+        - Iterator of media file path lists, one per directory.
+        """
+        for directory in self.metrics.iterate(
+            "scan", self.media_scanner.walk(self.media_directory, names=names)
+        ):
+            for entry in directory.junk if self.remove_junk else ():
+                self.print(f"\tRemoving junk file: {entry.path}")
+                try:
+                    os.remove(entry.path)
+                except OSError as e:
+                    self.print(f"\tUnable to remove junk file {entry.path}: {e}")
+            for entry in directory.skipped:
+                logging.debug(f"Skipped: {entry.path}")
+            if self.subtitle:
+                for subtitle_directory in directory.subtitle_directories:
+                    self.subtitle_index.add_directory(subtitle_directory)
+            media_files = [entry.path for entry in directory.media]
+            if not prefetch:
+                yield media_files
+                continue
+            self.probe_cache.prefetch(
+                media_file
+                for media_file in media_files
+                if os.path.splitext(media_file)[1][1:].lower()
+                in self.supported_video_types
+                and not (
+                    self.state_store
+                    and self.state_store.is_clean(
+                        media_file, subtitle=self.subtitle, optimize=self.optimize
+                    )
+                )
+            )
+            yield media_files
+        self.print(
+            f"\tMedia Found! ({self.media_scanner.media_count} files, "
+            f"{self.media_scanner.junk_count} junk "
+            f"{'removed' if self.remove_junk else 'found'}, "
+            f"{self.media_scanner.skipped_count} skipped)"
+        )
+
+    def probe_media(self) -> None:
+        """
+        Probe every video file in the media index in parallel, ahead of processing.
+        """
+        self.media_index.drain()
+        video_files = [
+            media_file
+            for media_file in self.media_index.paths()
+            if os.path.splitext(media_file)[1][1:].lower() in self.supported_video_types
+        ]
+        self.print(f"\tProbing {len(video_files)} video files...")
+        self.probe_cache.prefetch(video_files)
+        self.probe_cache.wait()
+
+    def rename_file(self, job: MediaJob) -> None:
+        """
+        Rename the media file based on the cleaned file name.
+
+        Args:
+        - job (MediaJob): Media file being processed.
+        """
+        self.print("\tRenaming file...")
         old_file_path = os.path.normpath(
-            os.path.join(self.directory, f"{self.file_name}{self.file_extension}")
+            os.path.join(job.directory, f"{job.file_name}{job.file_extension}")
         )
-        self.new_media_file_path = os.path.normpath(
-            os.path.join(self.directory, f"{self.new_file_name}{self.file_extension}")
+        job.new_media_file_path = os.path.normpath(
+            os.path.join(job.directory, f"{job.new_file_name}{job.file_extension}")
         )
-        self.temporary_media_file_path = os.path.normpath(
-            os.path.join(
-                self.directory, f"temp-{self.new_file_name}{self.file_extension}"
-            )
+        job.temporary_media_file_path = os.path.normpath(
+            os.path.join(job.directory, f"temp-{job.new_file_name}{job.file_extension}")
         )
         # Check if media file name is the same as what is proposed
-        self.file_name, self.file_extension = os.path.splitext(self.media_file)
-        if old_file_path != f"{self.new_media_file_path}" and os.path.isfile(
+        job.file_name, job.file_extension = os.path.splitext(job.media_file)
+        if old_file_path != f"{job.new_media_file_path}" and os.path.isfile(
             old_file_path
         ):
-            os.rename(old_file_path, self.new_media_file_path)
-            self.file_name = self.new_file_name
-            self.media_files[self.media_file_index] = self.new_media_file_path
-            self.media_file_index = 0
+            os.rename(old_file_path, job.new_media_file_path)
+            job.file_name = job.new_file_name
+            self.media_index.relocate(old_file_path, job.new_media_file_path)
             self.print(
-                f"\tFile Renamed: \n\t\t{old_file_path} \n\t\t➜ \n\t\t{self.new_media_file_path}"
+                f"\tFile Renamed: \n\t\t{old_file_path} \n\t\t➜ \n\t\t{job.new_media_file_path}"
             )
 
     # Clean Subtitle directories
@@ -509,436 +1219,922 @@ def clean_subtitle_directory(self, subtitle_directory: str) -> None:
         Args:
         - subtitle_directory (str): Path to the subtitle directory.
         """
+        try:
+            entries = list(os.scandir(subtitle_directory))
+        except OSError:
+            return
+        for entry in entries:
+            if not entry.is_dir():
+                continue
+            # Names are cleaned once per scan, not once per episode
+            new_folder_name = self.subtitle_index.cleaned(entry.name)
+            if new_folder_name != entry.name:
+                os.rename(
+                    entry.path,
+                    os.path.normpath(os.path.join(subtitle_directory, new_folder_name)),
+                )
+
+    def clean_subtitle_name(self, name: str) -> str:
+        """
+        Clean the name of a subtitle folder or file as the media it belongs to.
 
-        subtitle_directories = glob.glob(f"{subtitle_directory}/*/", recursive=True)
-        for subtitle_directory_index in range(0, len(subtitle_directories)):
-            subtitle_parent_directory = os.path.dirname(
-                os.path.normpath(subtitle_directories[subtitle_directory_index])
-            )
-            subtitle_directory = os.path.basename(
-                os.path.normpath(subtitle_directories[subtitle_directory_index])
+        Args:
+        - name (str): Folder or file name, without extension.
+
+        Returns:
+        - The cleaned name.
+        """
+        if self.detect_video_type(name) == "series":
+            return self.apply_filters(name, self.series_filters)
+        return self.apply_filters(name, self.movie_filters)
+
+    def find_subtitles(self, job: MediaJob) -> List[Tuple[str, str]]:
+        """
+        Find the subtitles of a video in the subtitle index.
+
+        Subs directories the scan did not index, e.g. when processing a
+        queued job, are indexed on first use.
+
+        Args:
+        - job (MediaJob): Media file being processed.
+
+        Returns:
+        - List of (language, path) in the order of the subtitle languages.
+        """
+        # The directory of the file is only renamed once every file in it is done
+        subtitle_directory = os.path.join(
+            os.path.dirname(job.new_media_file_path), "Subs"
+        )
+        if not os.path.isdir(subtitle_directory):
+            return []
+        subtitles = self.subtitle_index.find(
+            job.new_file_name, subtitle_directory, self.subtitle_languages
+        )
+        if not subtitles and self.subtitle_index.add_directory(subtitle_directory):
+            subtitles = self.subtitle_index.find(
+                job.new_file_name, subtitle_directory, self.subtitle_languages
             )
-            if os.path.isdir(subtitle_directories[subtitle_directory_index]):
-                new_folder_name = subtitle_directory
-                for key in self.series_filters:
-                    new_folder_name = re.sub(
-                        str(key), str(self.series_filters[key]), new_folder_name
-                    )
-                if new_folder_name != subtitle_directory:
-                    os.rename(
-                        subtitle_directories[subtitle_directory_index],
-                        os.path.normpath(
-                            os.path.join(subtitle_parent_directory, new_folder_name)
-                        ),
-                    )
+        return subtitles
 
-    def set_media_metadata(self) -> None:
+    def set_media_metadata(self, job: MediaJob) -> None:
         """
         Set metadata for the media file.
+
+        Args:
+        - job (MediaJob): Media file being processed.
         """
-        if self.media_type == "series" or self.media_type == "media":
-            self.set_video_metadata()
-        elif self.media_type == "music":
-            loop = asyncio.get_event_loop()
-            loop.run_until_complete(self.set_audio_metadata())
+        if job.media_type == "series" or job.media_type == "media":
+            if self.job_queue:
+                self.queue_video_metadata(job)
+            else:
+                self.set_video_metadata(job)
+        elif job.media_type == "music":
+            import asyncio
+
+            # Each job runs its own event loop, so this is safe from worker threads
+            asyncio.run(self.set_audio_metadata(job))
 
-    async def set_audio_metadata(self) -> None:
+    async def set_audio_metadata(
+        self,
+        job: MediaJob,
+        recognize: Optional[Callable[[str], Awaitable[Dict[str, Any]]]] = None,
+    ) -> None:
         """
         Set audio metadata for the media file.
+
+        Recognition is awaited, while downloading cover art and saving tags run
+        on worker threads, so many files can be tagged at once on one event
+        loop, see MusicPipeline. Files recognized before are answered from the
+        recognition cache.
+
+        Args:
+        - job (MediaJob): Media file being processed.
+        - recognize (Optional[Callable]): Coroutine function recognizing a file,
+          defaults to music_recognizer().
+        """
+        self.print(f"\tUpdating metadata for {os.path.basename(job.media_file)}...")
+        if self.audio_metadata_set(job):
+            print("File metadata is already set, moving on...")
+            return
+
+        import asyncio
+
+        path = os.path.normpath(os.path.join(job.directory, job.media_file))
+        loop = asyncio.get_running_loop()
+        song = None
+        if self.recognition_cache:
+            key = await loop.run_in_executor(None, audio_content_hash, path)
+            song = self.recognition_cache.get(key)
+        if song is None:
+            print(f"\t⚡ Shazam ⚡ {job.media_file}...")
+            recognize = recognize or self.music_recognizer()
+            song = await recognize(path)
+            if self.recognition_cache and "track" in song:
+                self.recognition_cache.put(key, song)
+        album_art = await loop.run_in_executor(
+            None, self.fetch_album_art, song["track"]["images"]["coverart"]
+        )
+        await loop.run_in_executor(
+            None, self.apply_audio_metadata, job, song, album_art
+        )
+
+    def audio_metadata_set(self, job: MediaJob) -> bool:
+        """
+        Check if the artist - title file name matches the tags and album art exists.
+
+        Args:
+        - job (MediaJob): Media file being processed.
+
+        Returns:
+        - True if the audio metadata does not need to be set.
         """
-        self.print(f"\tUpdating metadata for {os.path.basename(self.media_file)}...")
         try:
-            print("\t", self.audio_tags["artwork"])
+            print("\t", job.audio_tags["artwork"])
             artwork_present = True
         except KeyError:
             artwork_present = False
-        # First check if artist - title format matches and if album art exists
-        if (
+        return (
             artwork_present
-            and self.audio_tags["artist"].first == self.media_file.split("-")[0].strip()
-            and f"{self.audio_tags['tracktitle'].first}{self.file_extension}"
-            == self.media_file.split("-")[1].strip()
-        ):
-            print("File metadata is already set, moving on...")
-            return
-
-        print(f"\t⚡ Shazam ⚡ {self.media_file}...")
-        song = await self.shazam.recognize_song(
-            os.path.normpath(os.path.join(self.directory, self.media_file))
+            and job.audio_tags["artist"].first == job.media_file.split("-")[0].strip()
+            and f"{job.audio_tags['tracktitle'].first}{job.file_extension}"
+            == job.media_file.split("-")[1].strip()
         )
-        with open(
-            f"{song['track']['subtitle']} - {song['track']['title']}.json", "w"
-        ) as outfile:
-            outfile.write(json.dumps(song, indent=4))
-        self.audio_tags["tracktitle"] = song["track"]["title"]
-        self.audio_tags["albumartist"] = song["track"]["subtitle"]
-        self.audio_tags["artist"] = song["track"]["subtitle"]
-        self.audio_tags["album"] = song["track"]["sections"][0]["metadata"][0]["text"]
-        self.audio_tags["year"] = song["track"]["sections"][0]["metadata"][2]["text"]
+
+    def fetch_album_art(self, url: str) -> bytes:
+        """
+        Download album art, or get it from the artwork cache.
+
+        Args:
+        - url (str): URL of the album art.
+
+        Returns:
+        - The album art image data.
+        """
+        if self.artwork_cache:
+            return self.artwork_cache.fetch(url)
+        return self.connection_pool.get(url)
+
+    def apply_audio_metadata(
+        self, job: MediaJob, song: Dict[str, Any], album_art: bytes
+    ) -> None:
+        """
+        Apply a recognition result to the audio tags and save them.
+
+        Args:
+        - job (MediaJob): Media file being processed.
+        - song (Dict[str, Any]): Recognition result.
+        - album_art (bytes): Album art image data.
+        """
+        job.audio_tags["tracktitle"] = song["track"]["title"]
+        job.audio_tags["albumartist"] = song["track"]["subtitle"]
+        job.audio_tags["artist"] = song["track"]["subtitle"]
+        job.audio_tags["album"] = song["track"]["sections"][0]["metadata"][0]["text"]
+        job.audio_tags["year"] = song["track"]["sections"][0]["metadata"][2]["text"]
         try:
-            self.audio_tags["lyrics"] = song["track"]["sections"][1]["text"]
-            self.audio_tags["comment"] = song["track"]["sections"][1]["text"]
+            job.audio_tags["lyrics"] = song["track"]["sections"][1]["text"]
+            job.audio_tags["comment"] = song["track"]["sections"][1]["text"]
         except KeyError:
             print("No Lyrics found")
         try:
-            self.audio_tags["genre"] = song["track"]["genres"]["primary"]
+            job.audio_tags["genre"] = song["track"]["genres"]["primary"]
         except KeyError:
             print("No Genre found")
         try:
-            self.audio_tags["composer"] = song["track"]["sections"][0]["metadata"][1][
+            job.audio_tags["composer"] = song["track"]["sections"][0]["metadata"][1][
                 "text"
             ]
         except KeyError:
             print("No Composer found")
-        self.new_file_name = f"{song['track']['subtitle']} - {song['track']['title']}"
-        self.folder_name = self.audio_tags["artist"]
-        album_art = urlopen(song["track"]["images"]["coverart"])
-        self.audio_tags["artwork"] = album_art.read()
-        album_art.close()
-        self.audio_tags["artwork"].first.thumbnail([64, 64])
-        self.audio_tags.save()
-        self.completed_media_files.append(self.media_files[self.media_file_index])
+        job.new_file_name = f"{song['track']['subtitle']} - {song['track']['title']}"
+        job.folder_name = job.audio_tags["artist"]
+        job.audio_tags["artwork"] = album_art
+        job.audio_tags["artwork"].first.thumbnail([64, 64])
+        self.transfer.unshare(
+            os.path.normpath(os.path.join(job.directory, job.media_file))
+        )
+        job.audio_tags.save()
         self.print(
-            f"\t\tTrack: {self.audio_tags['title']}\n"
-            f"\t\tArtist:{self.audio_tags['artist']}\n"
-            f"\t\tAlbum: {self.audio_tags['album']}\n"
-            f"\t\tYear: {self.audio_tags['year']}\n"
-            f"\t\tComments: {self.audio_tags['comment']}\n"
-            f"\t\tGenre: {self.audio_tags['genre']}\n"
+            f"\t\tTrack: {job.audio_tags['title']}\n"
+            f"\t\tArtist:{job.audio_tags['artist']}\n"
+            f"\t\tAlbum: {job.audio_tags['album']}\n"
+            f"\t\tYear: {job.audio_tags['year']}\n"
+            f"\t\tComments: {job.audio_tags['comment']}\n"
+            f"\t\tGenre: {job.audio_tags['genre']}\n"
             f"\t\tCover Art URL: {song['track']['images']['coverart']}\n"
             f"\tMetadata Saved Successfully!"
         )
-        self.find_media()
-        self.media_file_index = 0
 
     # Check if media metadata title is the same as what is proposed
-    def set_video_metadata(self) -> None:
+    def set_video_metadata(self, job: MediaJob) -> None:
         """
         Set video metadata for the media file.
+
+        The title tags, the streams --optimize encodes and the subtitles
+        --subtitle adds are written by a single ffmpeg run, see FfmpegJob.
+
+        Args:
+        - job (MediaJob): Media file being processed.
         """
         self.print(
-            f"\tUpdating metadata for {os.path.basename(self.new_media_file_path)}..."
+            f"\tUpdating metadata for {os.path.basename(job.new_media_file_path)}..."
         )
+        stage = self.metrics.current()
+        probe = {"format": {}, "streams": []}
         try:
-            if "title" in ffmpeg.probe(self.new_media_file_path)["format"]["tags"]:
-                current_title_metadata = ffmpeg.probe(self.new_media_file_path)[
-                    "format"
-                ]["tags"]["title"]
-            else:
-                current_title_metadata = ""
+            with self.metrics.stage("probe", job.new_media_file_path):
+                probe = self.probe_cache.probe(job.new_media_file_path)
+            current_title_metadata = probe["format"].get("tags", {}).get("title", "")
             video_codec = next(
-                s
-                for s in ffmpeg.probe(self.new_media_file_path)["streams"]
-                if s["codec_type"] == "video"
+                s for s in probe["streams"] if s["codec_type"] == "video"
             )["codec_name"]
             self.print(f"Video Codec Detected: {video_codec}")
         except Exception as e:
             current_title_metadata = ""
             video_codec = ""
             self.print(f"Error reading metadata: {e}")
-        current_index = self.media_file_index
-        if (
-            current_title_metadata != self.new_file_name
-            or (self.optimize and video_codec != "hevc")
-        ) and self.subtitle is False:
-            failure = False
+        job.processed_video_codec = video_codec
+        processed_video_codec = video_codec
+        transcode = False
+        estimate_id = None
+        plan = None
+        if self.optimize:
+            # Only the streams worth it are encoded, the rest are copied
+            plan = self.plan_streams(probe)
+            for key in ("vcodec", "acodec"):
+                job.output_parameters.pop(key, None)
+            if plan.transcode and self.estimator.enabled:
+                worth_it, estimate_id = self.estimate_transcode(
+                    job, probe, {**job.output_parameters, **plan.output_parameters()}
+                )
+                if not worth_it:
+                    plan.copy_all("projected savings are below the threshold")
+            for decision in plan.decisions:
+                self.print(f"\t\t{decision}")
+            transcode = plan.transcode
+            job.output_parameters.update(plan.output_parameters())
+            if plan.encodes("video"):
+                processed_video_codec = "hevc"
+        started = time.perf_counter()
+        subtitle_streams = sum(
+            1 for stream in probe["streams"] if stream.get("codec_type") == "subtitle"
+        )
+        subtitles = []
+        if self.subtitle and not subtitle_streams:
+            subtitles = self.find_subtitles(job)
+        if current_title_metadata == job.new_file_name and not (transcode or subtitles):
+            return
+        if self.lease_lost(job):
+            return
+        if not (transcode or subtitles) and self.set_title_in_place(job):
+            return
+        # Tags, codec changes and subtitles are all written by one ffmpeg run
+        ffmpeg_job = FfmpegJob(
+            job.new_media_file_path,
+            job.temporary_media_file_path,
+            job.output_parameters,
+            subtitles=[(language_code(language), path) for language, path in subtitles],
+            subtitle_codec="mov_text" if job.extension == "mp4" else "srt",
+            subtitle_offset=subtitle_streams,
+            encode_parameters={
+                "vcodec": "libx265",
+                "acodec": "aac",
+                "crf": self.crf,
+                "audio_bitrate": self.audio_bitrate,
+                "preset": self.preset,
+            },
+        )
+        for language, path in subtitles:
+            self.print(f"\t\tAdding {language} subtitles: {path}")
+        if transcode:
+            stage.name = "transcode"
+        else:
+            stage.name = "subtitle_mux" if subtitles else "remux"
+        segmented_video = (
+            self.segmented_video(probe, plan) if transcode and not subtitles else None
+        )
+        if segmented_video:
             try:
-                ffmpeg.input(self.new_media_file_path).output(
-                    self.temporary_media_file_path, **self.output_parameters
-                ).overwrite_output().run(quiet=self.quiet, overwrite_output=True)
+                self.encode_segmented(job, probe, segmented_video)
+                ffmpeg_job = None
             except Exception as e:
-                try:
-                    self.print(
-                        f"\t\tTrying to remap using alternative method...\n\t\tError: {e}"
-                    )
-                    ffmpeg.input(self.new_media_file_path).output(
-                        self.temporary_media_file_path, **self.output_parameters
-                    ).overwrite_output().run(quiet=self.quiet, overwrite_output=True)
-                except Exception as e:
-                    try:
-                        self.print(
-                            f"\t\tTrying to remap using alternative optimized method...\n\t\tError: {e}"
-                        )
-                        self.video_codec = "libx265"
-                        self.audio_codec = "aac"
-                        self.output_parameters["crf"] = self.crf
-                        self.output_parameters["audio_bitrate"] = self.audio_bitrate
-                        self.output_parameters["preset"] = self.preset
-                        output_parameters = {
-                            "map_metadata": 0,
-                            "map": 0,
-                            "vcodec": self.video_codec,
-                            "acodec": self.audio_codec,
-                            "metadata:g:0": f"title={self.new_file_name}",
-                            "metadata:g:1": f"comment={self.new_file_name}",
-                            "crf": self.crf,
-                            "audio_bitrate": self.audio_bitrate,
-                            "preset": self.preset,
-                        }
-                        ffmpeg.input(self.new_media_file_path).output(
-                            self.temporary_media_file_path, **output_parameters
-                        ).overwrite_output().run(
-                            quiet=self.quiet, overwrite_output=True
-                        )
-                    except Exception as e:
-                        self.print(
-                            f"\t\tError trying to remap using alternative method...\n\t\tError: {e}"
-                        )
-                        failure = True
-            if not failure:
-                os.remove(self.new_media_file_path)
-                os.rename(self.temporary_media_file_path, self.new_media_file_path)
-            self.media_file_index = 0
-        elif (
-            current_title_metadata != self.new_file_name
-            or (self.optimize and video_codec != "hevc")
-        ) and self.subtitle is True:
-            subtitle_file = "English.srt"
-            subtitle_files = []
-            if self.media_type == "series" and os.path.isdir(
-                f"{self.parent_directory}/{self.folder_name}/Subs"
-            ):
-                matching_video = 0
-                subtitle_directories = glob.glob(
-                    f"{self.parent_directory}/{self.folder_name}/Subs/*/",
-                    recursive=True,
-                )
-                subtitle_directories.sort()
-                for subtitle_directory_index in range(0, len(subtitle_directories)):
-                    if (
-                        self.new_file_name
-                        in subtitle_directories[subtitle_directory_index]
-                    ):
-                        matching_video = subtitle_directory_index
-                for file in os.listdir(f"{subtitle_directories[matching_video]}"):
-                    if os.path.isfile(file) and (
-                        file.endswith("English.srt") or file.endswith("Eng.srt")
-                    ):
-                        subtitle_files.append(
-                            os.path.join(subtitle_directories[matching_video], file)
-                        )
-                        subtitle_file = subtitle_files[0]
-            elif os.path.isdir(
-                os.path.normpath(
-                    os.path.join(self.parent_directory, self.folder_name, "Subs", "")
+                self.remove_temporary_file(job)
+                failure = classify_failure(getattr(e, "stderr", None))
+                self.print(
+                    f"\t\tSegmented encode failed ({failure})...\n\t\tError: {e}"
                 )
-            ):
-                for file in os.listdir(
-                    os.path.normpath(
-                        os.path.join(
-                            self.parent_directory, self.folder_name, "Subs", ""
-                        )
-                    )
-                ):
-                    if os.path.isfile(file) and (
-                        file.endswith("English.srt") or file.endswith("Eng.srt")
-                    ):
-                        subtitle_files.append(
-                            os.path.normpath(
-                                os.path.join(
-                                    self.parent_directory,
-                                    self.folder_name,
-                                    "Subs",
-                                    file,
-                                )
-                            )
-                        )
-                        subtitle_file = subtitle_files[0]
-            if self.file_extension == ".mkv":
-                scodec = "srt"
-            elif self.file_extension == ".mp4":
-                scodec = "mov_text"
-            else:
-                scodec = "srt"
-
-            subtitle_exists = False
-            for stream in ffmpeg.probe(self.new_media_file_path)["streams"]:
-                if "subtitle" in stream["codec_type"]:
-                    subtitle_exists = True
-
-            failure = False
-            if not subtitle_exists and os.path.isfile(subtitle_file):
-                input_ffmpeg = ffmpeg.input(self.new_media_file_path)
-                input_ffmpeg_subtitle = ffmpeg.input(subtitle_file)
-                input_subtitles = input_ffmpeg_subtitle["s"]
-                try:
-                    (
-                        ffmpeg.output(
-                            input_ffmpeg["v"],
-                            input_ffmpeg["a"],
-                            input_subtitles,
-                            self.temporary_media_file_path,
-                            scodec=scodec,
-                            **self.output_parameters,
-                        )
-                        .overwrite_output()
-                        .run(quiet=self.quiet, overwrite_output=True)
-                    )
-                except Exception:
-                    failure = True
-                if not failure:
-                    os.remove(self.new_media_file_path)
-                    os.rename(self.temporary_media_file_path, self.new_media_file_path)
-            elif not subtitle_exists and not os.path.isfile(subtitle_file):
-                try:
-                    ffmpeg.input(self.new_media_file_path).output(
-                        self.temporary_media_file_path, **self.output_parameters
-                    ).overwrite_output().run(quiet=self.quiet, overwrite_output=True)
-                except Exception:
-                    failure = True
-                if not failure:
-                    os.remove(self.new_media_file_path)
-                    os.rename(self.temporary_media_file_path, self.new_media_file_path)
-            self.media_file_index = 0
-        else:
-            self.media_file_index += 1
-            self.completed_media_files.append(self.media_files[current_index])
+                if failure in ENVIRONMENT_FAILURES:
+                    job.failed = True
+                    return
+                stage.retries += 1
+        if ffmpeg_job:
+            ffmpeg_job = self.run_ffmpeg_job(job, ffmpeg_job)
+            if ffmpeg_job is None:
+                job.failed = True
+                return
+            if ffmpeg_job.encodes_video:
+                processed_video_codec = "hevc"
+        if self.lease_lost(job):
+            self.remove_temporary_file(job)
             return
-        self.completed_media_files.append(self.media_files[current_index])
-        self.find_media()
+        self.replace_media_file(job)
+        job.processed_video_codec = processed_video_codec
+        self.record_transcode(job, estimate_id, started)
         logging.debug(
-            f"Completed File: {self.completed_media_files[len(self.completed_media_files) - 1]}\n"
-            f"All Completed Files: {self.completed_media_files}"
+            f"\tMetadata Updated: {os.path.basename(job.new_media_file_path)}"
         )
-        logging.debug(
-            f"\tMetadata Updated: {os.path.basename(self.new_media_file_path)}"
+
+    def lease_lost(self, job: MediaJob) -> bool:
+        """
+        Check whether a queued job lost its lease, right before it changes the
+        media file, and mark it failed if it did.
+
+        Args:
+        - job (MediaJob): Media file being processed.
+
+        Returns:
+        - True if the job must stop, because another host runs it again.
+        """
+        if job.lease is None or self.job_queue.heartbeat(job.lease):
+            return False
+        self.print(
+            f"\t\tLease lost, leaving {job.new_media_file_path} to the worker "
+            f"running the job again",
+            quiet=False,
+        )
+        job.failed = True
+        return True
+
+    def run_ffmpeg(self, job: MediaJob, stream: Any) -> None:
+        """
+        Run an ffmpeg command on a media file, reporting its progress.
+
+        Progress is read from ffmpeg's -progress output, printed on a status
+        line and passed to the progress callback, see set_progress_callback().
+        The run is counted in the current metrics stage.
+
+        Args:
+        - job (MediaJob): Media file being processed.
+        - stream (ffmpeg.nodes.OutputStream): Output of the ffmpeg command.
+        """
+        import ffmpeg
+
+        self.metrics.current().subprocesses += 1
+        try:
+            duration = float(
+                self.probe_cache.probe(job.new_media_file_path)["format"]["duration"]
+            )
+        except Exception:
+            duration = 0.0
+        process = (
+            stream.global_args("-progress", "pipe:1", "-nostats")
+            .overwrite_output()
+            .run_async(pipe_stdout=True, pipe_stderr=True)
         )
+        # Drain stderr meanwhile, so ffmpeg never blocks on a full pipe. It is
+        # kept to classify failures, and shown as it comes when verbose.
+        stderr = []
+
+        def read_stderr() -> None:
+            for line in process.stderr:
+                stderr.append(line)
+                if not self.quiet:
+                    sys.stderr.write(line.decode("utf-8", errors="replace"))
+
+        drain = threading.Thread(target=read_stderr, daemon=True)
+        drain.start()
+        if job.lease is not None:
+
+            def cancel() -> None:
+                # The host that reclaimed the lease runs the job again
+                while process.poll() is None:
+                    if job.lease.lost.wait(1.0):
+                        process.terminate()
+                        return
+
+            threading.Thread(target=cancel, daemon=True).start()
+        progress = self.progress.start(job.entry, job.new_media_file_path, duration)
+        try:
+            for block in parse_progress(
+                io.TextIOWrapper(process.stdout, encoding="utf-8", errors="replace")
+            ):
+                self.progress.update(progress, block)
+                self.print(
+                    f"\t{progress}".ljust(self.terminal_width), end="\r", quiet=False
+                )
+        finally:
+            process.wait()
+            drain.join()
+            self.progress.finish(progress)
+        if process.returncode:
+            raise ffmpeg.Error("ffmpeg", None, b"".join(stderr))
+
+    def run_ffmpeg_job(
+        self, job: MediaJob, ffmpeg_job: FfmpegJob
+    ) -> Optional[FfmpegJob]:
+        """
+        Run an ffmpeg job, falling back to another strategy only when the
+        cause of a failure, classified from the error output of ffmpeg, is
+        one that strategy can work around.
+
+        Args:
+        - job (MediaJob): Media file being processed.
+        - ffmpeg_job (FfmpegJob): Changes to write to the temporary file.
+
+        Returns:
+        - The FfmpegJob that succeeded, or None if every strategy failed.
+        """
+        import ffmpeg
+
+        stage = self.metrics.current()
+        while True:
+            try:
+                self.run_ffmpeg(job, ffmpeg_job.build())
+                return ffmpeg_job
+            except ffmpeg.Error as e:
+                error = e
+                failure = classify_failure(e.stderr)
+            except Exception as e:
+                error = e
+                failure = None
+            self.remove_temporary_file(job)
+            if job.lease is not None and job.lease.lost.is_set():
+                return None
+            fallback = ffmpeg_job.fallback(failure) if failure else None
+            if fallback is None:
+                self.print(
+                    f"\t\tffmpeg failed ({failure or 'error'}) using {ffmpeg_job}, "
+                    f"no other strategy applies...\n\t\tError: {last_line(error)}"
+                )
+                return None
+            self.print(
+                f"\t\tffmpeg failed ({failure}) using {ffmpeg_job}, "
+                f"trying {fallback}...\n\t\tError: {last_line(error)}"
+            )
+            stage.retries += 1
+            if fallback.encodes_video:
+                stage.name = "transcode"
+            ffmpeg_job = fallback
+
+    def remove_temporary_file(self, job: MediaJob) -> None:
+        """
+        Remove what a failed ffmpeg run wrote to the temporary file.
+
+        Args:
+        - job (MediaJob): Media file being processed.
+        """
+        try:
+            os.remove(job.temporary_media_file_path)
+        except FileNotFoundError:
+            pass
+
+    def replace_media_file(self, job: MediaJob) -> None:
+        """
+        Replace the media file with the temporary file ffmpeg wrote.
+
+        Args:
+        - job (MediaJob): Media file being processed.
+        """
+        stage = self.metrics.current()
+        if stage:
+            stage.bytes_read += os.path.getsize(job.new_media_file_path)
+            stage.bytes_written += os.path.getsize(job.temporary_media_file_path)
+        os.remove(job.new_media_file_path)
+        os.rename(job.temporary_media_file_path, job.new_media_file_path)
+
+    def set_title_in_place(self, job: MediaJob) -> bool:
+        """
+        Set the title and comment tags of a video file without rewriting it.
+
+        Args:
+        - job (MediaJob): Media file being processed.
+
+        Returns:
+        - True if the tags were written, or the file is skipped because it is
+          hardlinked, False if the file has to be remuxed instead.
+        """
+        try:
+            # Editing a hardlinked file in place would also change its other
+            # links, such as a download that is still seeding, and remuxing it
+            # would take up the space linking saved. The file is not recorded
+            # as clean, so a later run sets its tags once it is unlinked.
+            if not self.transfer.unshare(job.new_media_file_path, copy=False):
+                job.skipped = "hardlinked"
+                self.print(
+                    f"\t\tFile is hardlinked, skipping its tags: {job.new_media_file_path}",
+                    quiet=False,
+                )
+                return True
+            written = set_title_tags(
+                job.new_media_file_path, job.new_file_name, job.new_file_name
+            )
+        except (ContainerError, OSError) as e:
+            self.print(f"\t\tUnable to edit tags in place: {e}")
+            return False
+        if written:
+            self.metrics.current().name = "tag_edit"
+            self.print(f"\t\tTags updated in place: {job.new_media_file_path}")
+        else:
+            self.print("\t\tNo room to update tags in place, remuxing...")
+        return written
 
     # Rename directory
-    def rename_directory(self) -> None:
+    def rename_directory(self, job: MediaJob) -> None:
         """
         Rename the media directory.
+
+        Args:
+        - job (MediaJob): Media file being processed.
         """
-        if self.media_type == "music":
-            self.folder_name = self.folder_name
-        elif self.media_type == "series":
-            self.folder_name = re.sub(" - S[0-9]+E[0-9]+", "", self.new_file_name)
-        elif self.media_type == "media":
-            self.folder_name = self.new_file_name
-        # self.parent_directory = os.path.dirname(os.path.normpath(self.directory))
+        if job.media_type == "music":
+            job.folder_name = job.folder_name
+        elif job.media_type == "series":
+            job.folder_name = re.sub(" - S[0-9]+E[0-9]+", "", job.new_file_name)
+        elif job.media_type == "media":
+            job.folder_name = job.new_file_name
+        # job.parent_directory = os.path.dirname(os.path.normpath(job.directory))
         # Check if media folder name is the same as what is proposed
-        if os.path.normpath(os.path.join(self.directory, "")) != os.path.normpath(
-            os.path.join(self.parent_directory, self.folder_name, "")
+        if os.path.normpath(job.directory) == os.path.normpath(self.media_directory):
+            self.print(
+                f"\tNot renaming the media directory: {os.path.normpath(job.directory)}"
+            )
+        elif os.path.normpath(os.path.join(job.directory, "")) != os.path.normpath(
+            os.path.join(job.parent_directory, job.folder_name, "")
         ):
             self.print(
-                f"\tRenaming directory: \n\t\t{os.path.normpath(os.path.join(self.directory, ''))} \n\t\t➜\n\t\t"
-                f"{os.path.normpath(os.path.join(self.parent_directory, self.folder_name, ''))}"
+                f"\tRenaming directory: \n\t\t{os.path.normpath(os.path.join(job.directory, ''))} \n\t\t➜\n\t\t"
+                f"{os.path.normpath(os.path.join(job.parent_directory, job.folder_name, ''))}"
             )
             if os.path.isdir(
-                os.path.normpath(os.path.join(self.parent_directory, self.folder_name))
+                os.path.normpath(os.path.join(job.parent_directory, job.folder_name))
             ):
-                for file_name in os.listdir(self.directory):
+                for file_name in os.listdir(job.directory):
                     # construct full file path
-                    source = os.path.normpath(os.path.join(self.directory, file_name))
+                    source = os.path.normpath(os.path.join(job.directory, file_name))
                     destination = os.path.normpath(
-                        os.path.join(self.parent_directory, self.folder_name, file_name)
+                        os.path.join(job.parent_directory, job.folder_name, file_name)
                     )
                     # move only files
                     if os.path.isfile(source):
                         shutil.move(source, destination)
-                if os.path.isdir(
-                    os.path.normpath(os.path.join(self.directory, "Subs"))
-                ):
-                    subtitles = glob.glob(f"{self.directory}/Subs/*/", recursive=True)
+                        self.media_index.relocate(source, destination)
+                if os.path.isdir(os.path.normpath(os.path.join(job.directory, "Subs"))):
+                    subtitles = glob.glob(
+                        f"{glob.escape(job.directory)}/Subs/*/", recursive=True
+                    )
+                    # Create the target first, so the first subtitle folder merged is
+                    # moved into it rather than renamed to it
+                    os.makedirs(
+                        os.path.join(job.parent_directory, job.folder_name, "Subs"),
+                        exist_ok=True,
+                    )
                     for subtitle_directory in subtitles:
                         shutil.move(
                             f"{subtitle_directory}",
                             os.path.normpath(
                                 os.path.join(
-                                    self.parent_directory, self.folder_name, "Subs"
+                                    job.parent_directory, job.folder_name, "Subs"
                                 )
                             ),
                         )
-                    os.rmdir(os.path.normpath(os.path.join(self.directory, "Subs")))
-                os.rmdir(f"{self.directory}")
+                    os.rmdir(os.path.normpath(os.path.join(job.directory, "Subs")))
+                os.rmdir(f"{job.directory}")
             else:
                 os.rename(
-                    os.path.normpath(os.path.join(self.directory, "")),
+                    os.path.normpath(os.path.join(job.directory, "")),
                     os.path.normpath(
-                        os.path.join(self.parent_directory, self.folder_name)
+                        os.path.join(job.parent_directory, job.folder_name)
                     ),
                 )
-            self.find_media()
-            self.media_file_index = 0
+                self.media_index.relocate_directory(
+                    job.directory,
+                    os.path.join(job.parent_directory, job.folder_name),
+                )
+                if self.media_scanner:
+                    self.media_scanner.relocate(
+                        job.directory,
+                        os.path.join(job.parent_directory, job.folder_name),
+                    )
         else:
             self.print(
-                f"\tRenaming directory not needed: {os.path.normpath(os.path.join(self.directory, ''))}"
+                f"\tRenaming directory not needed: {os.path.normpath(os.path.join(job.directory, ''))}"
             )
 
-    # Cleanup Variables
-    def reset_variables(self) -> None:
-        """
-        Reset class variables to their initial state.
-        """
-        self.media_file = ""
-        self.media_file_index = 0
-        self.new_file_name = ""
-        self.new_media_file_path = ""
-        self.temporary_media_file_path = ""
-        self.file_name = ""
-        self.file_extension = ""
-        self.media_files = []
-        self.media_file_directories = []
-
     # Iterate through all media files found
     def clean_media(self) -> None:
         """
         Process and clean all media files found.
+
+        With more than one job, files are processed concurrently by a pool of
+        worker threads, see set_jobs(). Music files are recognized and tagged
+        afterwards by a MusicPipeline, see set_music_jobs().
         """
-        while self.media_file_index < len(self.media_files):
-            file_length = len(
-                str(os.path.basename(self.media_files[self.media_file_index]))
+        transcode_queue = None
+        if self.optimize:
+            # Files found so far and each batch the scan adds are queued in
+            # the background, so processing starts without waiting for probes
+            transcode_queue = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix="media-manager-eta"
             )
+            self.media_index.on_batch = partial(
+                transcode_queue.submit, self.queue_transcodes
+            )
+            self.media_index.on_batch(
+                [self.media_index.get(path) for path in self.media_index.paths()]
+            )
+        try:
+            self.process_media()
+        finally:
+            if transcode_queue is not None:
+                self.media_index.on_batch = None
+                transcode_queue.shutdown(wait=False)
+
+    def process_media(self) -> None:
+        """
+        Process the pending media files, see clean_media().
+        """
+        music_jobs = []
+        if self.jobs <= 1:
+            for media_entry in self.media_index.pending():
+                job = MediaJob(media_entry, self.movie_filters)
+                if self.is_music(job):
+                    music_jobs.append(job)
+                else:
+                    self.process_media_file(job)
+            self.clean_music(music_jobs)
+            return
+        pending = self.media_index.pending()
+        slots = threading.BoundedSemaphore(self.jobs)
+        with ThreadPoolExecutor(
+            max_workers=self.jobs, thread_name_prefix="media-manager-job"
+        ) as executor:
+            while True:
+                slots.acquire()
+                # Pulling from a streaming scan reads directories, so it
+                # must not interleave with a worker renaming one
+                with self.layout_lock:
+                    media_entry = next(pending, None)
+                if media_entry is None:
+                    slots.release()
+                    break
+                job = MediaJob(media_entry, self.movie_filters)
+                if self.is_music(job):
+                    music_jobs.append(job)
+                    slots.release()
+                    continue
+                executor.submit(self._run_media_job, job, slots)
+        self.clean_music(music_jobs)
+
+    def queue_transcodes(self, entries: List[MediaEntry]) -> None:
+        """
+        Queue the length of the video files to be transcoded, so the queue
+        ETA of the progress tracker covers every file found so far.
+
+        Args:
+        - entries (List[MediaEntry]): Index entries of the media files found.
+        """
+        for entry in entries:
+            media_file = entry.path
+            if (
+                os.path.splitext(media_file)[1][1:].lower()
+                not in self.supported_video_types
+            ):
+                continue
+            if self.state_store and self.state_store.is_clean(
+                media_file, subtitle=self.subtitle, optimize=self.optimize
+            ):
+                continue
+            try:
+                probe = self.probe_cache.probe(media_file)
+                duration = float(probe["format"]["duration"])
+            except Exception:
+                continue
+            # Files already processed meanwhile are left out
+            if entry.completed or entry.removed:
+                continue
+            if self.plan_streams(probe).transcode:
+                self.progress.queue(entry, duration)
+
+    def is_music(self, job: MediaJob) -> bool:
+        """
+        Check if a media file is tagged by the music pipeline.
+
+        Args:
+        - job (MediaJob): Media file to check.
+
+        Returns:
+        - True for audio files when music managing is enabled.
+        """
+        return job.extension in self.supported_audio_types and music_feature()
+
+    def clean_music(self, music_jobs: List[MediaJob]) -> None:
+        """
+        Recognize, tag and rename music files concurrently.
+
+        Args:
+        - music_jobs (List[MediaJob]): Music files to process.
+        """
+        if not music_jobs:
+            return
+        from media_manager.music_pipeline import MusicPipeline
+
+        MusicPipeline(
+            self,
+            recognizer=self.music_recognizer(),
+            concurrency=self.music_jobs,
+            rate_limit=self.recognition_rate,
+        ).run(music_jobs)
+
+    def _run_media_job(self, job: MediaJob, slots: threading.BoundedSemaphore) -> None:
+        try:
+            self.process_media_file(job)
+        except BaseException as e:
+            self.print(f"\tError processing {job.entry.path}: {e}", quiet=False)
+            with self.layout_lock:
+                self.media_index.complete(job.entry.path)
+        finally:
+            slots.release()
+
+    def process_media_file(self, job: MediaJob) -> None:
+        """
+        Run the clean pipeline on a single media file.
+
+        Renames and directory changes happen under the layout lock. Metadata
+        and transcoding happen outside of it, while the file's directory is
+        marked as in use so no other job renames or merges it meanwhile.
+
+        Args:
+        - job (MediaJob): Media file to process.
+        """
+        with self.metrics.stage("prepare", job.entry.path):
+            prepared = self.prepare_media_file(job)
+        if not prepared:
+            return
+        try:
+            with self.metrics.stage("metadata", job.entry.path):
+                self.set_media_metadata(job)
+        finally:
+            self.release_media_file(job)
+        with self.metrics.stage("finish", job.entry.path):
+            self.finish_media_file(job)
+
+    def prepare_media_file(self, job: MediaJob) -> bool:
+        """
+        Detect, rename and mark the directory of a media file as in use, ahead
+        of setting its metadata.
+
+        Args:
+        - job (MediaJob): Media file to process.
+
+        Returns:
+        - False if the file is already clean and was skipped.
+        """
+        media_entry = job.entry
+        with self.layout_lock:
+            file_length = len(str(os.path.basename(media_entry.path)))
             truncate_amount = 0
             if file_length > self.max_file_length:
                 truncate_amount = abs(self.max_file_length - file_length)
-            pretty_print_filename = str(
-                os.path.basename(self.media_files[self.media_file_index])
-            )
+            pretty_print_filename = str(os.path.basename(media_entry.path))
             pretty_print_filename = pretty_print_filename[truncate_amount:file_length]
+            # The total stays open ended until a streaming scan is done
+            total = f"{self.media_index.total}"
+            if self.media_index.streaming:
+                total += "+"
             processing_message = (
-                f"Processing ({len(self.completed_media_files)}/"
-                f"{self.total_media_files}): "
+                f"Processing ({self.media_index.completed}/{total}): "
                 f"{pretty_print_filename}"
             )
             max_line_length = max(self.max_file_length, len(processing_message))
             padding = " " * (max_line_length - len(processing_message))
             processing_message = (
-                f"Processing ({len(self.completed_media_files)}/"
-                f"{self.total_media_files}): "
+                f"Processing ({self.media_index.completed}/{total}): "
                 f"{pretty_print_filename}{padding}"
             )
             processing_message = processing_message.ljust(self.terminal_width)
             self.print(processing_message, end="\r", quiet=False)
             sys.stdout.flush()
-            self.directory = os.path.normpath(
-                os.path.dirname(self.media_files[self.media_file_index])
-            )
-            if not self.directory.endswith(os.path.sep):
-                self.directory += os.path.sep
-            self.media_file = os.path.basename(self.media_files[self.media_file_index])
-            self.file_name, self.file_extension = os.path.splitext(self.media_file)
-            self.new_file_name = self.file_name
-            self.build_output_parameters()
-            self.media_detection()
-            if self.file_extension[1:] in self.supported_video_types:
-                self.clean_file_name()
+            if self.state_store and self.state_store.is_clean(
+                media_entry.path, subtitle=self.subtitle, optimize=self.optimize
+            ):
+                self.print(f"\tAlready clean, skipping: {media_entry.path}")
+                self.media_index.complete(media_entry.path)
+                return False
+            # Jobs may be created before earlier jobs moved this file
+            job.refresh_directory()
+            job.media_file = os.path.basename(media_entry.path)
+            job.file_name, job.file_extension = os.path.splitext(job.media_file)
+            job.new_file_name = job.file_name
+            self.media_detection(job)
+            if job.extension in self.supported_video_types:
+                self.clean_file_name(job)
             # For Videos, rename the file before setting the metadata,
             # For Audio, set the metadata first, then rename the file
-            if self.file_extension[1:] in self.supported_video_types:
-                self.verify_parent_directory()
-                self.rename_file()
+            self.verify_parent_directory(job)
+            if job.extension in self.supported_video_types:
+                self.rename_file(job)
                 self.clean_subtitle_directory(
-                    subtitle_directory=f"{self.parent_directory}/{self.folder_name}/Subs"
+                    subtitle_directory=os.path.join(
+                        os.path.dirname(job.new_media_file_path), "Subs"
+                    )
                 )
-                self.set_media_metadata()
-            elif self.file_extension[1:] in self.supported_audio_types:
-                self.verify_parent_directory()
-                self.set_media_metadata()
-                self.rename_file()
-            self.rename_directory()
-            self.media_file_index += 1
-        self.reset_variables()
+            self.build_output_parameters(job)
+            job.working_directory = os.path.normpath(job.directory)
+            self.directory_users[job.working_directory] = (
+                self.directory_users.get(job.working_directory, 0) + 1
+            )
+        return True
+
+    def release_media_file(self, job: MediaJob) -> None:
+        """
+        Mark the directory of a media file as no longer in use by the job.
+
+        Args:
+        - job (MediaJob): Media file being processed.
+        """
+        self.progress.discard(job.entry)
+        with self.layout_lock:
+            self.directory_users[job.working_directory] -= 1
+            if not self.directory_users[job.working_directory]:
+                del self.directory_users[job.working_directory]
+            self.layout_lock.notify_all()
+
+    def finish_media_file(self, job: MediaJob) -> None:
+        """
+        Rename the media file and its directory once no other job uses the
+        directory, and record the outcome.
+
+        Args:
+        - job (MediaJob): Media file being processed.
+        """
+        with self.layout_lock:
+            # Wait for every other job in this directory before renaming it
+            self.layout_lock.wait_for(
+                lambda: job.working_directory not in self.directory_users
+            )
+            job.refresh_directory()
+            if job.extension in self.supported_audio_types:
+                self.rename_file(job)
+            self.rename_directory(job)
+            if self.state_store and not (job.failed or job.skipped):
+                self.record_state(job)
+            self.media_index.complete(job.entry.path)
+
+    def record_state(self, job: MediaJob) -> None:
+        """
+        Record the outcome of processing a media file in the state store.
+
+        Args:
+        - job (MediaJob): Media file that was processed.
+        """
+        media_file_path = job.entry.path
+        try:
+            identity = file_identity(media_file_path)
+        except OSError as e:
+            self.print(f"\tUnable to record state for {media_file_path}: {e}")
+            return
+        self.state_store.record(
+            FileState(
+                path=media_file_path,
+                identity=identity,
+                name=os.path.basename(media_file_path),
+                title=job.new_file_name,
+                video_codec=job.processed_video_codec,
+                subtitle=self.subtitle,
+                optimized=self.optimize,
+            )
+        )
+
+    def plan_media(
+        self, target_directories: Optional[Dict[str, str]] = None
+    ) -> MediaPlan:
+        """
+        Plan every change needed to clean the media directory, without making any.
+
+        Args:
+        - target_directories (Optional[Dict[str, str]]): Library directory to move
+          each media type ('series', 'media', 'music') to.
+
+        Returns:
+        - The MediaPlan, see MediaPlanner.
+        """
+        if not self.media_index and not self.media_index.streaming:
+            # Junk files are planned for removal rather than removed by the scan
+            remove_junk = self.remove_junk
+            self.remove_junk = False
+            try:
+                self.find_media(prefetch=False)
+            finally:
+                self.remove_junk = remove_junk
+        return MediaPlanner(self).plan(target_directories)
+
+    def execute_plan(self, plan: MediaPlan) -> None:
+        """
+        Apply a plan made by plan_media().
+
+        Args:
+        - plan (MediaPlan): Plan to apply.
+        """
+        PlanExecutor(self).execute(plan)
 
     # Move media to new destination
     def move_media(self, target_directory: str, media_type="media") -> None:
@@ -952,14 +2148,16 @@ def move_media(self, target_directory: str, media_type="media") -> None:
         if not os.path.isdir(target_directory):
             self.print(f"\nDirectory {target_directory} does not exist")
             return
-        self.completed_media_files = []
-        self.find_media()
-        self.print(f"\nMoving {media_type} ({len(self.media_file_directories)})...")
-        for media_directory_index in range(0, len(self.media_file_directories)):
+        if not self.media_index and not self.media_index.streaming:
+            self.find_media()
+        self.media_index.drain()
+        media_file_directories = self.media_index.directories()
+        self.print(f"\nMoving {media_type} ({len(media_file_directories)})...")
+        for media_directory_index in range(0, len(media_file_directories)):
             # Find if file inside this directory is named as a series
             move = False
             files = glob.glob(
-                f"{self.media_file_directories[media_directory_index]}/*",
+                f"{glob.escape(media_file_directories[media_directory_index])}/*",
                 recursive=True,
             )
             for file in files:
@@ -985,137 +2183,305 @@ def move_media(self, target_directory: str, media_type="media") -> None:
                     move = True
                     break
             file_length = len(
-                str(
-                    os.path.basename(self.media_file_directories[media_directory_index])
-                )
+                str(os.path.basename(media_file_directories[media_directory_index]))
             )
             truncate_amount = 0
             if file_length > self.max_file_length:
                 truncate_amount = abs(self.max_file_length - file_length)
             if move:
-                if os.path.isdir(
-                    os.path.join(
-                        target_directory,
-                        os.path.basename(
-                            self.media_file_directories[media_directory_index]
-                        ),
-                    )
-                ):
-                    media_directory = str(
-                        os.path.basename(
-                            self.media_file_directories[media_directory_index]
+                source_directory = media_file_directories[media_directory_index]
+                with self.metrics.stage("move", source_directory) as stage:
+                    # Moves within a file system are renames, without any data copied
+                    if stage and (
+                        os.stat(source_directory).st_dev
+                        != os.stat(target_directory).st_dev
+                    ):
+                        stage.bytes_read = stage.bytes_written = tree_size(
+                            source_directory
+                        )
+                    if os.path.isdir(
+                        os.path.join(
+                            target_directory,
+                            os.path.basename(
+                                media_file_directories[media_directory_index]
+                            ),
                         )
-                    )[truncate_amount:file_length]
-                    merging_message = (
-                        f"Merging {media_type} "
-                        f"({media_directory_index + 1}/{len(self.media_file_directories)}) "
-                        f"{media_directory} "
-                        f"➜ {target_directory}"
-                    )
-                    merging_message = merging_message.ljust(self.terminal_width)
-                    self.print(merging_message, end="\r", quiet=False)
-                    for file_name in os.listdir(
-                        self.media_file_directories[media_directory_index]
                     ):
-                        # construct full file path
-                        source = os.path.normpath(
-                            os.path.join(
-                                self.media_file_directories[media_directory_index],
-                                file_name,
+                        media_directory = str(
+                            os.path.basename(
+                                media_file_directories[media_directory_index]
                             )
+                        )[truncate_amount:file_length]
+                        merging_message = (
+                            f"Merging {media_type} "
+                            f"({media_directory_index + 1}/{len(media_file_directories)}) "
+                            f"{media_directory} "
+                            f"➜ {target_directory}"
                         )
-                        destination = os.path.normpath(
-                            os.path.join(
-                                target_directory,
-                                os.path.basename(
-                                    self.media_file_directories[media_directory_index]
-                                ),
+                        merging_message = merging_message.ljust(self.terminal_width)
+                        self.print(merging_message, end="\r", quiet=False)
+                        for file_name in os.listdir(
+                            media_file_directories[media_directory_index]
+                        ):
+                            # construct full file path
+                            source = os.path.normpath(
+                                os.path.join(
+                                    media_file_directories[media_directory_index],
+                                    file_name,
+                                )
                             )
-                        )
-                        # move only files
-                        if os.path.isfile(source):
-                            if os.path.isfile(destination):
-                                self.print(
-                                    f"\t\tFile already exists {destination}, skipping..."
+                            destination = os.path.normpath(
+                                os.path.join(
+                                    target_directory,
+                                    os.path.basename(
+                                        media_file_directories[media_directory_index]
+                                    ),
                                 )
-                            else:
-                                try:
-                                    shutil.move(source, destination)
-                                except Exception as e:
+                            )
+                            # move only files
+                            if os.path.isfile(source):
+                                if os.path.isfile(destination):
                                     self.print(
-                                        f"\t\tUnable to move to target directory: {target_directory}]\n\t\t"
-                                        f"Error: {e}",
-                                        quiet=False,
+                                        f"\t\tFile already exists {destination}, skipping..."
                                     )
-                    if os.path.isdir(
-                        os.path.normpath(
-                            os.path.join(
-                                self.media_file_directories[media_directory_index],
-                                "Subs",
+                                else:
+                                    try:
+                                        self.transfer.move(source, destination)
+                                        self.media_index.remove(source)
+                                    except Exception as e:
+                                        self.print(
+                                            f"\t\tUnable to move to target directory: {target_directory}]\n\t\t"
+                                            f"Error: {e}",
+                                            quiet=False,
+                                        )
+                        if os.path.isdir(
+                            os.path.normpath(
+                                os.path.join(
+                                    media_file_directories[media_directory_index],
+                                    "Subs",
+                                )
                             )
-                        )
-                    ):
-                        subtitles = glob.glob(
-                            f"{self.media_file_directories[media_directory_index]}/Subs/*/",
-                            recursive=True,
-                        )
-                        for subtitle_directory in subtitles:
-                            shutil.move(
-                                f"{subtitle_directory}",
+                        ):
+                            subtitles = glob.glob(
+                                f"{glob.escape(media_file_directories[media_directory_index])}/Subs/*/",
+                                recursive=True,
+                            )
+                            for subtitle_directory in subtitles:
+                                self.transfer.move(
+                                    f"{subtitle_directory}",
+                                    os.path.normpath(
+                                        os.path.join(
+                                            target_directory,
+                                            os.path.basename(
+                                                media_file_directories[
+                                                    media_directory_index
+                                                ]
+                                            ),
+                                            "Subs",
+                                        )
+                                    ),
+                                )
+                            shutil.rmtree(
                                 os.path.normpath(
                                     os.path.join(
-                                        target_directory,
-                                        os.path.basename(
-                                            self.media_file_directories[
-                                                media_directory_index
-                                            ]
-                                        ),
+                                        media_file_directories[media_directory_index],
                                         "Subs",
                                     )
                                 ),
+                                ignore_errors=True,
                             )
-                        shutil.rmtree(
-                            os.path.normpath(
-                                os.path.join(
-                                    self.media_file_directories[media_directory_index],
-                                    "Subs",
-                                )
-                            ),
-                            ignore_errors=True,
-                        )
-                    try:
-                        os.rmdir(
-                            f"{self.media_file_directories[media_directory_index]}"
-                        )
-                    except OSError:
-                        self.print(
-                            f"\t\tSkipping removal of "
-                            f"{self.media_file_directories[media_directory_index]}..."
-                        )
-                else:
-                    media_directory = str(
-                        os.path.basename(
-                            self.media_file_directories[media_directory_index]
+                        try:
+                            os.rmdir(f"{media_file_directories[media_directory_index]}")
+                        except OSError:
+                            self.print(
+                                f"\t\tSkipping removal of "
+                                f"{media_file_directories[media_directory_index]}..."
+                            )
+                    else:
+                        media_directory = str(
+                            os.path.basename(
+                                media_file_directories[media_directory_index]
+                            )
+                        )[truncate_amount:file_length]
+                        moving_message = (
+                            f"Moving {media_type} "
+                            f"({len(media_file_directories)}/{len(media_file_directories)}) "
+                            f"{media_directory} "
+                            f"➜ {target_directory}"
                         )
-                    )[truncate_amount:file_length]
-                    moving_message = (
-                        f"Moving {media_type} "
-                        f"({len(self.media_file_directories)}/{len(self.media_file_directories)}) "
-                        f"{media_directory} "
-                        f"➜ {target_directory}"
+                        moving_message = moving_message.ljust(self.terminal_width)
+                        self.print(moving_message, end="\r", quiet=False)
+                        try:
+                            self.transfer.move(
+                                media_file_directories[media_directory_index],
+                                target_directory,
+                            )
+                            self.media_index.remove_directory(
+                                media_file_directories[media_directory_index]
+                            )
+                        except Exception as e:
+                            self.print(
+                                f"\nUnable to move to target directory: {target_directory}]\n\t\tError: {e}",
+                                quiet=False,
+                            )
+
+    def directory_media_type(self, media_files: List[str]) -> str:
+        """
+        Get the media type of a directory from the media files in it.
+
+        Args:
+        - media_files (List[str]): Paths of the media files in the directory.
+
+        Returns:
+        - 'series' if a file is named as an episode, 'music' if a file is an
+          audio file, 'media' otherwise.
+        """
+        if any(
+            re.search("[Ss][0-9][0-9]*[Ee][0-9][0-9]*", os.path.basename(media_file))
+            for media_file in media_files
+        ):
+            return "series"
+        if any(
+            os.path.splitext(media_file)[1][1:].lower() in self.supported_audio_types
+            for media_file in media_files
+        ):
+            return "music"
+        return "media"
+
+    def import_media(
+        self,
+        target_directories: Dict[str, str],
+        names: Optional[Iterable[str]] = None,
+    ) -> None:
+        """
+        Link media into the library directories, then clean it there.
+
+        The media directory is left untouched, so downloads keep seeding:
+        media files and subtitles are hardlinked, reflinked or, failing both,
+        copied into a staging directory inside each library directory, see
+        TransferEngine.link_file(). Renames and metadata changes are made on
+        the linked files, which are then moved into the library directory.
+
+        Args:
+        - target_directories (Dict[str, str]): Library directory to import each
+          media type ('series', 'media', 'music') into.
+        - names (Optional[Iterable[str]]): Only import these entries of the
+          media directory, e.g. new downloads, or None to import all of them.
+        """
+        source_directory = self.media_directory
+        self.remove_junk = False
+        try:
+            self.find_media(prefetch=False, names=names)
+        finally:
+            self.remove_junk = True
+        staging_directories = {}
+        links = []
+        for directory in self.media_index.directories():
+            media_files = self.media_index.files_in_directory(directory)
+            media_type = self.directory_media_type(media_files)
+            if media_type not in target_directories:
+                continue
+            staging_directory = os.path.join(
+                target_directories[media_type], f".media-manager-import-{media_type}"
+            )
+            staging_directories[media_type] = staging_directory
+            destination = os.path.normpath(
+                os.path.join(
+                    staging_directory, os.path.relpath(directory, source_directory)
+                )
+            )
+            os.makedirs(destination, exist_ok=True)
+            for media_file in media_files:
+                links.append(
+                    (
+                        media_file,
+                        os.path.join(destination, os.path.basename(media_file)),
                     )
-                    moving_message = moving_message.ljust(self.terminal_width)
-                    self.print(moving_message, end="\r", quiet=False)
-                    try:
-                        shutil.move(
-                            self.media_file_directories[media_directory_index],
-                            target_directory,
+                )
+            for subtitle_directory, _, subtitle_files in os.walk(
+                os.path.join(directory, "Subs")
+            ):
+                subtitle_destination = os.path.normpath(
+                    os.path.join(
+                        destination, os.path.relpath(subtitle_directory, directory)
+                    )
+                )
+                os.makedirs(subtitle_destination, exist_ok=True)
+                for subtitle_file in subtitle_files:
+                    links.append(
+                        (
+                            os.path.join(subtitle_directory, subtitle_file),
+                            os.path.join(subtitle_destination, subtitle_file),
                         )
-                    except Exception as e:
-                        self.print(
-                            f"\nUnable to move to target directory: {target_directory}]\n\t\tError: {e}",
-                            quiet=False,
+                    )
+        self.print(f"\nLinking {len(links)} files into the library...", quiet=False)
+        copied = self.transfer.files_copied
+        try:
+            self.transfer.link_files(links)
+        except OSError as e:
+            self.print(f"\tUnable to link every file: {e}", quiet=False)
+        self.print(
+            f"\t{self.transfer.files_linked} hardlinked, "
+            f"{self.transfer.files_reflinked} reflinked, "
+            f"{self.transfer.files_copied - copied} copied",
+            quiet=False,
+        )
+        for media_type, staging_directory in staging_directories.items():
+            self.set_media_directory(staging_directory)
+            self.find_media(lazy=True)
+            self.clean_media()
+            self.move_media(
+                target_directory=target_directories[media_type], media_type=media_type
+            )
+            for directory, _, _ in os.walk(staging_directory, topdown=False):
+                try:
+                    os.rmdir(directory)
+                except OSError:
+                    self.print(
+                        f"\tLeaving files not imported in {directory}", quiet=False
+                    )
+        self.set_media_directory(source_directory)
+
+    def watch_media(
+        self,
+        target_directories: Dict[str, str],
+        watcher: DownloadWatcher,
+        link: bool = False,
+    ) -> None:
+        """
+        Process downloads as they finish, until stopped.
+
+        Only the downloads that settled are scanned, instead of the whole
+        media directory. A download failing to process is reported and
+        retried once it changes again.
+
+        Args:
+        - target_directories (Dict[str, str]): Library directory for each
+          media type ('series', 'media', 'music').
+        - watcher (DownloadWatcher): Watcher of the media directory.
+        - link (bool): Link media into the library instead of moving it.
+        """
+        self.print(
+            f"Watching {watcher.directory} for downloads "
+            f"({type(watcher.source).__name__.lower()})...",
+            quiet=False,
+        )
+        for names in watcher.batches():
+            self.print(f"\nDownloads finished: {', '.join(names)}", quiet=False)
+            try:
+                if link:
+                    self.import_media(
+                        target_directories=target_directories, names=names
+                    )
+                else:
+                    self.find_media(lazy=True, names=names)
+                    self.clean_media()
+                    for media_type, target_directory in target_directories.items():
+                        self.move_media(
+                            target_directory=target_directory, media_type=media_type
                         )
+            except Exception as e:
+                self.print(f"\tUnable to process {', '.join(names)}: {e}", quiet=False)
 
 
 def media_manager(argv):
@@ -1131,10 +2497,37 @@ def media_manager(argv):
     music_flag = False
     tv_flag = False
     subtitle_flag = False
+    subtitle_languages = ["English"]
     optimize_flag = False
     audio_bitrate = "128k"
     preset = "medium"
     crf = 28
+    bits_per_pixel = DEFAULT_BITS_PER_PIXEL
+    min_savings_ratio = None
+    segments = 1
+    queue_directory = None
+    worker_flag = False
+    idle_timeout = None
+    lease_timeout = 120.0
+    watch_flag = False
+    settle_seconds = 60.0
+    poll_interval = None
+    min_savings_bytes = None
+    max_depth = 3
+    jobs = 1
+    probe_workers = None
+    music_jobs = 4
+    transfer_jobs = 4
+    recognition_rate = None
+    excerpt_duration = None
+    excerpt_starts = [0.3, 0.6]
+    state_flag = True
+    reset_state_flag = False
+    link_flag = False
+    plan_file = None
+    apply_plan_file = None
+    metrics_file = None
+    metrics_textfile = None
     tv_directory = os.path.join(os.path.expanduser("~"), "Downloads")
     media_directory = os.path.join(os.path.expanduser("~"), "Downloads")
     music_directory = os.path.join(os.path.expanduser("~"), "Downloads")
@@ -1142,19 +2535,46 @@ def media_manager(argv):
     try:
         opts, args = getopt.getopt(
             argv,
-            "hvd:a:m:t:s",
+            "hvd:a:m:t:sj:",
             [
                 "help",
                 "crf=",
+                "idle-timeout=",
+                "lease-timeout=",
+                "queue=",
+                "worker",
+                "watch",
+                "settle=",
+                "poll=",
+                "jobs=",
+                "link",
                 "audio-bitrate=",
+                "bits-per-pixel=",
                 "media-directory=",
                 "tv-directory=",
                 "music-directory",
                 "directory=",
+                "excerpt-length=",
+                "excerpt-start=",
+                "apply-plan=",
+                "max-depth=",
+                "metrics=",
+                "metrics-textfile=",
+                "min-savings=",
+                "min-savings-gb=",
+                "music-jobs=",
+                "no-state",
                 "preset=",
+                "probe-workers=",
+                "recognition-rate=",
+                "reset-state",
+                "segments=",
+                "transfer-jobs=",
                 "subtitle",
+                "subtitle-languages=",
                 "verbose",
                 "optimize",
+                "plan=",
             ],
         )
     except getopt.GetoptError as e:
@@ -1169,8 +2589,34 @@ def media_manager(argv):
             audio_bitrate = arg
         elif opt in ("--crf"):
             crf = arg
+        elif opt == "--bits-per-pixel":
+            bits_per_pixel = float(arg)
+        elif opt == "--queue":
+            queue_directory = arg
+        elif opt == "--worker":
+            worker_flag = True
+        elif opt == "--idle-timeout":
+            idle_timeout = float(arg)
+        elif opt == "--lease-timeout":
+            lease_timeout = float(arg)
+        elif opt == "--watch":
+            watch_flag = True
+        elif opt == "--settle":
+            settle_seconds = float(arg)
+        elif opt == "--poll":
+            poll_interval = float(arg)
+        elif opt == "--segments":
+            segments = int(arg)
+        elif opt == "--min-savings":
+            min_savings_ratio = float(arg) / 100
+        elif opt == "--min-savings-gb":
+            min_savings_bytes = int(float(arg) * 1e9)
+        elif opt in ("-j", "--jobs"):
+            jobs = int(arg)
         elif opt in ("-d", "--directory"):
             source_directory = arg
+        elif opt == "--max-depth":
+            max_depth = int(arg) if int(arg) > 0 else None
         elif opt in ("-a", "--music-directory"):
             music_flag = True
             music_directory = arg
@@ -1181,35 +2627,181 @@ def media_manager(argv):
             optimize_flag = True
         elif opt in ("--preset"):
             preset = arg.lower()
+        elif opt == "--probe-workers":
+            probe_workers = int(arg)
+        elif opt == "--music-jobs":
+            music_jobs = int(arg)
+        elif opt == "--transfer-jobs":
+            transfer_jobs = int(arg)
+        elif opt == "--excerpt-length":
+            excerpt_duration = float(arg) if float(arg) > 0 else None
+        elif opt == "--excerpt-start":
+            excerpt_starts = [float(start) / 100 for start in arg.split(",")]
+        elif opt == "--recognition-rate":
+            recognition_rate = float(arg) if float(arg) > 0 else None
+        elif opt == "--link":
+            link_flag = True
+        elif opt == "--no-state":
+            state_flag = False
+        elif opt == "--reset-state":
+            reset_state_flag = True
+        elif opt == "--plan":
+            plan_file = arg
+        elif opt == "--apply-plan":
+            apply_plan_file = arg
+        elif opt == "--metrics":
+            metrics_file = arg
+        elif opt == "--metrics-textfile":
+            metrics_textfile = arg
         elif opt in ("-t", "--tv-directory"):
             tv_flag = True
             tv_directory = arg
         elif opt in ("-s", "--subtitle"):
             subtitle_flag = True
+        elif opt == "--subtitle-languages":
+            subtitle_languages = arg.split(",")
         elif opt in ("-v", "--verbose"):
             media_manager_instance.set_verbose(quiet=False)
 
     media_manager_instance.set_media_directory(media_directory=source_directory)
-    media_manager_instance.find_media()
+    media_manager_instance.set_max_depth(max_depth=max_depth)
+    if state_flag or reset_state_flag:
+        state_store = StateStore()
+        if reset_state_flag:
+            state_store.clear()
+        if not state_flag:
+            # Only reset the record, this run processes every file regardless
+            state_store.close()
+    if state_flag:
+        media_manager_instance.set_state_store(state_store=state_store)
+        media_manager_instance.set_probe_cache(
+            ProbeCache(state_store=state_store, max_workers=probe_workers)
+        )
+    else:
+        media_manager_instance.set_probe_cache(ProbeCache(max_workers=probe_workers))
+    # Recognitions and artwork are keyed by content, not by the recorded state
+    media_manager_instance.set_recognition_cache(RecognitionCache())
+    media_manager_instance.set_artwork_cache(
+        ArtworkCache(pool=media_manager_instance.connection_pool)
+    )
+    media_manager_instance.set_metrics(
+        Metrics(path=metrics_file, textfile=metrics_textfile)
+    )
     media_manager_instance.set_crf(crf=crf)
     media_manager_instance.set_preset(preset=preset)
     media_manager_instance.set_audio_bitrate(audio_bitrate=audio_bitrate)
+    media_manager_instance.set_bits_per_pixel(bits_per_pixel=bits_per_pixel)
+    media_manager_instance.set_segments(segments=segments)
+    media_manager_instance.set_estimator(
+        SizeEstimator(
+            min_savings_ratio=min_savings_ratio, min_savings_bytes=min_savings_bytes
+        )
+    )
     media_manager_instance.set_optimize(optimize=optimize_flag)
     media_manager_instance.set_subtitle(subtitle=subtitle_flag)
-    media_manager_instance.clean_media()
-
-    if tv_flag:
-        media_manager_instance.move_media(
-            target_directory=tv_directory, media_type="series"
+    media_manager_instance.set_subtitle_languages(subtitle_languages=subtitle_languages)
+    media_manager_instance.set_jobs(jobs=jobs)
+    media_manager_instance.set_music_jobs(music_jobs=music_jobs)
+    media_manager_instance.set_transfer_jobs(transfer_jobs=transfer_jobs)
+    media_manager_instance.set_recognition_rate(recognition_rate=recognition_rate)
+    media_manager_instance.set_excerpt(
+        excerpt_duration=excerpt_duration, excerpt_starts=excerpt_starts
+    )
+    if worker_flag and not queue_directory:
+        print("Argument Error: --worker needs --queue")
+        usage()
+        sys.exit(2)
+    if queue_directory:
+        media_manager_instance.set_job_queue(
+            JobQueue(
+                queue_directory,
+                lease_timeout=lease_timeout,
+                heartbeat_interval=min(15.0, lease_timeout / 4),
+            )
         )
+    if worker_flag:
+        try:
+            processed = media_manager_instance.run_worker(idle_timeout=idle_timeout)
+            print(f"\nProcessed {processed} jobs")
+        except KeyboardInterrupt:
+            print("\nStopped, the job in progress was returned to the queue")
+        media_manager_instance.probe_cache.close()
+        media_manager_instance.metrics.close()
+        if media_manager_instance.state_store:
+            media_manager_instance.state_store.close()
+        return
+    target_directories = {}
+    if tv_flag:
+        target_directories["series"] = tv_directory
     if media_flag:
-        media_manager_instance.move_media(
-            target_directory=media_directory, media_type="media"
-        )
+        target_directories["media"] = media_directory
     if music_flag:
-        media_manager_instance.move_media(
-            target_directory=music_directory, media_type="music"
+        target_directories["music"] = music_directory
+
+    if plan_file:
+        plan = media_manager_instance.plan_media(target_directories=target_directories)
+        if plan_file == "-":
+            print(plan.to_json())
+        else:
+            plan.save(plan_file)
+            print(f"Plan with {len(plan)} operations written to {plan_file}")
+            for kind, count in plan.summary().items():
+                print(f"\t{kind}: {count}")
+        media_manager_instance.probe_cache.close()
+        media_manager_instance.connection_pool.close()
+        media_manager_instance.metrics.close()
+        if media_manager_instance.state_store:
+            media_manager_instance.state_store.close()
+        return
+    if apply_plan_file:
+        media_manager_instance.execute_plan(MediaPlan.load(apply_plan_file))
+        media_manager_instance.probe_cache.close()
+        media_manager_instance.connection_pool.close()
+        media_manager_instance.metrics.close()
+        if media_manager_instance.state_store:
+            media_manager_instance.state_store.close()
+        print("\nComplete!")
+        return
+
+    if watch_flag:
+        watcher = DownloadWatcher(
+            source_directory,
+            settle_seconds=settle_seconds,
+            poll_interval=poll_interval,
         )
+        try:
+            media_manager_instance.watch_media(
+                target_directories=target_directories,
+                watcher=watcher,
+                link=link_flag,
+            )
+        except KeyboardInterrupt:
+            print("\nStopped watching")
+        finally:
+            watcher.close()
+    elif link_flag:
+        media_manager_instance.import_media(target_directories=target_directories)
+    else:
+        media_manager_instance.find_media(lazy=True)
+        media_manager_instance.clean_media()
+        for media_type, target_directory in target_directories.items():
+            media_manager_instance.move_media(
+                target_directory=target_directory, media_type=media_type
+            )
+    if media_manager_instance.estimator.enabled and media_manager_instance.state_store:
+        accuracy = media_manager_instance.state_store.estimate_accuracy()
+        if accuracy["measured"]:
+            print(
+                f"\nTranscode estimates: {accuracy['measured']} measured, "
+                f"size off by {accuracy['size_error']:.1%} and "
+                f"time off by {accuracy['time_error']:.1%} on average, "
+                f"{accuracy['skipped']} of {accuracy['estimates']} not worth transcoding"
+            )
+    media_manager_instance.probe_cache.close()
+    media_manager_instance.connection_pool.close()
+    media_manager_instance.metrics.close()
+    if media_manager_instance.state_store:
+        media_manager_instance.state_store.close()
     print("\nComplete!")
 
 
@@ -1225,11 +2817,38 @@ def usage():
         f"\nUsage:\n"
         f"-h | --help            [ See usage ]\n"
         f"-d | --directory       [ Directory to scan for media ]\n"
+        f"-j | --jobs            [ Number of media files to process concurrently (Default: 1) ]\n"
+        f"--max-depth            [ Maximum folder depth to scan, 0 for unlimited (Default: 3) ]\n"
         f"--media-directory      [ Directory to move Media ]\n"
         f"--music-directory      [ Directory to move Music ]\n"
         f"--tv-directory         [ Directory to move Series ]\n"
+        f"--link                 [ Hardlink or reflink media into the directories above instead of moving it, leaving downloads to seed ]\n"
+        f"--watch                [ Keep running and process downloads as they finish instead of scanning once ]\n"
+        f"--settle               [ Seconds a download must stay unchanged before --watch processes it (Default: 60) ]\n"
+        f"--poll                 [ Poll for downloads every this many seconds instead of using inotify, e.g. on network mounts ]\n"
         f"--subtitle             [ Apply subtitle in media Sub folder ]\n"
-        f"--optimize             [ Optimize video for streaming in HEVC ]\n"
+        f"--subtitle-languages   [ Comma separated languages of the subtitles applied, in order (Default: English) ]\n"
+        f"--optimize             [ Optimize video for streaming in HEVC, encoding only the streams that need it ]\n"
+        f"--queue                [ Hand video processing to --worker processes through this directory on a shared file system ]\n"
+        f"--worker               [ Process video jobs from the --queue directory, on any host mounting it ]\n"
+        f"--idle-timeout         [ Seconds without a job after which a --worker stops (Default: never) ]\n"
+        f"--lease-timeout        [ Seconds without a heartbeat after which a job is taken from its --worker, the same on every host (Default: 120) ]\n"
+        f"--segments             [ Split each video --optimize encodes into this many segments encoded concurrently (Default: 1) ]\n"
+        f"--min-savings          [ Only transcode when sample encodes project saving this many percent of the size ]\n"
+        f"--min-savings-gb       [ Only transcode when sample encodes project saving this many GB ]\n"
+        f"--bits-per-pixel       [ Video bits per pixel below which --optimize copies the video (Default: {DEFAULT_BITS_PER_PIXEL}) ]\n"
+        f"--music-jobs           [ Number of music files recognized concurrently (Default: 4) ]\n"
+        f"--recognition-rate     [ Maximum music recognition requests per second (Default: no limit) ]\n"
+        f"--excerpt-length       [ Recognize music from excerpts of this many seconds, 0 for whole files (Default: 0) ]\n"
+        f"--excerpt-start        [ Comma separated start of each excerpt tried, in percent of the track (Default: 30,60) ]\n"
+        f"--transfer-jobs        [ Number of files copied concurrently when moving to another file system (Default: 4) ]\n"
+        f"--probe-workers        [ Number of concurrent ffprobe processes (Default: 8) ]\n"
+        f"--no-state             [ Do not skip files recorded as clean by previous runs ]\n"
+        f"--reset-state          [ Invalidate the record of files processed by previous runs ]\n"
+        f"--plan                 [ Write the planned changes as JSON to a file (- for stdout) without making them ]\n"
+        f"--apply-plan           [ Apply a plan written by --plan ]\n"
+        f"--metrics              [ Append per-stage timings as JSON lines to a file (- for stderr) ]\n"
+        f"--metrics-textfile     [ Write run metrics to a Prometheus node_exporter textfile ]\n"
         f"-v | --verbose         [ Show Output of FFMPEG ]\n"
         f"\nExample:\n"
         f'media-manager -d "~/Downloads" -m "~/User/Media/Movies" -t "~/User/Media/TV" -s\n'
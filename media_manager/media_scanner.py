@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+from typing import Iterable, Iterator, List, Optional, Set, Tuple
+
+
+class ScanDirectory:
+    """
+    Entries found in a single directory by the MediaScanner.
+
+    Attributes:
+    - path: Path of the directory.
+    - depth: Depth of the directory below the scanned root (root is 0).
+    - media: DirEntry objects for candidate media files.
+    - junk: DirEntry objects for junk files (e.g. .nfo, .exe).
+    - skipped: DirEntry objects that were neither media nor junk, or were not descended into.
+    - subtitle_directories: Paths of the Subs directories inside the directory.
+    """
+
+    __slots__ = ("path", "depth", "media", "junk", "skipped", "subtitle_directories")
+
+    def __init__(self, path: str, depth: int):
+        self.path = path
+        self.depth = depth
+        self.media: List[os.DirEntry] = []
+        self.junk: List[os.DirEntry] = []
+        self.skipped: List[os.DirEntry] = []
+        self.subtitle_directories: List[str] = []
+
+
+class MediaScanner:
+    """
+    Single-pass streaming directory walker built on os.scandir.
+
+    Each directory is read exactly once and its entries are classified from
+    the DirEntry type information, so no extra stat calls are made during the
+    walk. Results are yielded one directory at a time, so processing can start
+    while the rest of the tree is still being enumerated.
+
+    Attributes:
+    - media_extensions: Set of media file extensions without the leading dot.
+    - junk_extensions: Set of junk file extensions without the leading dot.
+    - max_depth: Maximum depth of files below the root to yield, or None for unlimited.
+    - media_count: Number of media files found so far.
+    - junk_count: Number of junk files found so far.
+    - skipped_count: Number of entries skipped so far.
+    - known_directories: Every directory seen so far, including ones not descended into.
+    - root_files: Names of the files directly inside the scanned root.
+    - junk_files: Paths of the junk files found so far.
+    """
+
+    def __init__(
+        self,
+        media_extensions: Iterable[str],
+        junk_extensions: Iterable[str] = ("nfo", "exe"),
+        max_depth: Optional[int] = 3,
+    ):
+        """
+        Initialize the MediaScanner.
+
+        Args:
+        - media_extensions (Iterable[str]): Media file extensions without the leading dot.
+        - junk_extensions (Iterable[str]): Junk file extensions without the leading dot.
+        - max_depth (Optional[int]): Maximum depth of files below the root, or None for unlimited.
+        """
+        self.media_extensions = {extension.lower() for extension in media_extensions}
+        self.junk_extensions = {extension.lower() for extension in junk_extensions}
+        self.max_depth = max_depth
+        self.media_count = 0
+        self.junk_count = 0
+        self.skipped_count = 0
+        self.known_directories: Set[str] = set()
+        self.root_files: List[str] = []
+        self.junk_files: List[str] = []
+        self._queue: List[Tuple[str, int]] = []
+
+    def walk(
+        self, directory: str, names: Optional[Iterable[str]] = None
+    ) -> Iterator[ScanDirectory]:
+        """
+        Walk a directory tree depth first, in sorted order.
+
+        Args:
+        - directory (str): Root directory to scan.
+        - names (Optional[Iterable[str]]): Only scan these entries of the root
+          directory, e.g. new downloads, or None to scan all of them.
+
+        Returns:
+        - Iterator of ScanDirectory results, one per directory read.
+        """
+        self._queue = [(os.path.normpath(directory), 0)]
+        names = None if names is None else set(names)
+        self.known_directories.add(os.path.normpath(directory))
+        while self._queue:
+            path, depth = self._queue.pop()
+            result = ScanDirectory(path, depth)
+            try:
+                with os.scandir(path) as iterator:
+                    entries = sorted(iterator, key=lambda entry: entry.name)
+            except OSError:
+                # Directory vanished (renamed or merged by processing) or is unreadable
+                continue
+            if names is not None and depth == 0:
+                entries = [entry for entry in entries if entry.name in names]
+            subdirectories = []
+            for entry in entries:
+                if entry.name.startswith("."):
+                    result.skipped.append(entry)
+                    continue
+                try:
+                    is_directory = entry.is_dir()
+                except OSError:
+                    result.skipped.append(entry)
+                    continue
+                if is_directory:
+                    self.known_directories.add(entry.path)
+                    if entry.name.lower() == "subs":
+                        result.subtitle_directories.append(entry.path)
+                    if self.max_depth is None or depth + 2 <= self.max_depth:
+                        subdirectories.append(entry.path)
+                    else:
+                        result.skipped.append(entry)
+                    continue
+                extension = os.path.splitext(entry.name)[1][1:].lower()
+                if extension in self.junk_extensions:
+                    result.junk.append(entry)
+                    self.junk_files.append(entry.path)
+                    continue
+                if extension in self.media_extensions:
+                    result.media.append(entry)
+                else:
+                    result.skipped.append(entry)
+                if depth == 0:
+                    self.root_files.append(entry.name)
+            self.media_count += len(result.media)
+            self.junk_count += len(result.junk)
+            self.skipped_count += len(result.skipped)
+            for subdirectory in reversed(subdirectories):
+                self._queue.append((subdirectory, depth + 1))
+            yield result
+
+    def relocate(self, old_directory: str, new_directory: str) -> None:
+        """
+        Re-point directories that are queued for scanning after a directory was renamed.
+
+        Args:
+        - old_directory (str): Previous path of the directory.
+        - new_directory (str): New path of the directory.
+        """
+        old_directory = os.path.normpath(old_directory)
+        new_directory = os.path.normpath(new_directory)
+        prefix = os.path.join(old_directory, "")
+        for position, (path, depth) in enumerate(self._queue):
+            if path == old_directory or path.startswith(prefix):
+                self._queue[position] = (
+                    new_directory + path[len(old_directory) :],
+                    depth,
+                )
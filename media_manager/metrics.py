@@ -0,0 +1,423 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import json
+import math
+import time
+import tempfile
+import threading
+from typing import Any, Dict, Iterable, List, Optional, TextIO
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    """
+    Get a percentile of a list of values, using the nearest rank method.
+
+    Args:
+    - values (List[float]): Values, sorted in ascending order.
+    - fraction (float): Percentile, as a fraction between 0 and 1.
+
+    Returns:
+    - The percentile, or 0 for an empty list.
+    """
+    if not values:
+        return 0.0
+    return values[max(0, math.ceil(fraction * len(values)) - 1)]
+
+
+def tree_size(path: str) -> int:
+    """
+    Get the total size of the files in a directory tree.
+
+    Args:
+    - path (str): Path of a file or directory.
+
+    Returns:
+    - Size in bytes.
+    """
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    size = 0
+    for directory, _, files in os.walk(path):
+        for file_name in files:
+            try:
+                size += os.path.getsize(os.path.join(directory, file_name))
+            except OSError:
+                pass
+    return size
+
+
+class Stage:
+    """
+    Timing and counters of one stage of processing one media file.
+
+    Used as a context manager, see Metrics.stage(). The stage is recorded when
+    the context exits. Its name may be changed meanwhile, once it is known
+    what the stage actually did.
+
+    Attributes:
+    - name: Name of the stage.
+    - path: Path of the media file or directory processed, or None.
+    - seconds: Wall time of the stage.
+    - bytes_read: Number of bytes read.
+    - bytes_written: Number of bytes written.
+    - subprocesses: Number of subprocesses run.
+    - retries: Number of attempts retried after a failure.
+    - error: Flag indicating whether the stage raised an exception.
+    """
+
+    __slots__ = (
+        "metrics",
+        "name",
+        "path",
+        "started",
+        "seconds",
+        "bytes_read",
+        "bytes_written",
+        "subprocesses",
+        "retries",
+        "error",
+    )
+
+    def __init__(self, metrics: Optional["Metrics"], name: str, path: Optional[str]):
+        """
+        Initialize the Stage.
+
+        Args:
+        - metrics (Optional[Metrics]): Metrics recording the stage, None for a stage that is not recorded.
+        - name (str): Name of the stage.
+        - path (Optional[str]): Path of the media file or directory processed.
+        """
+        self.metrics = metrics
+        self.name = name
+        self.path = path
+        self.started = 0.0
+        self.seconds = 0.0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.subprocesses = 0
+        self.retries = 0
+        self.error = False
+
+    def __bool__(self) -> bool:
+        return self.metrics is not None
+
+    def __enter__(self) -> "Stage":
+        if self.metrics is not None:
+            self.metrics._push(self)
+            self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> bool:
+        if self.metrics is not None:
+            self.seconds = time.perf_counter() - self.started
+            self.error = exc_type is not None
+            self.metrics._pop()
+            self.metrics.add(self)
+        return False
+
+
+# Returned by disabled Metrics, so instrumented code costs one attribute check
+NULL_STAGE = Stage(None, "", None)
+
+
+class Metrics:
+    """
+    Per-stage timing instrumentation of clean and move runs.
+
+    Every stage of every media file is written as a JSON line when it ends.
+    When the run is closed, per-stage aggregates (p50/p95 wall time, bytes,
+    subprocesses and retries) and run totals (files/s, MB/s) are written as a
+    last JSON line, and optionally as a Prometheus textfile for the
+    node_exporter textfile collector. Stages nest, e.g. the probe stage is
+    part of the metadata stage that waits for it.
+
+    When no output is configured, stage() returns a shared no-op stage and
+    nothing is recorded.
+
+    Attributes:
+    - path: File the JSON lines are appended to, '-' for stderr, or None.
+    - textfile: Path of the Prometheus textfile written by close(), or None.
+    - enabled: Flag indicating whether stages are recorded.
+    """
+
+    def __init__(self, path: Optional[str] = None, textfile: Optional[str] = None):
+        """
+        Initialize the Metrics.
+
+        Args:
+        - path (Optional[str]): File the JSON lines are appended to, '-' for stderr.
+        - textfile (Optional[str]): Path of the Prometheus textfile written by close().
+        """
+        self.path = path
+        self.textfile = textfile
+        self.enabled = bool(path or textfile)
+        self.lock = threading.Lock()
+        self._local = threading.local()
+        self._samples: Dict[str, List[float]] = {}
+        self._totals: Dict[str, Dict[str, int]] = {}
+        self._started = time.perf_counter()
+        self._output: Optional[TextIO] = None
+        self._closed = False
+
+    def stage(self, name: str, path: Optional[str] = None) -> Stage:
+        """
+        Time a stage, as a context manager.
+
+        Args:
+        - name (str): Name of the stage.
+        - path (Optional[str]): Path of the media file or directory processed.
+
+        Returns:
+        - The Stage, whose counters can be updated until the context exits.
+        """
+        if not self.enabled:
+            return NULL_STAGE
+        return Stage(self, name, path)
+
+    def current(self) -> Stage:
+        """
+        Get the innermost stage running on this thread.
+
+        Returns:
+        - The Stage, or a no-op stage when there is none.
+        """
+        if not self.enabled:
+            return NULL_STAGE
+        stack = getattr(self._local, "stack", None)
+        return stack[-1] if stack else NULL_STAGE
+
+    def record(
+        self, name: str, seconds: float, path: Optional[str] = None, **counters: int
+    ) -> None:
+        """
+        Record a stage timed by the caller, e.g. one spanning coroutine switches.
+
+        Args:
+        - name (str): Name of the stage.
+        - seconds (float): Wall time of the stage.
+        - path (Optional[str]): Path of the media file or directory processed.
+        - counters (int): Stage attributes to set, e.g. bytes_read or error.
+        """
+        if not self.enabled:
+            return
+        stage = Stage(self, name, path)
+        stage.seconds = seconds
+        for counter, value in counters.items():
+            setattr(stage, counter, value)
+        self.add(stage)
+
+    def iterate(self, name: str, iterable: Iterable[Any]) -> Iterable[Any]:
+        """
+        Time the production of every item of an iterable as a stage.
+
+        Args:
+        - name (str): Name of the stage.
+        - iterable (Iterable[Any]): Iterable to time.
+
+        Returns:
+        - Iterable of the same items.
+        """
+        if not self.enabled:
+            return iterable
+        return self._iterate(name, iter(iterable))
+
+    def _iterate(self, name: str, iterator):
+        while True:
+            started = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            self.record(
+                name, time.perf_counter() - started, getattr(item, "path", None)
+            )
+            yield item
+
+    def _push(self, stage: Stage) -> None:
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        stack.append(stage)
+
+    def _pop(self) -> None:
+        self._local.stack.pop()
+
+    def add(self, stage: Stage) -> None:
+        """
+        Record a finished stage.
+
+        Args:
+        - stage (Stage): The finished stage.
+        """
+        event = {
+            "event": "stage",
+            "time": round(time.time(), 3),
+            "stage": stage.name,
+            "path": stage.path,
+            "seconds": round(stage.seconds, 6),
+            "bytes_read": stage.bytes_read,
+            "bytes_written": stage.bytes_written,
+            "subprocesses": stage.subprocesses,
+            "retries": stage.retries,
+            "error": stage.error,
+        }
+        with self.lock:
+            self._samples.setdefault(stage.name, []).append(stage.seconds)
+            totals = self._totals.setdefault(
+                stage.name,
+                {
+                    "bytes_read": 0,
+                    "bytes_written": 0,
+                    "subprocesses": 0,
+                    "retries": 0,
+                    "errors": 0,
+                },
+            )
+            totals["bytes_read"] += stage.bytes_read
+            totals["bytes_written"] += stage.bytes_written
+            totals["subprocesses"] += stage.subprocesses
+            totals["retries"] += stage.retries
+            totals["errors"] += stage.error
+            self._write(event)
+
+    def _write(self, event: Dict[str, Any]) -> None:
+        if not self.path:
+            return
+        if self._output is None:
+            self._output = (
+                sys.stderr if self.path == "-" else open(self.path, "a", buffering=1)
+            )
+        self._output.write(json.dumps(event) + "\n")
+
+    def summary(self) -> Dict[str, Any]:
+        """
+        Aggregate the stages recorded so far.
+
+        Files are counted by the prepare stage every processed file goes through.
+
+        Returns:
+        - Dictionary of run totals, with per-stage aggregates under 'stages'.
+        """
+        seconds = time.perf_counter() - self._started
+        stages = {}
+        with self.lock:
+            for name, samples in self._samples.items():
+                ordered = sorted(samples)
+                total = sum(ordered)
+                totals = self._totals[name]
+                stages[name] = {
+                    "count": len(ordered),
+                    "seconds": total,
+                    "p50": percentile(ordered, 0.5),
+                    "p95": percentile(ordered, 0.95),
+                    "max": ordered[-1],
+                    **totals,
+                    "mb_per_second": (
+                        totals["bytes_read"] / total / 1e6 if total else 0.0
+                    ),
+                }
+        files = stages.get("prepare", {}).get("count", 0)
+        bytes_read = sum(stage["bytes_read"] for stage in stages.values())
+        return {
+            "event": "run",
+            "time": round(time.time(), 3),
+            "seconds": seconds,
+            "files": files,
+            "files_per_second": files / seconds if seconds else 0.0,
+            "bytes_read": bytes_read,
+            "mb_per_second": bytes_read / seconds / 1e6 if seconds else 0.0,
+            "stages": stages,
+        }
+
+    def textfile_metrics(self, summary: Dict[str, Any]) -> str:
+        """
+        Format a run summary in the Prometheus text exposition format.
+
+        Args:
+        - summary (Dict[str, Any]): Run summary, see summary().
+
+        Returns:
+        - The metrics text.
+        """
+        lines = [
+            "# HELP media_manager_stage_seconds Wall time of each stage in the last run.",
+            "# TYPE media_manager_stage_seconds summary",
+        ]
+        stages = summary["stages"]
+        for name, stage in sorted(stages.items()):
+            for quantile in ("p50", "p95"):
+                lines.append(
+                    f'media_manager_stage_seconds{{stage="{name}",'
+                    f'quantile="{int(quantile[1:]) / 100}"}} {stage[quantile]}'
+                )
+            lines.append(
+                f'media_manager_stage_seconds_sum{{stage="{name}"}} {stage["seconds"]}'
+            )
+            lines.append(
+                f'media_manager_stage_seconds_count{{stage="{name}"}} {stage["count"]}'
+            )
+        for counter, metric, description in (
+            ("bytes_read", "read_bytes", "Bytes read"),
+            ("bytes_written", "written_bytes", "Bytes written"),
+            ("subprocesses", "subprocesses", "Subprocesses run"),
+            ("retries", "retries", "Attempts retried"),
+            ("errors", "errors", "Stages failed"),
+        ):
+            lines.append(
+                f"# HELP media_manager_stage_{metric} {description} by each stage in the last run."
+            )
+            lines.append(f"# TYPE media_manager_stage_{metric} gauge")
+            for name, stage in sorted(stages.items()):
+                lines.append(
+                    f'media_manager_stage_{metric}{{stage="{name}"}} {stage[counter]}'
+                )
+        for key, metric, description in (
+            ("seconds", "duration_seconds", "Wall time of the last run."),
+            ("files", "files", "Media files processed by the last run."),
+            ("files_per_second", "files_per_second", "Files processed per second."),
+            (
+                "mb_per_second",
+                "read_megabytes_per_second",
+                "Megabytes read per second.",
+            ),
+            ("time", "last_run_timestamp_seconds", "End time of the last run."),
+        ):
+            lines.append(f"# HELP media_manager_run_{metric} {description}")
+            lines.append(f"# TYPE media_manager_run_{metric} gauge")
+            lines.append(f"media_manager_run_{metric} {summary[key]}")
+        return "\n".join(lines) + "\n"
+
+    def close(self) -> Optional[Dict[str, Any]]:
+        """
+        Write the run summary and close the output.
+
+        The textfile is replaced atomically, so the collector never reads it
+        half written.
+
+        Returns:
+        - The run summary, or None when disabled or already closed.
+        """
+        if not self.enabled or self._closed:
+            return None
+        self._closed = True
+        summary = self.summary()
+        with self.lock:
+            self._write(summary)
+            if self._output is not None and self._output is not sys.stderr:
+                self._output.close()
+            self._output = None
+        if self.textfile:
+            directory = os.path.dirname(os.path.abspath(self.textfile))
+            descriptor, temporary_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+            try:
+                with os.fdopen(descriptor, "w") as temporary_file:
+                    temporary_file.write(self.textfile_metrics(summary))
+                os.chmod(temporary_path, 0o644)
+                os.replace(temporary_path, self.textfile)
+            except BaseException:
+                os.unlink(temporary_path)
+                raise
+        return summary
@@ -0,0 +1,402 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+
+from media_manager.state_store import default_cache_directory
+
+if TYPE_CHECKING:
+    import http.client
+
+
+def audio_ranges(path: str) -> List[Tuple[int, int]]:
+    """
+    Find the byte ranges of an audio file that hold the audio itself.
+
+    ID3v1, ID3v2 and APEv2 tags, FLAC metadata blocks and MP4 boxes other than
+    mdat are left out, so writing tags does not change the ranges' content.
+    Other formats are covered whole.
+
+    Args:
+    - path (str): Path of the audio file.
+
+    Returns:
+    - List of (start, end) byte ranges.
+    """
+    size = os.path.getsize(path)
+    with open(path, "rb") as audio_file:
+        head = audio_file.read(12)
+        if head[4:8] == b"ftyp":
+            ranges = []
+            position = 0
+            while position + 8 <= size:
+                audio_file.seek(position)
+                header = audio_file.read(16)
+                box_size = int.from_bytes(header[:4], "big")
+                header_size = 8
+                if box_size == 1:
+                    box_size = int.from_bytes(header[8:16], "big")
+                    header_size = 16
+                elif box_size == 0:
+                    box_size = size - position
+                if box_size < header_size:
+                    break
+                if header[4:8] == b"mdat":
+                    ranges.append(
+                        (position + header_size, min(position + box_size, size))
+                    )
+                position += box_size
+            return ranges or [(0, size)]
+        start = 0
+        while head[:3] == b"ID3":
+            tag_size = 0
+            for byte in head[6:10]:
+                tag_size = (tag_size << 7) | (byte & 0x7F)
+            start += 10 + tag_size + (10 if head[5] & 0x10 else 0)
+            audio_file.seek(start)
+            head = audio_file.read(12)
+        if head[:4] == b"fLaC":
+            start += 4
+            last = False
+            while not last and start + 4 <= size:
+                audio_file.seek(start)
+                block = audio_file.read(4)
+                last = bool(block[0] & 0x80)
+                start += 4 + int.from_bytes(block[1:4], "big")
+        end = size
+        if end - start >= 128:
+            audio_file.seek(end - 128)
+            if audio_file.read(3) == b"TAG":
+                end -= 128
+        if end - start >= 32:
+            audio_file.seek(end - 32)
+            footer = audio_file.read(32)
+            if footer[:8] == b"APETAGEX":
+                end -= int.from_bytes(footer[12:16], "little")
+                if int.from_bytes(footer[20:24], "little") & 0x80000000:
+                    end -= 32
+        return [(start, max(start, end))]
+
+
+def audio_content_hash(path: str) -> str:
+    """
+    Hash the audio of a file, ignoring its tags.
+
+    Args:
+    - path (str): Path of the audio file.
+
+    Returns:
+    - Hex digest of the audio content.
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, "rb") as audio_file:
+        for start, end in audio_ranges(path):
+            audio_file.seek(start)
+            remaining = end - start
+            while remaining > 0:
+                chunk = audio_file.read(min(remaining, 1 << 20))
+                if not chunk:
+                    break
+                digest.update(chunk)
+                remaining -= len(chunk)
+    return digest.hexdigest()
+
+
+def _write_atomic(path: str, data: bytes) -> None:
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    descriptor, temporary_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(descriptor, "wb") as temporary_file:
+            temporary_file.write(data)
+        os.replace(temporary_path, path)
+    except BaseException:
+        os.unlink(temporary_path)
+        raise
+
+
+class RecognitionCache:
+    """
+    Directory of music recognition results keyed by audio content hash, so
+    files that were recognized before are not sent to the service again, even
+    after they were renamed or re-tagged.
+
+    Attributes:
+    - directory: Directory holding the results.
+    - hits: Number of lookups answered from the cache.
+    - misses: Number of lookups not found in the cache.
+    """
+
+    def __init__(self, directory: Optional[str] = None):
+        """
+        Initialize the RecognitionCache.
+
+        Args:
+        - directory (Optional[str]): Directory holding the results, defaults to the user cache directory.
+        """
+        self.directory = directory or os.path.join(
+            default_cache_directory(), "recognition"
+        )
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Get a recognition result.
+
+        Args:
+        - key (str): Audio content hash, see audio_content_hash().
+
+        Returns:
+        - The recognition result, or None if it is not cached.
+        """
+        try:
+            with open(self._path(key), "r") as result_file:
+                result = json.load(result_file)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return result
+
+    def put(self, key: str, result: Dict[str, Any]) -> None:
+        """
+        Store a recognition result.
+
+        Args:
+        - key (str): Audio content hash, see audio_content_hash().
+        - result (Dict[str, Any]): Recognition result.
+        """
+        _write_atomic(self._path(key), json.dumps(result, indent=4).encode("utf-8"))
+
+
+class ConnectionPool:
+    """
+    Keep-alive HTTP(S) connections reused across requests to the same host.
+    The pool can be shared between threads.
+
+    Attributes:
+    - max_idle: Maximum number of idle connections kept per host.
+    - timeout: Socket timeout in seconds.
+    - requests: Number of requests made.
+    - connections: Number of connections opened.
+    """
+
+    redirects = (301, 302, 303, 307, 308)
+
+    def __init__(self, max_idle: int = 4, timeout: float = 30.0):
+        """
+        Initialize the ConnectionPool.
+
+        Args:
+        - max_idle (int): Maximum number of idle connections kept per host.
+        - timeout (float): Socket timeout in seconds.
+        """
+        self.max_idle = max_idle
+        self.timeout = timeout
+        self.requests = 0
+        self.connections = 0
+        self.lock = threading.Lock()
+        self._idle: Dict[Tuple[str, str], List["http.client.HTTPConnection"]] = {}
+
+    def _acquire(self, scheme: str, host: str) -> "http.client.HTTPConnection":
+        # Imported here, as most runs never download anything
+        import http.client
+
+        with self.lock:
+            idle = self._idle.get((scheme, host))
+            if idle:
+                return idle.pop()
+            self.connections += 1
+        if scheme == "https":
+            return http.client.HTTPSConnection(host, timeout=self.timeout)
+        return http.client.HTTPConnection(host, timeout=self.timeout)
+
+    def _release(
+        self, scheme: str, host: str, connection: "http.client.HTTPConnection"
+    ) -> None:
+        with self.lock:
+            idle = self._idle.setdefault((scheme, host), [])
+            if len(idle) < self.max_idle:
+                idle.append(connection)
+                return
+        connection.close()
+
+    def get(self, url: str, redirects: int = 5) -> bytes:
+        """
+        Download a URL.
+
+        Args:
+        - url (str): URL to download, non-HTTP URLs are opened with urlopen().
+        - redirects (int): Maximum number of redirects to follow.
+
+        Returns:
+        - The response body.
+        """
+        import http.client
+        from urllib.parse import urljoin, urlsplit
+        from urllib.request import urlopen
+
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https"):
+            with urlopen(url) as response:
+                return response.read()
+        target = parts.path or "/"
+        if parts.query:
+            target += f"?{parts.query}"
+        for attempt in range(2):
+            connection = self._acquire(parts.scheme, parts.netloc)
+            try:
+                connection.request(
+                    "GET", target, headers={"User-Agent": "media-manager"}
+                )
+                response = connection.getresponse()
+                data = response.read()
+            except (http.client.HTTPException, OSError):
+                connection.close()
+                # An idle connection may have been closed by the server
+                if attempt:
+                    raise
+                continue
+            break
+        with self.lock:
+            self.requests += 1
+        if response.will_close:
+            connection.close()
+        else:
+            self._release(parts.scheme, parts.netloc, connection)
+        if response.status in self.redirects and redirects > 0:
+            return self.get(urljoin(url, response.getheader("Location")), redirects - 1)
+        if response.status >= 400:
+            raise OSError(f"HTTP {response.status} {response.reason}: {url}")
+        return data
+
+    def close(self) -> None:
+        """
+        Close all idle connections.
+        """
+        with self.lock:
+            idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for connection in connections:
+                connection.close()
+
+
+class ArtworkCache:
+    """
+    Directory of downloaded album art keyed by URL, evicting the least recently
+    used images once it grows past its size limit. Tracks sharing a cover are
+    downloaded once, even when they are tagged concurrently.
+
+    Attributes:
+    - directory: Directory holding the images.
+    - max_bytes: Maximum total size of the cached images.
+    - pool: Connection pool used to download images.
+    - hits: Number of images answered from the cache.
+    - misses: Number of images downloaded.
+    """
+
+    def __init__(
+        self,
+        directory: Optional[str] = None,
+        max_bytes: int = 256 * 1024 * 1024,
+        pool: Optional[ConnectionPool] = None,
+    ):
+        """
+        Initialize the ArtworkCache.
+
+        Args:
+        - directory (Optional[str]): Directory holding the images, defaults to the user cache directory.
+        - max_bytes (int): Maximum total size of the cached images.
+        - pool (Optional[ConnectionPool]): Connection pool used to download images.
+        """
+        self.directory = directory or os.path.join(default_cache_directory(), "artwork")
+        self.max_bytes = max_bytes
+        self.pool = pool or ConnectionPool()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self._loading: Dict[str, threading.Lock] = {}
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self._size = 0
+        try:
+            with os.scandir(self.directory) as iterator:
+                files = [
+                    (entry.stat().st_mtime_ns, entry.name, entry.stat().st_size)
+                    for entry in iterator
+                    if entry.is_file() and not entry.name.endswith(".tmp")
+                ]
+        except OSError:
+            files = []
+        for _, name, size in sorted(files):
+            self._entries[name] = size
+            self._size += size
+
+    def fetch(self, url: str) -> bytes:
+        """
+        Get album art, downloading it if it is not cached.
+
+        Args:
+        - url (str): URL of the album art.
+
+        Returns:
+        - The album art image data.
+        """
+        name = hashlib.sha1(url.encode("utf-8")).hexdigest()
+        with self.lock:
+            loading = self._loading.setdefault(name, threading.Lock())
+        try:
+            with loading:
+                data = self._read(name)
+                if data is None:
+                    data = self.pool.get(url)
+                    self._write(name, data)
+                    with self.lock:
+                        self.misses += 1
+                return data
+        finally:
+            with self.lock:
+                self._loading.pop(name, None)
+
+    def _read(self, name: str) -> Optional[bytes]:
+        with self.lock:
+            if name not in self._entries:
+                return None
+            self._entries.move_to_end(name)
+        path = os.path.join(self.directory, name)
+        try:
+            with open(path, "rb") as image_file:
+                data = image_file.read()
+            os.utime(path)
+        except OSError:
+            with self.lock:
+                self._size -= self._entries.pop(name, 0)
+            return None
+        with self.lock:
+            self.hits += 1
+        return data
+
+    def _write(self, name: str, data: bytes) -> None:
+        _write_atomic(os.path.join(self.directory, name), data)
+        evicted = []
+        with self.lock:
+            self._size += len(data) - self._entries.pop(name, 0)
+            self._entries[name] = len(data)
+            while self._size > self.max_bytes and len(self._entries) > 1:
+                old_name, size = self._entries.popitem(last=False)
+                self._size -= size
+                evicted.append(old_name)
+        for old_name in evicted:
+            try:
+                os.unlink(os.path.join(self.directory, old_name))
+            except OSError:
+                pass
@@ -0,0 +1,371 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import asyncio
+import hashlib
+import json
+import os
+import time
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Sequence,
+    Union,
+)
+
+import ffmpeg
+from media_manager.media_job import MediaJob
+
+Recognizer = Callable[[Union[str, bytes]], Awaitable[Dict[str, Any]]]
+
+
+class ReplayRecognizer:
+    """
+    Local stand-in for the recognition service.
+
+    Answers with recognition results saved as JSON files named after the hash
+    of the audio asked about, after an optional simulated network latency.
+    The audio is a file, or the WAV data of an excerpt, see ExcerptRecognizer.
+    Audio without a saved result is not recognized, unless a recognizer is
+    given to record: its results are then saved, so answers of the real
+    service can be recorded once and replayed offline.
+
+    Attributes:
+    - directory: Directory holding the saved recognition results.
+    - latency: Seconds to wait before answering each request.
+    - recognizer: Coroutine function recording the results missing, or None.
+    - requests: Number of requests answered so far.
+    - in_flight: Number of requests being answered.
+    - max_in_flight: Highest number of requests answered at once.
+    - started: time.monotonic() at which each request started.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        latency: float = 0.0,
+        recognizer: Optional[Recognizer] = None,
+    ):
+        """
+        Initialize the ReplayRecognizer.
+
+        Args:
+        - directory (str): Directory holding the saved recognition results.
+        - latency (float): Seconds to wait before answering each request.
+        - recognizer (Optional[Recognizer]): Coroutine function recording the
+          results missing, or None to answer them as not recognized.
+        """
+        self.directory = directory
+        self.latency = latency
+        self.recognizer = recognizer
+        self.requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.started: List[float] = []
+
+    @staticmethod
+    def key(audio: Union[str, bytes]) -> str:
+        """
+        Get the name results for some audio are saved under.
+
+        Args:
+        - audio (Union[str, bytes]): Path of an audio file, or audio data.
+
+        Returns:
+        - Hex digest of the audio.
+        """
+        digest = hashlib.blake2b(digest_size=20)
+        if isinstance(audio, bytes):
+            digest.update(audio)
+        else:
+            with open(audio, "rb") as audio_file:
+                for chunk in iter(lambda: audio_file.read(1 << 20), b""):
+                    digest.update(chunk)
+        return digest.hexdigest()
+
+    def _path(self, audio: Union[str, bytes]) -> str:
+        return os.path.join(self.directory, f"{self.key(audio)}.json")
+
+    def save(self, audio: Union[str, bytes], result: Dict[str, Any]) -> None:
+        """
+        Save the recognition result for some audio.
+
+        Args:
+        - audio (Union[str, bytes]): Path of an audio file, or audio data.
+        - result (Dict[str, Any]): Recognition result.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self._path(audio), "w") as result_file:
+            json.dump(result, result_file)
+
+    async def __call__(self, audio: Union[str, bytes]) -> Dict[str, Any]:
+        self.requests += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        self.started.append(time.monotonic())
+        try:
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            try:
+                with open(self._path(audio), "r") as result_file:
+                    return json.load(result_file)
+            except FileNotFoundError:
+                if self.recognizer is None:
+                    return {}
+            result = await self.recognizer(audio)
+            self.save(audio, result)
+            return result
+        finally:
+            self.in_flight -= 1
+
+
+class ExcerptRecognizer:
+    """
+    Recognizes audio files from a short excerpt decoded to low-rate mono PCM,
+    instead of handing the whole file to the recognizer, which would decode
+    all of it into memory. When an excerpt is not matched, the next window is
+    tried.
+
+    Attributes:
+    - recognizer: Coroutine function recognizing WAV audio data.
+    - duration: Length of each excerpt in seconds.
+    - starts: Start of each window tried, as a fraction of the track length.
+    - sample_rate: Sample rate of the decoded excerpts.
+    - probe: Function returning ffprobe information for a path.
+    """
+
+    def __init__(
+        self,
+        recognizer: Recognizer,
+        duration: float = 12.0,
+        starts: Sequence[float] = (0.3, 0.6),
+        sample_rate: int = 16000,
+        probe: Optional[Callable[[str], Dict[str, Any]]] = None,
+    ):
+        """
+        Initialize the ExcerptRecognizer.
+
+        Args:
+        - recognizer (Recognizer): Coroutine function recognizing WAV audio data.
+        - duration (float): Length of each excerpt in seconds.
+        - starts (Sequence[float]): Start of each window tried, as a fraction of the track length.
+        - sample_rate (int): Sample rate of the decoded excerpts.
+        - probe (Optional[Callable]): Function returning ffprobe information for a path, defaults to ffmpeg.probe().
+        """
+        self.recognizer = recognizer
+        self.duration = duration
+        self.starts = tuple(starts) or (0.0,)
+        self.sample_rate = sample_rate
+        self.probe = probe or ffmpeg.probe
+
+    async def __call__(self, path: str) -> Dict[str, Any]:
+        loop = asyncio.get_running_loop()
+        length = await loop.run_in_executor(None, self.track_length, path)
+        result: Dict[str, Any] = {}
+        tried = set()
+        for start in self.starts:
+            offset = max(0.0, min(length * start, length - self.duration))
+            if offset in tried:
+                continue
+            tried.add(offset)
+            excerpt = await loop.run_in_executor(None, self.decode, path, offset)
+            result = await self.recognizer(excerpt)
+            if result.get("track"):
+                break
+        return result
+
+    def track_length(self, path: str) -> float:
+        """
+        Get the length of a track.
+
+        Args:
+        - path (str): Path of the audio file.
+
+        Returns:
+        - Length in seconds, or 0 if it is unknown.
+        """
+        try:
+            return float(self.probe(path)["format"]["duration"])
+        except Exception:
+            return 0.0
+
+    def decode(self, path: str, offset: float) -> bytes:
+        """
+        Decode an excerpt of a track.
+
+        Args:
+        - path (str): Path of the audio file.
+        - offset (float): Start of the excerpt in seconds.
+
+        Returns:
+        - Mono 16-bit WAV audio data.
+        """
+        excerpt, _ = (
+            ffmpeg.input(path, ss=offset, t=self.duration)
+            .output(
+                "pipe:",
+                format="wav",
+                acodec="pcm_s16le",
+                ac=1,
+                ar=self.sample_rate,
+                vn=None,
+            )
+            .run(capture_stdout=True, capture_stderr=True)
+        )
+        return excerpt
+
+
+class MusicPipeline:
+    """
+    Tags many music files concurrently on a single event loop.
+
+    Recognition requests are bounded by a semaphore and spaced out by an
+    optional rate limit. Renames, cover art downloads and tag writes run on
+    worker threads, so they overlap with the requests still waiting on the
+    network.
+
+    Attributes:
+    - manager: MediaManager holding the configuration and layout lock.
+    - recognizer: Coroutine function recognizing an audio file.
+    - concurrency: Maximum number of recognition requests in flight.
+    - rate_limit: Maximum number of recognition requests started per second, or None.
+    """
+
+    def __init__(
+        self,
+        manager,
+        recognizer: Optional[Recognizer] = None,
+        concurrency: int = 4,
+        rate_limit: Optional[float] = None,
+    ):
+        """
+        Initialize the MusicPipeline.
+
+        Args:
+        - manager (MediaManager): Manager processing the music files.
+        - recognizer (Optional[Recognizer]): Coroutine function recognizing an
+          audio file, defaults to the manager's recognizer, see
+          MediaManager.music_recognizer().
+        - concurrency (int): Maximum number of recognition requests in flight.
+        - rate_limit (Optional[float]): Maximum number of recognition requests
+          started per second, or None for no limit.
+        """
+        self.manager = manager
+        self.recognizer = recognizer
+        self.concurrency = max(1, int(concurrency))
+        self.rate_limit = rate_limit if rate_limit and rate_limit > 0 else None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._throttle_lock: Optional[asyncio.Lock] = None
+        self._released: Optional[asyncio.Condition] = None
+        self._next_start = 0.0
+
+    def run(self, jobs: Iterable[MediaJob]) -> None:
+        """
+        Process music files until all of them are done.
+
+        Args:
+        - jobs (Iterable[MediaJob]): Music files to process.
+        """
+        jobs = list(jobs)
+        if jobs:
+            asyncio.run(self._run(jobs))
+
+    async def _run(self, jobs: List[MediaJob]) -> None:
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._throttle_lock = asyncio.Lock()
+        self._released = asyncio.Condition()
+        self._next_start = 0.0
+        queue: asyncio.Queue = asyncio.Queue()
+        for job in jobs:
+            queue.put_nowait(job)
+        # More workers than request slots, so files are renamed and tagged
+        # while other requests are still waiting on the network
+        workers = min(len(jobs), self.concurrency * 2)
+        await asyncio.gather(*(self._worker(queue) for _ in range(workers)))
+
+    async def _worker(self, queue: asyncio.Queue) -> None:
+        while not queue.empty():
+            job = queue.get_nowait()
+            try:
+                await self._process(job)
+            except (Exception, SystemExit) as e:
+                self.manager.print(
+                    f"\tError processing {job.entry.path}: {e}", quiet=False
+                )
+                with self.manager.layout_lock:
+                    self.manager.media_index.complete(job.entry.path)
+
+    async def _process(self, job: MediaJob) -> None:
+        manager = self.manager
+        loop = asyncio.get_running_loop()
+        if not await loop.run_in_executor(
+            None, self._stage, "prepare", manager.prepare_media_file, job
+        ):
+            return
+        started = time.perf_counter()
+        error = True
+        try:
+            await manager.set_audio_metadata(job, recognize=self.recognize)
+            error = False
+        finally:
+            # Coroutines interleave on this thread, so the stage is timed here
+            manager.metrics.record(
+                "metadata", time.perf_counter() - started, job.entry.path, error=error
+            )
+            manager.release_media_file(job)
+            async with self._released:
+                self._released.notify_all()
+        # Wait on the event loop rather than in a worker thread, so jobs
+        # waiting for their directory never starve the jobs they wait for
+        async with self._released:
+            await self._released.wait_for(
+                lambda: job.working_directory not in manager.directory_users
+            )
+        await loop.run_in_executor(
+            None, self._stage, "finish", manager.finish_media_file, job
+        )
+
+    def _stage(self, name: str, function: Callable[[MediaJob], Any], job: MediaJob):
+        with self.manager.metrics.stage(name, job.entry.path):
+            return function(job)
+
+    async def recognize(self, path: str) -> Dict[str, Any]:
+        """
+        Recognize an audio file, within the concurrency and rate limits.
+
+        Args:
+        - path (str): Path of the audio file.
+
+        Returns:
+        - The recognition result.
+        """
+        recognizer = self.recognizer or self.manager.music_recognizer()
+        async with self._semaphore:
+            await self._throttle()
+            started = time.perf_counter()
+            error = True
+            try:
+                result = await recognizer(path)
+                error = False
+            finally:
+                self.manager.metrics.record(
+                    "recognize", time.perf_counter() - started, path, error=error
+                )
+            return result
+
+    async def _throttle(self) -> None:
+        if not self.rate_limit:
+            return
+        loop = asyncio.get_running_loop()
+        async with self._throttle_lock:
+            delay = self._next_start - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self._next_start = (
+                max(loop.time(), self._next_start) + 1.0 / self.rate_limit
+            )
@@ -0,0 +1,686 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import json
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from media_manager.media_index import MediaEntry
+from media_manager.media_job import MediaJob, belongs_to_media
+
+
+class PlanOperation:
+    """
+    A single filesystem or metadata change in a MediaPlan.
+
+    Attributes:
+    - kind: Type of operation, one of MediaPlan.kinds.
+    - source: Path the operation reads from, at the time the operation runs.
+    - destination: Path the operation writes to, if any.
+    - title: Title metadata to apply, for metadata operations.
+    - media_type: Type of media ('media', 'series', 'music').
+    - transcode: Flag indicating whether the file is re-encoded if it is not HEVC yet.
+    """
+
+    __slots__ = ("kind", "source", "destination", "title", "media_type", "transcode")
+
+    def __init__(
+        self,
+        kind: str,
+        source: str,
+        destination: str = "",
+        title: str = "",
+        media_type: str = "",
+        transcode: bool = False,
+    ):
+        self.kind = kind
+        self.source = source
+        self.destination = destination
+        self.title = title
+        self.media_type = media_type
+        self.transcode = transcode
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Convert the operation to a JSON serializable dictionary.
+
+        Returns:
+        - Dictionary with the non-empty fields of the operation.
+        """
+        return {
+            field: getattr(self, field)
+            for field in self.__slots__
+            if getattr(self, field) or field in ("kind", "source")
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "PlanOperation":
+        """
+        Create an operation from a dictionary made by to_dict().
+
+        Args:
+        - data (Dict[str, Any]): Dictionary describing the operation.
+
+        Returns:
+        - The PlanOperation.
+        """
+        return cls(**{field: data[field] for field in cls.__slots__ if field in data})
+
+    def __repr__(self) -> str:
+        return f"PlanOperation({self.kind!r}, {self.source!r}, {self.destination!r})"
+
+
+class MediaPlan:
+    """
+    Complete, ordered set of changes needed to clean a media directory.
+
+    Operations are stored in the order they have to be applied: junk file
+    removals, directory renames and merges (deepest first), file moves, subtitle folder cleanup,
+    metadata rewrites and transcodes, music processing and finally moves to
+    the library directories.
+
+    Attributes:
+    - media_directory: Media directory the plan was made for.
+    - subtitle: Flag indicating whether subtitles are applied.
+    - optimize: Flag indicating whether videos are optimized.
+    - operations: List of PlanOperation objects, in execution order.
+    """
+
+    version = 1
+    kinds = (
+        "remove_junk",
+        "rename_directory",
+        "merge_directory",
+        "move_file",
+        "clean_subtitles",
+        "metadata",
+        "process",
+        "move_directory",
+        "move_media",
+    )
+
+    def __init__(
+        self, media_directory: str = "", subtitle: bool = False, optimize: bool = False
+    ):
+        self.media_directory = media_directory
+        self.subtitle = subtitle
+        self.optimize = optimize
+        self.operations: List[PlanOperation] = []
+
+    def __len__(self) -> int:
+        return len(self.operations)
+
+    def add(self, operation: PlanOperation) -> None:
+        """
+        Append an operation to the plan.
+
+        Args:
+        - operation (PlanOperation): Operation to append.
+        """
+        self.operations.append(operation)
+
+    def summary(self) -> Dict[str, int]:
+        """
+        Count the operations in the plan by kind.
+
+        Returns:
+        - Dictionary of operation kind to number of operations.
+        """
+        counts = {}
+        for operation in self.operations:
+            counts[operation.kind] = counts.get(operation.kind, 0) + 1
+        return counts
+
+    def to_json(self, indent: Optional[int] = 2) -> str:
+        """
+        Serialize the plan to JSON.
+
+        Args:
+        - indent (Optional[int]): Indentation of the JSON output.
+
+        Returns:
+        - The plan as a JSON string.
+        """
+        return json.dumps(
+            {
+                "version": self.version,
+                "media_directory": self.media_directory,
+                "subtitle": self.subtitle,
+                "optimize": self.optimize,
+                "summary": self.summary(),
+                "operations": [operation.to_dict() for operation in self.operations],
+            },
+            indent=indent,
+        )
+
+    @classmethod
+    def from_json(cls, text: str) -> "MediaPlan":
+        """
+        Load a plan from JSON made by to_json().
+
+        Args:
+        - text (str): The plan as a JSON string.
+
+        Returns:
+        - The MediaPlan.
+        """
+        data = json.loads(text)
+        if data.get("version") != cls.version:
+            raise ValueError(f"Unsupported plan version: {data.get('version')}")
+        plan = cls(
+            media_directory=data.get("media_directory", ""),
+            subtitle=bool(data.get("subtitle")),
+            optimize=bool(data.get("optimize")),
+        )
+        for operation in data.get("operations", []):
+            if operation.get("kind") not in cls.kinds:
+                raise ValueError(f"Unknown plan operation: {operation.get('kind')}")
+            plan.add(PlanOperation.from_dict(operation))
+        return plan
+
+    def save(self, path: str) -> None:
+        """
+        Write the plan to a JSON file.
+
+        Args:
+        - path (str): Path of the JSON file.
+        """
+        with open(path, "w") as plan_file:
+            plan_file.write(self.to_json())
+
+    @classmethod
+    def load(cls, path: str) -> "MediaPlan":
+        """
+        Read a plan from a JSON file.
+
+        Args:
+        - path (str): Path of the JSON file.
+
+        Returns:
+        - The MediaPlan.
+        """
+        with open(path, "r") as plan_file:
+            return cls.from_json(plan_file.read())
+
+
+class MediaPlanner:
+    """
+    Computes a MediaPlan for a scanned media directory, without touching it.
+
+    Planning works purely from the MediaIndex and the directories recorded by
+    the MediaScanner: names are cleaned with the manager's filters, directory
+    renames are simulated deepest first to decide between a rename and a
+    merge, and the final location of every file is derived from that.
+    Whether a file actually needs its metadata rewritten or transcoded depends
+    on its probe, so metadata operations are checked again when they run.
+
+    Attributes:
+    - manager: MediaManager providing the configuration and the scanned index.
+    """
+
+    series_patterns = ("S[0-9][0-9]*E[0-9][0-9]*", "s[0-9][0-9]*e[0-9][0-9]*")
+
+    def __init__(self, manager):
+        self.manager = manager
+
+    def plan(self, target_directories: Optional[Dict[str, str]] = None) -> MediaPlan:
+        """
+        Plan every change needed to clean the media directory.
+
+        Args:
+        - target_directories (Optional[Dict[str, str]]): Library directory to move
+          each media type ('series', 'media', 'music') to.
+
+        Returns:
+        - The MediaPlan.
+        """
+        manager = self.manager
+        target_directories = target_directories or {}
+        manager.media_index.drain()
+        root = os.path.normpath(manager.media_directory)
+        scanner = manager.media_scanner
+        known_directories = set(scanner.known_directories) if scanner else set()
+        root_files = list(scanner.root_files) if scanner else []
+        plan = MediaPlan(
+            media_directory=root, subtitle=manager.subtitle, optimize=manager.optimize
+        )
+        if manager.remove_junk and scanner:
+            for junk_file in sorted(scanner.junk_files):
+                if os.path.lexists(junk_file):
+                    plan.add(PlanOperation("remove_junk", junk_file))
+
+        videos = []
+        music = []
+        folder_names = {}
+        for media_file in sorted(manager.media_index.paths()):
+            file_name, file_extension = os.path.splitext(os.path.basename(media_file))
+            if file_extension[1:].lower() in manager.supported_audio_types:
+                music.append(media_file)
+                continue
+            media_type = manager.detect_video_type(file_name)
+            filters = (
+                manager.series_filters
+                if media_type == "series"
+                else manager.movie_filters
+            )
+            new_file_name = manager.apply_filters(file_name, filters)
+            if media_type == "series":
+                folder_name = re.sub(" - S[0-9]+E[0-9]+", "", new_file_name)
+            else:
+                folder_name = new_file_name
+            videos.append((media_file, media_type, new_file_name, folder_name))
+            directory = os.path.dirname(media_file)
+            if directory != root:
+                # The last file processed in a directory decides its name
+                folder_names[directory] = folder_name
+
+        # Rename directories deepest first, so every source is still at its
+        # scanned location when it is renamed
+        existing_directories = set(known_directories)
+        renamed_directories = {}
+        for directory in sorted(
+            folder_names, key=lambda path: (-path.count(os.sep), path)
+        ):
+            destination = os.path.join(
+                os.path.dirname(directory), folder_names[directory]
+            )
+            if destination == directory:
+                continue
+            kind = (
+                "merge_directory"
+                if destination in existing_directories
+                else "rename_directory"
+            )
+            plan.add(PlanOperation(kind, directory, destination))
+            existing_directories.discard(directory)
+            existing_directories.add(destination)
+            renamed_directories[directory] = folder_names[directory]
+
+        final_directories = {root: root}
+
+        def final_directory(directory: str) -> str:
+            if directory not in final_directories:
+                parent = os.path.dirname(directory)
+                if parent == directory or len(directory) < len(root):
+                    return directory
+                final_directories[directory] = os.path.join(
+                    final_directory(parent),
+                    renamed_directories.get(directory, os.path.basename(directory)),
+                )
+            return final_directories[directory]
+
+        media_names = {os.path.basename(media_file) for media_file, *_ in videos}
+        media_names.update(os.path.basename(media_file) for media_file in music)
+        sidecar_files = [name for name in root_files if name not in media_names]
+        moved_sidecars = set()
+        final_videos = []
+        subtitle_directories = []
+        for media_file, media_type, new_file_name, folder_name in videos:
+            directory = os.path.dirname(media_file)
+            file_extension = os.path.splitext(media_file)[1]
+            if directory == root:
+                # Media without its own folder gets one, along with its sidecar files
+                final_media_directory = os.path.join(root, folder_name)
+                source = media_file
+                media_name = os.path.splitext(os.path.basename(media_file))[0]
+                for name in sidecar_files:
+                    if (
+                        belongs_to_media(name, folder_name, media_name)
+                        and name not in moved_sidecars
+                    ):
+                        moved_sidecars.add(name)
+                        plan.add(
+                            PlanOperation(
+                                "move_file",
+                                os.path.join(root, name),
+                                os.path.join(final_media_directory, name),
+                            )
+                        )
+            else:
+                final_media_directory = final_directory(directory)
+                source = os.path.join(
+                    final_media_directory, os.path.basename(media_file)
+                )
+            destination = os.path.join(
+                final_media_directory, f"{new_file_name}{file_extension}"
+            )
+            if source != destination:
+                plan.add(PlanOperation("move_file", source, destination))
+            if (
+                os.path.join(directory, "Subs") in known_directories
+                and final_media_directory not in subtitle_directories
+            ):
+                subtitle_directories.append(final_media_directory)
+            final_videos.append((destination, media_type, new_file_name))
+
+        for subtitle_directory in subtitle_directories:
+            plan.add(
+                PlanOperation(
+                    "clean_subtitles", os.path.join(subtitle_directory, "Subs")
+                )
+            )
+        for destination, media_type, new_file_name in final_videos:
+            plan.add(
+                PlanOperation(
+                    "metadata",
+                    destination,
+                    title=new_file_name,
+                    media_type=media_type,
+                    transcode=manager.optimize,
+                )
+            )
+        for media_file in music:
+            # Music is named from its recognized tags, so it can only be
+            # processed by the regular pipeline
+            plan.add(PlanOperation("process", media_file, media_type="music"))
+
+        self.plan_moves(plan, root, final_videos, target_directories)
+        return plan
+
+    def plan_moves(
+        self,
+        plan: MediaPlan,
+        root: str,
+        final_videos: List[tuple],
+        target_directories: Dict[str, str],
+    ) -> None:
+        """
+        Plan moving cleaned media directories to their library directories.
+
+        Series are matched first, so a directory holding both episodes and
+        other videos is treated as a series, like move_media() does.
+
+        Args:
+        - plan (MediaPlan): Plan to add the operations to.
+        - root (str): Media directory being cleaned.
+        - final_videos (List[tuple]): Final path, media type and title of every video.
+        - target_directories (Dict[str, str]): Library directory for each media type.
+        """
+        file_names_by_directory = {}
+        for destination, _, _ in final_videos:
+            file_names_by_directory.setdefault(os.path.dirname(destination), []).append(
+                os.path.basename(destination)
+            )
+        for directory in sorted(file_names_by_directory):
+            if directory == root:
+                continue
+            file_names = file_names_by_directory[directory]
+            is_series = any(
+                re.search(pattern, file_name)
+                for file_name in file_names
+                for pattern in self.series_patterns
+            )
+            if is_series and target_directories.get("series"):
+                media_type = "series"
+            elif not all(
+                any(re.search(pattern, file_name) for pattern in self.series_patterns)
+                for file_name in file_names
+            ) and target_directories.get("media"):
+                media_type = "media"
+            else:
+                continue
+            plan.add(
+                PlanOperation(
+                    "move_directory",
+                    directory,
+                    os.path.join(
+                        target_directories[media_type], os.path.basename(directory)
+                    ),
+                    media_type=media_type,
+                )
+            )
+        if target_directories.get("music"):
+            plan.add(
+                PlanOperation(
+                    "move_media",
+                    root,
+                    target_directories["music"],
+                    media_type="music",
+                )
+            )
+
+
+class PlanExecutor:
+    """
+    Applies a MediaPlan to the media directory.
+
+    Operations run in plan order, one stage per operation kind. Renames,
+    merges and file moves are cheap and dependent on each other, so they run
+    in order; metadata rewrites and transcodes run on the manager's job pool,
+    and library moves run in parallel across destination devices. The
+    manager's MediaIndex is updated as files move, so nothing is rescanned.
+    An operation whose source is gone is skipped and reported.
+
+    Attributes:
+    - manager: MediaManager providing the configuration and shared caches.
+    - completed: Number of operations applied.
+    - skipped: Number of operations skipped.
+    - failed: Number of operations that failed.
+    """
+
+    def __init__(self, manager):
+        self.manager = manager
+        self.completed = 0
+        self.skipped = 0
+        self.failed = 0
+
+    def execute(self, plan: MediaPlan) -> None:
+        """
+        Apply every operation in a plan.
+
+        The subtitle and optimize settings the plan was made with are applied
+        to the manager first.
+
+        Args:
+        - plan (MediaPlan): Plan to apply.
+        """
+        manager = self.manager
+        manager.set_subtitle(plan.subtitle)
+        manager.set_optimize(plan.optimize)
+        stages = {}
+        for operation in plan.operations:
+            stages.setdefault(operation.kind, []).append(operation)
+        for kind in MediaPlan.kinds:
+            operations = stages.get(kind, [])
+            if not operations:
+                continue
+            manager.print(f"\nApplying {len(operations)} {kind} operations...")
+            if kind == "metadata" and manager.jobs > 1:
+                with ThreadPoolExecutor(
+                    max_workers=manager.jobs, thread_name_prefix="media-manager-job"
+                ) as executor:
+                    list(executor.map(self.apply, operations))
+            elif kind == "move_directory":
+                self.move_directories(operations)
+            else:
+                for operation in operations:
+                    self.apply(operation)
+        manager.print(
+            f"\tPlan applied ({self.completed} done, {self.skipped} skipped, "
+            f"{self.failed} failed)",
+            quiet=False,
+        )
+
+    def move_directories(self, operations: List[PlanOperation]) -> None:
+        """
+        Move directories to their library directories, one worker per destination device.
+
+        Args:
+        - operations (List[PlanOperation]): move_directory operations.
+        """
+        groups = {}
+        for operation in operations:
+            try:
+                device = os.stat(os.path.dirname(operation.destination)).st_dev
+            except OSError:
+                device = None
+            groups.setdefault(device, []).append(operation)
+        if len(groups) == 1:
+            for operation in operations:
+                self.apply(operation)
+            return
+
+        def apply_group(group: List[PlanOperation]) -> None:
+            for operation in group:
+                self.apply(operation)
+
+        with ThreadPoolExecutor(
+            max_workers=len(groups), thread_name_prefix="media-manager-move"
+        ) as executor:
+            list(executor.map(apply_group, groups.values()))
+
+    def apply(self, operation: PlanOperation) -> None:
+        """
+        Apply a single operation, reporting rather than raising failures.
+
+        Args:
+        - operation (PlanOperation): Operation to apply.
+        """
+        manager = self.manager
+        if not os.path.exists(operation.source):
+            manager.print(
+                f"\tSkipping {operation.kind}, {operation.source} no longer exists"
+            )
+            self._count("skipped")
+            return
+        try:
+            getattr(self, f"apply_{operation.kind}")(operation)
+        except Exception as e:
+            manager.print(
+                f"\tUnable to apply {operation.kind} to {operation.source}\n\t\t"
+                f"Error: {e}",
+                quiet=False,
+            )
+            self._count("failed")
+        else:
+            self._count("completed")
+
+    def apply_remove_junk(self, operation: PlanOperation) -> None:
+        self.manager.print(f"\tRemoving junk file: {operation.source}")
+        os.remove(operation.source)
+
+    def apply_rename_directory(self, operation: PlanOperation) -> None:
+        if os.path.isdir(operation.destination):
+            self.apply_merge_directory(operation)
+            return
+        self.manager.print(
+            f"\tRenaming directory: \n\t\t{operation.source} \n\t\t➜\n\t\t"
+            f"{operation.destination}"
+        )
+        os.rename(operation.source, operation.destination)
+        self.manager.media_index.relocate_directory(
+            operation.source, operation.destination
+        )
+
+    def apply_merge_directory(self, operation: PlanOperation) -> None:
+        self.manager.print(
+            f"\tMerging directory: \n\t\t{operation.source} \n\t\t➜\n\t\t"
+            f"{operation.destination}"
+        )
+        self.merge_directory(operation.source, operation.destination)
+        self.manager.media_index.relocate_directory(
+            operation.source, operation.destination
+        )
+
+    def apply_move_file(self, operation: PlanOperation) -> None:
+        if os.path.exists(operation.destination):
+            raise FileExistsError(f"{operation.destination} already exists")
+        os.makedirs(os.path.dirname(operation.destination), exist_ok=True)
+        self.manager.print(
+            f"\tFile Renamed: \n\t\t{operation.source} \n\t\t➜ \n\t\t"
+            f"{operation.destination}"
+        )
+        shutil.move(operation.source, operation.destination)
+        self.manager.media_index.relocate(operation.source, operation.destination)
+
+    def apply_clean_subtitles(self, operation: PlanOperation) -> None:
+        self.manager.clean_subtitle_directory(subtitle_directory=operation.source)
+
+    def apply_metadata(self, operation: PlanOperation) -> None:
+        manager = self.manager
+        if manager.state_store and manager.state_store.is_clean(
+            operation.source, subtitle=manager.subtitle, optimize=manager.optimize
+        ):
+            manager.print(f"\tAlready clean, skipping: {operation.source}")
+            manager.media_index.complete(operation.source)
+            return
+        entry = manager.media_index.get(operation.source) or MediaEntry(
+            os.path.normpath(operation.source)
+        )
+        job = MediaJob(entry, manager.movie_filters)
+        job.media_type = operation.media_type or "media"
+        if job.media_type == "series":
+            job.filters = manager.series_filters
+        job.folder_name = os.path.basename(os.path.normpath(job.directory))
+        job.new_file_name = operation.title or job.file_name
+        job.new_media_file_path = entry.path
+        job.temporary_media_file_path = os.path.join(
+            job.directory, f"temp-{job.new_file_name}{job.file_extension}"
+        )
+        manager.build_output_parameters(job)
+        manager.set_video_metadata(job)
+        if manager.state_store and not job.failed:
+            manager.record_state(job)
+        manager.media_index.complete(entry.path)
+
+    def apply_process(self, operation: PlanOperation) -> None:
+        manager = self.manager
+        entry = manager.media_index.get(operation.source) or manager.media_index.add(
+            operation.source
+        )
+        manager.process_media_file(MediaJob(entry, manager.movie_filters))
+
+    def apply_move_directory(self, operation: PlanOperation) -> None:
+        manager = self.manager
+        manager.print(
+            f"Moving {operation.media_type} {os.path.basename(operation.source)} "
+            f"➜ {os.path.dirname(operation.destination)}".ljust(manager.terminal_width),
+            end="\r",
+            quiet=False,
+        )
+        if os.path.isdir(operation.destination):
+            self.merge_directory(operation.source, operation.destination)
+        else:
+            manager.transfer.move(operation.source, operation.destination)
+        manager.media_index.remove_directory(operation.source)
+
+    def apply_move_media(self, operation: PlanOperation) -> None:
+        self.manager.move_media(
+            target_directory=operation.destination, media_type=operation.media_type
+        )
+
+    def merge_directory(self, source: str, destination: str) -> None:
+        """
+        Merge a directory into another one, then remove it if it is empty.
+
+        Subdirectories that exist on both sides, such as Subs, are merged
+        recursively. Files that already exist in the destination are left in
+        place.
+
+        Args:
+        - source (str): Directory to merge.
+        - destination (str): Directory to merge into.
+        """
+        os.makedirs(destination, exist_ok=True)
+        for name in sorted(os.listdir(source)):
+            source_path = os.path.join(source, name)
+            destination_path = os.path.join(destination, name)
+            if os.path.isdir(source_path) and os.path.isdir(destination_path):
+                self.merge_directory(source_path, destination_path)
+            elif os.path.exists(destination_path):
+                self.manager.print(
+                    f"\t\tFile already exists {destination_path}, skipping..."
+                )
+            else:
+                self.manager.transfer.move(source_path, destination_path)
+        try:
+            os.rmdir(source)
+        except OSError:
+            self.manager.print(f"\t\tSkipping removal of {source}...")
+
+    def _count(self, outcome: str) -> None:
+        with self.manager.layout_lock:
+            setattr(self, outcome, getattr(self, outcome) + 1)
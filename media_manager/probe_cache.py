@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+from media_manager.containers import ContainerError, read_container
+from media_manager.metrics import Metrics
+from media_manager.state_store import StateStore, file_identity
+
+
+def ffprobe(path: str) -> Dict[str, Any]:
+    """
+    Probe a path with ffprobe, importing ffmpeg-python on first use.
+
+    Args:
+    - path (str): Path of the media file.
+
+    Returns:
+    - The result of ffmpeg.probe().
+    """
+    import ffmpeg
+
+    return ffmpeg.probe(path)
+
+
+class ProbeCache:
+    """
+    Cache of ffprobe results, so every media file is probed at most once per run.
+
+    Results are keyed by file identity (device, inode, size and mtime), which
+    survives the renames and directory merges done while processing, and is
+    invalidated as soon as a file is rewritten. When a StateStore is given,
+    results are also persisted between runs. Files can be probed ahead of
+    processing on a bounded thread pool with prefetch(). Matroska and MP4
+    headers are read natively, and ffprobe is only run for files the native
+    reader can not parse.
+
+    Attributes:
+    - state_store: Optional StateStore used to persist probe results.
+    - max_workers: Maximum number of concurrent ffprobe processes used by prefetch().
+    - probe_function: Function that probes a path, defaults to ffprobe().
+    - native: Flag indicating whether to read Matroska and MP4 headers natively.
+    - probe_count: Number of probes actually run, natively or with the probe function.
+    - native_count: Number of probes answered by the native reader.
+    - metrics: Metrics recording every probe function run as an ffprobe stage.
+    """
+
+    def __init__(
+        self,
+        state_store: Optional[StateStore] = None,
+        max_workers: Optional[int] = None,
+        probe_function: Optional[Callable[[str], Dict[str, Any]]] = None,
+        native: bool = True,
+    ):
+        """
+        Initialize the ProbeCache.
+
+        Args:
+        - state_store (Optional[StateStore]): Store used to persist probe results.
+        - max_workers (Optional[int]): Maximum number of concurrent probes, defaults to 8.
+        - probe_function (Optional[Callable]): Function that probes a path, defaults to ffprobe().
+        - native (bool): Read Matroska and MP4 headers natively before falling back to the probe function.
+        """
+        self.state_store = state_store
+        self.max_workers = max_workers or 8
+        self.probe_function = probe_function or ffprobe
+        self.native = native
+        self.probe_count = 0
+        self.native_count = 0
+        self.metrics = Metrics()
+        self._results: Dict[Tuple[int, int, int, int], Any] = {}
+        self._futures: Dict[Tuple[int, int, int, int], Future] = {}
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def probe(self, path: str) -> Dict[str, Any]:
+        """
+        Probe a media file, using a cached result when the file is unchanged.
+
+        Args:
+        - path (str): Path of the media file.
+
+        Returns:
+        - The probe result, in the same format as ffmpeg.probe().
+        """
+        identity = file_identity(path)
+        with self._lock:
+            result = self._results.get(identity)
+            future = self._futures.get(identity) if result is None else None
+        if result is None and future is not None:
+            future.result()
+            with self._lock:
+                result = self._results.get(identity)
+        if result is None:
+            result = self._probe(path, identity)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def prefetch(self, paths: Iterable[str]) -> None:
+        """
+        Start probing media files in the background.
+
+        This returns immediately. Later calls to probe() wait for a prefetch
+        that is still running instead of starting a second ffprobe.
+
+        Args:
+        - paths (Iterable[str]): Paths of the media files.
+        """
+        for path in paths:
+            try:
+                identity = file_identity(path)
+            except OSError:
+                continue
+            with self._lock:
+                if identity in self._results or identity in self._futures:
+                    continue
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.max_workers,
+                        thread_name_prefix="media-manager-probe",
+                    )
+                self._futures[identity] = self._executor.submit(
+                    self._probe, path, identity
+                )
+
+    def wait(self) -> None:
+        """
+        Wait for every prefetch to finish.
+        """
+        with self._lock:
+            futures = list(self._futures.values())
+        for future in futures:
+            future.result()
+
+    def invalidate(self, path: str) -> None:
+        """
+        Drop the cached result for a media file.
+
+        Args:
+        - path (str): Path of the media file.
+        """
+        try:
+            identity = file_identity(path)
+        except OSError:
+            return
+        with self._lock:
+            self._results.pop(identity, None)
+
+    def close(self) -> None:
+        """
+        Stop the prefetch thread pool.
+        """
+        if self._executor is not None:
+            # Prefetches not started yet are dropped, like
+            # shutdown(cancel_futures=True) does from Python 3.9
+            with self._lock:
+                futures = list(self._futures.items())
+            for identity, future in futures:
+                if future.cancel():
+                    with self._lock:
+                        self._futures.pop(identity, None)
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def read_native(self, path: str) -> Optional[Dict[str, Any]]:
+        """
+        Read a media file's header without ffprobe.
+
+        Args:
+        - path (str): Path of the media file.
+
+        Returns:
+        - The probe result, or None if the file has to be probed with the probe function.
+        """
+        if not self.native:
+            return None
+        try:
+            result = read_container(path)
+        except ContainerError:
+            return None
+        with self._lock:
+            self.native_count += 1
+        return result
+
+    def _probe(self, path: str, identity: Tuple[int, int, int, int]) -> Any:
+        result: Any = None
+        if self.state_store:
+            result = self.state_store.get_probe(identity)
+        if result is None:
+            with self._lock:
+                self.probe_count += 1
+            try:
+                result = self.read_native(path)
+                if result is None:
+                    with self.metrics.stage("ffprobe", path) as stage:
+                        stage.subprocesses = 1
+                        result = self.probe_function(path)
+            except Exception as e:
+                result = e
+            else:
+                if self.state_store:
+                    self.state_store.record_probe(identity, result)
+        with self._lock:
+            self._results[identity] = result
+            self._futures.pop(identity, None)
+        return result
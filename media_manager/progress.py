@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import threading
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional
+
+
+def parse_progress(lines: Iterable[str]) -> Iterator[Dict[str, str]]:
+    """
+    Parse the output of ffmpeg -progress.
+
+    Args:
+    - lines (Iterable[str]): Lines of key=value pairs written by ffmpeg.
+
+    Returns:
+    - Iterator of progress blocks, each ending with its 'progress' key set to
+      'continue' or 'end'.
+    """
+    block: Dict[str, str] = {}
+    for line in lines:
+        key, separator, value = line.strip().partition("=")
+        if not separator:
+            continue
+        block[key] = value.strip()
+        if key == "progress":
+            yield block
+            block = {}
+
+
+def format_duration(seconds: Optional[float]) -> str:
+    """
+    Format a duration as hours, minutes and seconds.
+
+    Args:
+    - seconds (Optional[float]): Duration in seconds, or None if it is unknown.
+
+    Returns:
+    - The duration as H:MM:SS, or '?' if it is unknown.
+    """
+    if seconds is None:
+        return "?"
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}"
+
+
+class FileProgress:
+    """
+    Progress of one ffmpeg run.
+
+    Attributes:
+    - path: Path of the media file being encoded.
+    - duration: Length of the media file in seconds, or 0 if it is unknown.
+    - position: Seconds of media encoded so far.
+    - frame: Number of frames encoded so far.
+    - fps: Frames encoded per second.
+    - speed: Seconds of media encoded per second of wall time.
+    - elapsed: Wall time since the run started.
+    - queue_eta: Seconds until every queued encode is done, or None if it is unknown.
+    - done: Flag indicating whether ffmpeg exited.
+    """
+
+    __slots__ = (
+        "path",
+        "duration",
+        "position",
+        "frame",
+        "fps",
+        "speed",
+        "started",
+        "elapsed",
+        "queue_eta",
+        "done",
+    )
+
+    def __init__(self, path: str, duration: float):
+        """
+        Initialize the FileProgress.
+
+        Args:
+        - path (str): Path of the media file being encoded.
+        - duration (float): Length of the media file in seconds, or 0 if it is unknown.
+        """
+        self.path = path
+        self.duration = duration
+        self.position = 0.0
+        self.frame = 0
+        self.fps = 0.0
+        self.speed = 0.0
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+        self.queue_eta: Optional[float] = None
+        self.done = False
+
+    @property
+    def percent(self) -> Optional[float]:
+        """
+        Percentage of the media file encoded, or None if its length is unknown.
+        """
+        if not self.duration:
+            return None
+        return min(100.0, self.position / self.duration * 100)
+
+    @property
+    def eta(self) -> Optional[float]:
+        """
+        Seconds until the media file is encoded, or None if it is unknown.
+        """
+        if not self.duration or not self.speed:
+            return None
+        return max(0.0, self.duration - self.position) / self.speed
+
+    def update(self, block: Dict[str, str]) -> None:
+        """
+        Update the progress from a block of ffmpeg -progress output.
+
+        Args:
+        - block (Dict[str, str]): Progress block, see parse_progress().
+        """
+        self.elapsed = time.perf_counter() - self.started
+        # out_time_ms is in microseconds too, ffmpeg kept the name for compatibility
+        for key in ("out_time_us", "out_time_ms"):
+            try:
+                self.position = int(block[key]) / 1e6
+                break
+            except (KeyError, ValueError):
+                continue
+        try:
+            self.frame = int(block["frame"])
+        except (KeyError, ValueError):
+            pass
+        try:
+            self.fps = float(block["fps"])
+        except (KeyError, ValueError):
+            pass
+        try:
+            self.speed = float(block["speed"].rstrip("x"))
+        except (KeyError, ValueError):
+            if self.elapsed:
+                self.speed = self.position / self.elapsed
+        self.done = block.get("progress") == "end"
+
+    def __str__(self) -> str:
+        percent = self.percent
+        return (
+            f"{os.path.basename(self.path)[:30]}: "
+            f"{'?' if percent is None else f'{percent:.1f}'}% | "
+            f"{self.fps:.1f} fps | {self.speed:.2f}x | "
+            f"ETA {format_duration(self.eta)} | "
+            f"Queue ETA {format_duration(self.queue_eta)}"
+        )
+
+
+class ProgressTracker:
+    """
+    Progress of the encodes of a run, shared by concurrent jobs.
+
+    Media files expected to be encoded are queued with their length, so the
+    queue ETA is weighted by how much media is left rather than by how many
+    files are. The queue is encoded at the combined speed of the encodes
+    running, or at the average speed of the finished ones in between.
+
+    Attributes:
+    - callback: Function called with the FileProgress of every update, or None.
+    """
+
+    def __init__(self, callback: Optional[Callable[[FileProgress], Any]] = None):
+        """
+        Initialize the ProgressTracker.
+
+        Args:
+        - callback (Optional[Callable]): Function called with the FileProgress of every update.
+        """
+        self.callback = callback
+        self.lock = threading.Lock()
+        self._queued: Dict[Any, float] = {}
+        self._active: Dict[int, FileProgress] = {}
+        self._encoded = 0.0
+        self._encoding_time = 0.0
+
+    def queue(self, key: Any, duration: float) -> None:
+        """
+        Queue a media file expected to be encoded.
+
+        Args:
+        - key (Any): Key of the media file, e.g. its MediaEntry, which survives renames.
+        - duration (float): Length of the media file in seconds.
+        """
+        with self.lock:
+            self._queued[key] = duration
+
+    def discard(self, key: Any) -> None:
+        """
+        Remove a media file from the queue, e.g. once it was processed.
+
+        Args:
+        - key (Any): Key the media file was queued with.
+        """
+        with self.lock:
+            self._queued.pop(key, None)
+
+    def start(self, key: Any, path: str, duration: float) -> FileProgress:
+        """
+        Start tracking an ffmpeg run.
+
+        Args:
+        - key (Any): Key the media file was queued with, if any.
+        - path (str): Path of the media file.
+        - duration (float): Length of the media file in seconds, or 0 if it is unknown.
+
+        Returns:
+        - The FileProgress of the run.
+        """
+        progress = FileProgress(path, duration)
+        with self.lock:
+            self._queued.pop(key, None)
+            self._active[id(progress)] = progress
+        return progress
+
+    def update(self, progress: FileProgress, block: Dict[str, str]) -> None:
+        """
+        Update an ffmpeg run from a block of its -progress output.
+
+        Args:
+        - progress (FileProgress): Progress returned by start().
+        - block (Dict[str, str]): Progress block, see parse_progress().
+        """
+        progress.update(block)
+        with self.lock:
+            progress.queue_eta = self._queue_eta()
+        if self.callback:
+            self.callback(progress)
+
+    def finish(self, progress: FileProgress) -> None:
+        """
+        Stop tracking an ffmpeg run.
+
+        Args:
+        - progress (FileProgress): Progress returned by start().
+        """
+        progress.elapsed = time.perf_counter() - progress.started
+        progress.done = True
+        with self.lock:
+            if self._active.pop(id(progress), None) is not None:
+                self._encoded += progress.position
+                self._encoding_time += progress.elapsed
+            progress.queue_eta = self._queue_eta()
+        if self.callback:
+            self.callback(progress)
+
+    def queue_eta(self) -> Optional[float]:
+        """
+        Estimate the time until every queued and running encode is done.
+
+        Returns:
+        - Seconds, or None until a speed was measured.
+        """
+        with self.lock:
+            return self._queue_eta()
+
+    def _queue_eta(self) -> Optional[float]:
+        remaining = sum(self._queued.values())
+        speed = 0.0
+        for progress in self._active.values():
+            if progress.duration:
+                remaining += max(0.0, progress.duration - progress.position)
+            speed += progress.speed
+        if not speed and self._encoding_time:
+            speed = self._encoded / self._encoding_time
+        if not speed:
+            return None
+        return remaining / speed
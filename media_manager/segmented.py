@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Callable, Dict, List, Optional
+
+# Shorter segments spend more of their encode on rate control warm up and
+# keyframes than they gain from running in parallel
+MIN_SEGMENT_SECONDS = 60.0
+# Difference between the length of the source and of the encode tolerated,
+# segments are cut at keyframes so a frame or two may move
+DURATION_TOLERANCE = 0.5
+
+
+class SegmentError(RuntimeError):
+    """
+    Raised when a segmented encode does not match its source.
+    """
+
+
+def stream_layout(probe: Dict[str, Any]) -> List[str]:
+    """
+    Get the type of every stream of a media file, in file order.
+
+    Args:
+    - probe (Dict[str, Any]): ffprobe result of the media file.
+
+    Returns:
+    - List of stream types, e.g. ['video', 'audio', 'subtitle'].
+    """
+    return [stream.get("codec_type", "") for stream in probe.get("streams", [])]
+
+
+def concat_list(paths: List[str]) -> str:
+    """
+    Build the input list of the ffmpeg concat demuxer.
+
+    Args:
+    - paths (List[str]): Files to concatenate, in order.
+
+    Returns:
+    - Contents of the list file.
+    """
+    lines = []
+    for path in paths:
+        escaped = os.path.abspath(path).replace("'", "'\\''")
+        lines.append(f"file '{escaped}'\n")
+    return "".join(lines)
+
+
+class SegmentedEncoder:
+    """
+    Encoder splitting the video of one long media file into segments encoded
+    concurrently.
+
+    The video stream is split at keyframes without re-encoding, each segment
+    is encoded by its own ffmpeg process, and the encoded segments are
+    concatenated without re-encoding. The other streams are copied, or
+    encoded, once from the source, in their original order. The result is
+    validated against the length and stream layout of the source.
+
+    Attributes:
+    - segments: Number of segments, 1 to encode files in one piece.
+    """
+
+    def __init__(self, segments: int = 1):
+        """
+        Initialize the SegmentedEncoder.
+
+        Args:
+        - segments (int): Number of segments, 1 to encode files in one piece.
+        """
+        self.segments = max(1, segments)
+
+    def applies(self, duration: float) -> bool:
+        """
+        Check whether a media file is long enough to be encoded in segments.
+
+        Args:
+        - duration (float): Length of the media file in seconds.
+
+        Returns:
+        - True if the file should be encoded in segments.
+        """
+        return self.segments > 1 and duration >= self.segments * MIN_SEGMENT_SECONDS
+
+    def encode(
+        self,
+        source: str,
+        destination: str,
+        probe: Dict[str, Any],
+        video_index: int,
+        video_parameters: Dict[str, Any],
+        output_parameters: Dict[str, Any],
+        probe_function: Callable[[str], Dict[str, Any]],
+        on_segment: Optional[Callable[[int, int], Any]] = None,
+    ) -> int:
+        """
+        Encode a media file in segments.
+
+        Args:
+        - source (str): Path of the media file.
+        - destination (str): Path to write the encoded file to.
+        - probe (Dict[str, Any]): ffprobe result of the media file.
+        - video_index (int): Index of the video stream to encode.
+        - video_parameters (Dict[str, Any]): ffmpeg output parameters of the
+          segments, e.g. {'c:v': 'libx265', 'crf': 28, 'preset': 'medium'}.
+        - output_parameters (Dict[str, Any]): ffmpeg output parameters of the
+          other streams and the metadata of the encoded file.
+        - probe_function (Callable): Function returning the ffprobe result of a file.
+        - on_segment (Optional[Callable]): Function called with the number of
+          segments encoded and the number of segments, as each one finishes.
+
+        Returns:
+        - Number of ffmpeg processes run.
+
+        Raises:
+        - ffmpeg.Error: If an ffmpeg process fails.
+        - SegmentError: If the encoded file does not match the source.
+        """
+        import ffmpeg
+
+        duration = float(probe["format"]["duration"])
+        workdir = tempfile.mkdtemp(
+            prefix=".media-manager-segments-",
+            dir=os.path.dirname(os.path.abspath(destination)),
+        )
+        try:
+            # The segment muxer only cuts at keyframes when copying
+            ffmpeg.input(source).output(
+                os.path.join(workdir, "segment-%04d.mkv"),
+                map=f"0:{video_index}",
+                c="copy",
+                f="segment",
+                segment_time=f"{duration / self.segments:.3f}",
+                reset_timestamps=1,
+            ).overwrite_output().run(capture_stdout=True, capture_stderr=True)
+            segments = sorted(
+                os.path.join(workdir, name)
+                for name in os.listdir(workdir)
+                if name.startswith("segment-")
+            )
+            if not segments:
+                raise SegmentError(f"No segments were cut from {source}")
+            encoded = [
+                os.path.join(workdir, f"encoded-{index:04d}.mkv")
+                for index in range(len(segments))
+            ]
+
+            def encode_segment(segment: str, output: str) -> None:
+                ffmpeg.input(segment).output(
+                    output, **video_parameters
+                ).overwrite_output().run(capture_stdout=True, capture_stderr=True)
+                os.remove(segment)
+
+            # Each segment is encoded by its own ffmpeg process, the threads
+            # only wait on them
+            with ThreadPoolExecutor(max_workers=len(segments)) as executor:
+                futures = [
+                    executor.submit(encode_segment, segment, output)
+                    for segment, output in zip(segments, encoded)
+                ]
+                for finished, future in enumerate(as_completed(futures), 1):
+                    future.result()
+                    if on_segment:
+                        on_segment(finished, len(segments))
+
+            list_path = os.path.join(workdir, "segments.txt")
+            with open(list_path, "w") as list_file:
+                list_file.write(concat_list(encoded))
+            video_path = os.path.join(workdir, "video.mkv")
+            ffmpeg.input(list_path, f="concat", safe=0).output(
+                video_path, c="copy"
+            ).overwrite_output().run(capture_stdout=True, capture_stderr=True)
+
+            # Keep the streams of the source in their order, with the encoded
+            # video in place of the original one
+            video = ffmpeg.input(video_path)
+            original = ffmpeg.input(source)
+            streams = [
+                video["0"] if index == video_index else original[str(index)]
+                for index in range(len(probe["streams"]))
+            ]
+            parameters = {
+                key: value for key, value in output_parameters.items() if key != "map"
+            }
+            parameters["map_metadata"] = 1
+            parameters["map_chapters"] = 1
+            parameters[f"map_metadata:s:{video_index}"] = f"1:s:{video_index}"
+            ffmpeg.output(*streams, destination, **parameters).overwrite_output().run(
+                capture_stdout=True, capture_stderr=True
+            )
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+        result = probe_function(destination)
+        if stream_layout(result) != stream_layout(probe):
+            raise SegmentError(
+                f"Stream layout {stream_layout(result)} of the encode does not match "
+                f"{stream_layout(probe)} of the source"
+            )
+        encoded_duration = float(result["format"]["duration"])
+        if abs(encoded_duration - duration) > DURATION_TOLERANCE:
+            raise SegmentError(
+                f"Encode is {encoded_duration:.3f} s long, "
+                f"the source is {duration:.3f} s long"
+            )
+        return len(segments) + 3
@@ -0,0 +1,368 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+
+def default_cache_directory() -> str:
+    """
+    Get the cache directory used for persistent media-manager state.
+
+    Returns:
+    - Path of the cache directory.
+    """
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    return os.path.join(cache_home, "media-manager")
+
+
+def file_identity(path: str) -> Tuple[int, int, int, int]:
+    """
+    Get the identity of a file on disk.
+
+    Args:
+    - path (str): Path of the file.
+
+    Returns:
+    - Tuple of (device, inode, size, mtime in nanoseconds).
+    """
+    stat = os.stat(path)
+    return stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+class FileState:
+    """
+    Outcome recorded for a processed media file.
+
+    Attributes:
+    - path: Path of the media file when it was recorded.
+    - identity: Tuple of (device, inode, size, mtime in nanoseconds).
+    - name: File name that was applied.
+    - title: Title metadata that was applied.
+    - video_codec: Video codec of the file after processing.
+    - subtitle: Flag indicating whether subtitles were applied.
+    - optimized: Flag indicating whether the file was optimized.
+    """
+
+    __slots__ = (
+        "path",
+        "identity",
+        "name",
+        "title",
+        "video_codec",
+        "subtitle",
+        "optimized",
+    )
+
+    def __init__(
+        self,
+        path: str,
+        identity: Tuple[int, int, int, int],
+        name: str,
+        title: str = "",
+        video_codec: str = "",
+        subtitle: bool = False,
+        optimized: bool = False,
+    ):
+        self.path = path
+        self.identity = identity
+        self.name = name
+        self.title = title
+        self.video_codec = video_codec
+        self.subtitle = subtitle
+        self.optimized = optimized
+
+
+class StateStore:
+    """
+    SQLite store of processed media files, so reruns can skip files that are
+    already clean without probing them. Probe results are kept here too, so
+    they survive between runs. The store can be shared between threads.
+
+    Attributes:
+    - path: Path of the SQLite database file.
+    """
+
+    schema_version = 2
+
+    def __init__(self, path: Optional[str] = None):
+        """
+        Open, or create, the state store.
+
+        Args:
+        - path (Optional[str]): Path of the database file, defaults to the user cache directory.
+        """
+        self.path = path or os.path.join(default_cache_directory(), "state.sqlite3")
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.lock = threading.RLock()
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        if (
+            self.connection.execute("PRAGMA user_version").fetchone()[0]
+            != self.schema_version
+        ):
+            self.connection.execute("DROP TABLE IF EXISTS files")
+            self.connection.execute("DROP TABLE IF EXISTS probes")
+            self.connection.execute(f"PRAGMA user_version={self.schema_version}")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            "path TEXT PRIMARY KEY, device INTEGER, inode INTEGER, size INTEGER, "
+            "mtime_ns INTEGER, name TEXT, title TEXT, video_codec TEXT, "
+            "subtitle INTEGER, optimized INTEGER, updated REAL)"
+        )
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS probes ("
+            "device INTEGER, inode INTEGER, size INTEGER, mtime_ns INTEGER, "
+            "probe TEXT, updated REAL, PRIMARY KEY (device, inode))"
+        )
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS estimates ("
+            "id INTEGER PRIMARY KEY, path TEXT, source_size INTEGER, duration REAL, "
+            "predicted_size INTEGER, predicted_seconds REAL, transcode INTEGER, "
+            "actual_size INTEGER, actual_seconds REAL, created REAL)"
+        )
+        self.connection.commit()
+
+    def get(self, path: str) -> Optional[FileState]:
+        """
+        Get the recorded state of a media file.
+
+        Args:
+        - path (str): Path of the media file.
+
+        Returns:
+        - The FileState, or None if the file has not been recorded.
+        """
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT path, device, inode, size, mtime_ns, name, title, video_codec, "
+                "subtitle, optimized FROM files WHERE path = ?",
+                (os.path.normpath(path),),
+            ).fetchone()
+        if row is None:
+            return None
+        return FileState(
+            path=row[0],
+            identity=(row[1], row[2], row[3], row[4]),
+            name=row[5],
+            title=row[6],
+            video_codec=row[7],
+            subtitle=bool(row[8]),
+            optimized=bool(row[9]),
+        )
+
+    def is_clean(
+        self, path: str, subtitle: bool = False, optimize: bool = False
+    ) -> bool:
+        """
+        Check whether a media file is unchanged since it was last processed
+        with settings that cover the requested ones.
+
+        Args:
+        - path (str): Path of the media file.
+        - subtitle (bool): Flag indicating whether subtitles are requested.
+        - optimize (bool): Flag indicating whether optimization is requested.
+
+        Returns:
+        - True if the file can be skipped.
+        """
+        state = self.get(path)
+        if state is None:
+            return False
+        try:
+            identity = file_identity(path)
+        except OSError:
+            return False
+        return (
+            state.identity == identity
+            and state.name == os.path.basename(path)
+            and (state.subtitle or not subtitle)
+            and (state.optimized or not optimize)
+        )
+
+    def record(self, state: FileState) -> None:
+        """
+        Record the outcome of processing a media file.
+
+        Args:
+        - state (FileState): Outcome to record.
+        """
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO files (path, device, inode, size, mtime_ns, "
+                "name, title, video_codec, subtitle, optimized, updated) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    os.path.normpath(state.path),
+                    *state.identity,
+                    state.name,
+                    state.title,
+                    state.video_codec,
+                    int(state.subtitle),
+                    int(state.optimized),
+                    time.time(),
+                ),
+            )
+            self.connection.commit()
+
+    def get_probe(
+        self, identity: Tuple[int, int, int, int]
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Get a persisted probe result for a file.
+
+        Args:
+        - identity (Tuple[int, int, int, int]): Identity of the file.
+
+        Returns:
+        - The probe result, or None if the file changed or was never probed.
+        """
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT probe FROM probes "
+                "WHERE device = ? AND inode = ? AND size = ? AND mtime_ns = ?",
+                identity,
+            ).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+    def record_probe(
+        self, identity: Tuple[int, int, int, int], probe: Dict[str, Any]
+    ) -> None:
+        """
+        Persist a probe result for a file.
+
+        Args:
+        - identity (Tuple[int, int, int, int]): Identity of the file.
+        - probe (Dict[str, Any]): Probe result.
+        """
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO probes (device, inode, size, mtime_ns, probe, "
+                "updated) VALUES (?, ?, ?, ?, ?, ?)",
+                (*identity, json.dumps(probe), time.time()),
+            )
+            self.connection.commit()
+
+    def record_estimate(
+        self,
+        path: str,
+        source_size: int,
+        duration: float,
+        predicted_size: int,
+        predicted_seconds: float,
+        transcode: bool,
+    ) -> int:
+        """
+        Record the projected outcome of transcoding a media file.
+
+        Args:
+        - path (str): Path of the media file.
+        - source_size (int): Size of the media file in bytes.
+        - duration (float): Length of the media file in seconds.
+        - predicted_size (int): Projected size of the transcoded file in bytes.
+        - predicted_seconds (float): Projected wall time of the transcode.
+        - transcode (bool): Flag indicating whether the file is transcoded.
+
+        Returns:
+        - ID of the estimate, to record the actual outcome with.
+        """
+        with self.lock:
+            cursor = self.connection.execute(
+                "INSERT INTO estimates (path, source_size, duration, predicted_size, "
+                "predicted_seconds, transcode, created) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    os.path.normpath(path),
+                    source_size,
+                    duration,
+                    predicted_size,
+                    predicted_seconds,
+                    int(transcode),
+                    time.time(),
+                ),
+            )
+            self.connection.commit()
+            return cursor.lastrowid
+
+    def record_estimate_result(
+        self, estimate_id: int, actual_size: int, actual_seconds: float
+    ) -> None:
+        """
+        Record the actual outcome of a transcode that was estimated.
+
+        Args:
+        - estimate_id (int): ID returned by record_estimate().
+        - actual_size (int): Size of the transcoded file in bytes.
+        - actual_seconds (float): Wall time of the transcode.
+        """
+        with self.lock:
+            self.connection.execute(
+                "UPDATE estimates SET actual_size = ?, actual_seconds = ? WHERE id = ?",
+                (actual_size, actual_seconds, estimate_id),
+            )
+            self.connection.commit()
+
+    def estimate_accuracy(self) -> Dict[str, Any]:
+        """
+        Summarize how close the estimates came to the transcodes they projected.
+
+        Returns:
+        - Dictionary with the number of estimates, of files skipped and of
+          transcodes measured, and the mean absolute error of the projected
+          size and time of the measured transcodes, as fractions of the
+          actual values (None without measured transcodes).
+        """
+        with self.lock:
+            estimates, skipped = self.connection.execute(
+                "SELECT COUNT(*), COALESCE(SUM(1 - transcode), 0) FROM estimates"
+            ).fetchone()
+            measured, size_error, time_error = self.connection.execute(
+                "SELECT COUNT(*), "
+                "AVG(ABS(predicted_size - actual_size) * 1.0 / actual_size), "
+                "AVG(ABS(predicted_seconds - actual_seconds) / actual_seconds) "
+                "FROM estimates WHERE actual_size > 0 AND actual_seconds > 0"
+            ).fetchone()
+        return {
+            "estimates": estimates,
+            "skipped": skipped,
+            "measured": measured,
+            "size_error": size_error,
+            "time_error": time_error,
+        }
+
+    def forget(self, path: str) -> None:
+        """
+        Remove a media file from the store.
+
+        Args:
+        - path (str): Path of the media file.
+        """
+        with self.lock:
+            self.connection.execute(
+                "DELETE FROM files WHERE path = ?", (os.path.normpath(path),)
+            )
+            self.connection.commit()
+
+    def clear(self) -> None:
+        """
+        Invalidate the store by removing every recorded file and probe result.
+        """
+        with self.lock:
+            self.connection.execute("DELETE FROM files")
+            self.connection.execute("DELETE FROM probes")
+            self.connection.commit()
+
+    def close(self) -> None:
+        """
+        Close the database connection.
+        """
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from fractions import Fraction
+from typing import Any, Dict, List, Optional, Union
+
+# Codecs kept as they are when optimizing, they compress as well as what
+# they would be encoded to
+VIDEO_CODECS_KEPT = ("hevc", "av1")
+AUDIO_CODECS_KEPT = ("aac", "opus")
+# HEVC at the default CRF lands around 0.03 to 0.05 bits per pixel, so video
+# below this is not worth the encode whatever its codec
+DEFAULT_BITS_PER_PIXEL = 0.05
+# Audio within this factor of the target bitrate is not worth the encode
+AUDIO_BITRATE_TOLERANCE = 1.25
+
+
+def parse_bitrate(value: Union[str, int, float, None]) -> Optional[float]:
+    """
+    Parse a bitrate as ffprobe or ffmpeg write it.
+
+    Args:
+    - value (Union[str, int, float, None]): Bitrate, e.g. 128000 or '128k'.
+
+    Returns:
+    - Bits per second, or None if the value is missing or not a bitrate.
+    """
+    if value is None:
+        return None
+    text = str(value).strip().lower()
+    multiplier = 1
+    if text[-1:] in ("k", "m"):
+        multiplier = 1000 if text[-1] == "k" else 1000000
+        text = text[:-1]
+    try:
+        bitrate = float(text) * multiplier
+    except ValueError:
+        return None
+    return bitrate if bitrate > 0 else None
+
+
+def frame_rate(stream: Dict[str, Any]) -> Optional[float]:
+    """
+    Read the frame rate of a video stream.
+
+    Args:
+    - stream (Dict[str, Any]): Stream of an ffprobe result.
+
+    Returns:
+    - Frames per second, or None if it is unknown.
+    """
+    for key in ("avg_frame_rate", "r_frame_rate"):
+        try:
+            rate = float(Fraction(stream[key]))
+        except (KeyError, ValueError, ZeroDivisionError):
+            continue
+        if rate > 0:
+            return rate
+    return None
+
+
+def stream_bitrate(stream: Dict[str, Any]) -> Optional[float]:
+    """
+    Read the bitrate of a stream.
+
+    Matroska files rarely carry a bit_rate per stream, but mkvmerge writes
+    the statistics tags, which ffprobe reports as BPS.
+
+    Args:
+    - stream (Dict[str, Any]): Stream of an ffprobe result.
+
+    Returns:
+    - Bits per second, or None if it is unknown.
+    """
+    bitrate = parse_bitrate(stream.get("bit_rate"))
+    if bitrate:
+        return bitrate
+    for key, value in stream.get("tags", {}).items():
+        if key.upper() in ("BPS", "BPS-ENG"):
+            return parse_bitrate(value)
+    return None
+
+
+class StreamDecision:
+    """
+    Whether to copy or encode one stream of a media file.
+
+    Attributes:
+    - index: Index of the stream in the file.
+    - codec_type: Type of the stream, e.g. 'video' or 'audio'.
+    - type_index: Index of the stream among the streams of its type, as used
+      in ffmpeg stream specifiers.
+    - codec_name: Codec of the stream.
+    - encoder: Encoder to encode the stream with, or None to copy it.
+    - reason: Why the stream is copied or encoded.
+    """
+
+    __slots__ = ("index", "codec_type", "type_index", "codec_name", "encoder", "reason")
+
+    def __init__(
+        self,
+        index: int,
+        codec_type: str,
+        type_index: int,
+        codec_name: str,
+        encoder: Optional[str],
+        reason: str,
+    ):
+        """
+        Initialize the StreamDecision.
+
+        Args:
+        - index (int): Index of the stream in the file.
+        - codec_type (str): Type of the stream.
+        - type_index (int): Index of the stream among the streams of its type.
+        - codec_name (str): Codec of the stream.
+        - encoder (Optional[str]): Encoder to encode the stream with, or None to copy it.
+        - reason (str): Why the stream is copied or encoded.
+        """
+        self.index = index
+        self.codec_type = codec_type
+        self.type_index = type_index
+        self.codec_name = codec_name
+        self.encoder = encoder
+        self.reason = reason
+
+    @property
+    def specifier(self) -> str:
+        """
+        ffmpeg stream specifier of the stream in the output, e.g. 'v:0'.
+        """
+        return f"{self.codec_type[0]}:{self.type_index}"
+
+    def __str__(self) -> str:
+        action = f"encode to {self.encoder}" if self.encoder else "copy"
+        return (
+            f"Stream {self.index} ({self.codec_type} {self.codec_name}): "
+            f"{action}, {self.reason}"
+        )
+
+
+class StreamPlan:
+    """
+    Per stream codec decisions for optimizing a media file.
+
+    Attributes:
+    - decisions: Decision of every video and audio stream, in file order.
+    """
+
+    def __init__(self, decisions: List[StreamDecision]):
+        """
+        Initialize the StreamPlan.
+
+        Args:
+        - decisions (List[StreamDecision]): Decision of every video and audio stream.
+        """
+        self.decisions = decisions
+
+    @property
+    def transcode(self) -> bool:
+        """
+        Flag indicating whether any stream is encoded.
+        """
+        return any(decision.encoder for decision in self.decisions)
+
+    def encodes(self, codec_type: str) -> bool:
+        """
+        Check whether any stream of a type is encoded.
+
+        Args:
+        - codec_type (str): Type of the streams, e.g. 'video'.
+
+        Returns:
+        - True if a stream of the type is encoded.
+        """
+        return any(
+            decision.encoder and decision.codec_type == codec_type
+            for decision in self.decisions
+        )
+
+    def copy_all(self, reason: str) -> None:
+        """
+        Copy every stream, e.g. when encoding would not pay off.
+
+        Args:
+        - reason (str): Why the streams are copied.
+        """
+        for decision in self.decisions:
+            if decision.encoder:
+                decision.encoder = None
+                decision.reason = reason
+
+    def output_parameters(self) -> Dict[str, str]:
+        """
+        Build the ffmpeg codec options of the plan.
+
+        Every stream is copied unless it is encoded, ffmpeg applies the
+        per stream codecs over the 'c' default as they sort after it.
+
+        Returns:
+        - Output parameters for ffmpeg-python, e.g. {'c': 'copy', 'c:v:0': 'libx265'}.
+        """
+        parameters = {"c": "copy"}
+        for decision in self.decisions:
+            if decision.encoder:
+                parameters[f"c:{decision.specifier}"] = decision.encoder
+        return parameters
+
+
+def plan_streams(
+    probe: Dict[str, Any],
+    video_encoder: str = "libx265",
+    audio_encoder: str = "aac",
+    audio_bitrate: Union[str, int, None] = "128k",
+    bits_per_pixel: float = DEFAULT_BITS_PER_PIXEL,
+) -> StreamPlan:
+    """
+    Decide which streams of a media file to copy and which to encode.
+
+    Video already in HEVC or AV1, or below the bits per pixel threshold, is
+    copied, as is cover art. Audio already in AAC or Opus at a bitrate close
+    to the target is copied. Every other video and audio stream is encoded.
+
+    Args:
+    - probe (Dict[str, Any]): ffprobe result of the media file.
+    - video_encoder (str): Encoder for the video streams encoded.
+    - audio_encoder (str): Encoder for the audio streams encoded.
+    - audio_bitrate (Union[str, int, None]): Target audio bitrate, e.g. '128k'.
+    - bits_per_pixel (float): Video bitrate per pixel per frame below which
+      video is copied.
+
+    Returns:
+    - The StreamPlan of the media file.
+    """
+    streams = probe.get("streams", [])
+    target_audio_bitrate = parse_bitrate(audio_bitrate)
+    # Without a bitrate per video stream, the video is what is left of the
+    # bitrate of the file once the audio with a known bitrate is taken out
+    format_bitrate = parse_bitrate(probe.get("format", {}).get("bit_rate"))
+    videos = [
+        stream
+        for stream in streams
+        if stream.get("codec_type") == "video"
+        and not stream.get("disposition", {}).get("attached_pic")
+    ]
+    if format_bitrate and len(videos) == 1:
+        for stream in streams:
+            if stream.get("codec_type") == "audio":
+                format_bitrate -= stream_bitrate(stream) or 0
+
+    decisions = []
+    type_indexes: Dict[str, int] = {}
+    for index, stream in enumerate(streams):
+        codec_type = stream.get("codec_type", "")
+        if codec_type not in ("video", "audio"):
+            continue
+        type_index = type_indexes.get(codec_type, 0)
+        type_indexes[codec_type] = type_index + 1
+        codec_name = stream.get("codec_name", "")
+        encoder = None
+        if codec_type == "video":
+            bitrate = stream_bitrate(stream)
+            if bitrate is None and len(videos) == 1 and format_bitrate:
+                bitrate = format_bitrate
+            rate = frame_rate(stream)
+            pixels = (stream.get("width") or 0) * (stream.get("height") or 0)
+            if stream.get("disposition", {}).get("attached_pic"):
+                reason = "cover art"
+            elif codec_name in VIDEO_CODECS_KEPT:
+                reason = f"already {codec_name}"
+            elif bitrate and rate and pixels:
+                density = bitrate / (pixels * rate)
+                if density < bits_per_pixel:
+                    reason = f"{density:.3f} bits per pixel is below {bits_per_pixel}"
+                else:
+                    encoder = video_encoder
+                    reason = f"{density:.3f} bits per pixel"
+            else:
+                encoder = video_encoder
+                reason = "bitrate unknown"
+        else:
+            bitrate = stream_bitrate(stream)
+            if codec_name not in AUDIO_CODECS_KEPT:
+                encoder = audio_encoder
+                reason = f"{codec_name or 'unknown codec'} is not kept"
+            elif (
+                bitrate
+                and target_audio_bitrate
+                and bitrate > target_audio_bitrate * AUDIO_BITRATE_TOLERANCE
+            ):
+                encoder = audio_encoder
+                reason = f"{bitrate / 1000:.0f} kb/s is above the target"
+            else:
+                reason = f"already {codec_name}"
+        decisions.append(
+            StreamDecision(index, codec_type, type_index, codec_name, encoder, reason)
+        )
+    return StreamPlan(decisions)
@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import threading
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+SUBTITLE_EXTENSIONS = ("srt",)
+EPISODE_PATTERN = "[Ss][0-9]+[Ee][0-9]+"
+# Language of a subtitle file by the words download groups name them with,
+# and its ISO 639-2 code for the stream metadata. Two letter codes are also
+# ordinary words, e.g. 'It' or 'No', so they only count at the end of a name
+LANGUAGES = {
+    "English": ("eng", ("english", "eng", "en")),
+    "Spanish": ("spa", ("spanish", "spa", "es", "esp")),
+    "French": ("fre", ("french", "fre", "fra", "fr")),
+    "German": ("ger", ("german", "ger", "deu", "de")),
+    "Italian": ("ita", ("italian", "ita", "it")),
+    "Portuguese": ("por", ("portuguese", "por", "pt")),
+    "Dutch": ("dut", ("dutch", "dut", "nld", "nl")),
+    "Swedish": ("swe", ("swedish", "swe", "sv")),
+    "Danish": ("dan", ("danish", "dan", "da")),
+    "Norwegian": ("nor", ("norwegian", "nor", "no", "nb")),
+    "Finnish": ("fin", ("finnish", "fin", "fi")),
+    "Polish": ("pol", ("polish", "pol", "pl")),
+    "Russian": ("rus", ("russian", "rus", "ru")),
+    "Greek": ("gre", ("greek", "gre", "ell", "el")),
+    "Turkish": ("tur", ("turkish", "tur", "tr")),
+    "Arabic": ("ara", ("arabic", "ara", "ar")),
+    "Hebrew": ("heb", ("hebrew", "heb", "he")),
+    "Hindi": ("hin", ("hindi", "hin")),
+    "Japanese": ("jpn", ("japanese", "jpn", "ja")),
+    "Chinese": ("chi", ("chinese", "chi", "zho", "zh")),
+    "Korean": ("kor", ("korean", "kor", "ko")),
+}
+LANGUAGE_ALIASES = {
+    alias: language for language, (_, aliases) in LANGUAGES.items() for alias in aliases
+}
+# Words marking a kind of subtitles rather than a language, 'hi' being
+# hearing impaired
+SUBTITLE_FLAGS = ("forced", "sdh", "hi", "cc")
+
+
+def subtitle_language(file_name: str) -> Optional[str]:
+    """
+    Detect the language of a subtitle file from its name, e.g. '2_English.srt'
+    or 'Show.S01E02.en.forced.srt'.
+
+    Language names are preferred over three letter codes, found anywhere in
+    the name. Two letter codes are only accepted as the last word, or the
+    last word before flags such as 'forced', 'sdh' or 'hi'.
+
+    Args:
+    - file_name (str): Name of the subtitle file.
+
+    Returns:
+    - Language name, e.g. 'English', or None if the name does not tell.
+    """
+    words = [
+        word
+        for word in re.split(
+            r"[\s._\-\[\]()]+", os.path.splitext(file_name)[0].casefold()
+        )
+        if word
+    ]
+    names = [word for word in words if len(word) > 3 and word in LANGUAGE_ALIASES]
+    codes = [word for word in words if len(word) == 3 and word in LANGUAGE_ALIASES]
+    for found in (names, codes):
+        if found:
+            return LANGUAGE_ALIASES[found[-1]]
+    while words and words[-1] in SUBTITLE_FLAGS:
+        words.pop()
+    if words and len(words[-1]) == 2:
+        return LANGUAGE_ALIASES.get(words[-1])
+    return None
+
+
+def language_code(language: str) -> str:
+    """
+    Get the ISO 639-2 code of a language.
+
+    Args:
+    - language (str): Language name, e.g. 'English'.
+
+    Returns:
+    - Language code, e.g. 'eng', or 'und' if the language is unknown.
+    """
+    return LANGUAGES.get(language, ("und", ()))[0]
+
+
+def subtitle_key(name: str) -> str:
+    """
+    Normalize a cleaned media name into the key its subtitles are indexed by,
+    so 'Show Name - S01E02' and 'show.name.s01e02' match.
+
+    Args:
+    - name (str): Cleaned name of a media file or subtitle folder.
+
+    Returns:
+    - The key.
+    """
+    return " ".join(re.findall(r"[^\W_]+", name.casefold()))
+
+
+class SubtitleTrack:
+    """
+    A subtitle file in the index.
+
+    Its path is kept relative to its Subs directory, which moves along with
+    the media it belongs to.
+
+    Attributes:
+    - language: Language name, e.g. 'English'.
+    - folder: Name of the folder of the file within Subs when it was indexed,
+      or '' if it is directly inside Subs.
+    - file_name: Name of the subtitle file.
+    """
+
+    __slots__ = ("language", "folder", "file_name")
+
+    def __init__(self, language: str, folder: str, file_name: str):
+        """
+        Initialize the SubtitleTrack.
+
+        Args:
+        - language (str): Language name.
+        - folder (str): Folder of the file within Subs, or ''.
+        - file_name (str): Name of the subtitle file.
+        """
+        self.language = language
+        self.folder = folder
+        self.file_name = file_name
+
+    def __repr__(self) -> str:
+        return f"SubtitleTrack({self.language!r}, {self.folder!r}, {self.file_name!r})"
+
+
+class SubtitleIndex:
+    """
+    Index of the subtitle files in the Subs directories of a scan, by media
+    and language.
+
+    Each Subs directory is read once. Subtitles in a folder per episode,
+    e.g. Subs/Show.S01E02.1080p/2_English.srt, are indexed by the cleaned
+    folder name; subtitles directly inside Subs by the cleaned file name if
+    it names an episode, and otherwise by the cleaned name of the directory
+    holding Subs, which a movie named unlike its folder falls back to. Media
+    is looked up by its cleaned name, so processing a
+    file costs a dictionary lookup and a stat of the files found instead of
+    reading the Subs directory again.
+
+    Attributes:
+    - clean_name: Function cleaning a media or folder name as media files
+      are renamed, e.g. 'Show.S01E02.1080p' to 'Show - S01E02'.
+    """
+
+    def __init__(self, clean_name: Callable[[str], str]):
+        """
+        Initialize the SubtitleIndex.
+
+        Args:
+        - clean_name (Callable[[str], str]): Function cleaning a media or folder name.
+        """
+        self.clean_name = clean_name
+        self._tracks: Dict[str, List[SubtitleTrack]] = {}
+        self._clean_names: Dict[str, str] = {}
+        self._indexed: Set[str] = set()
+        self._owners: Dict[Tuple[int, int], str] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return sum(len(tracks) for tracks in self._tracks.values())
+
+    def cleaned(self, name: str) -> str:
+        """
+        Clean a name, once per distinct name.
+
+        Args:
+        - name (str): Media or folder name.
+
+        Returns:
+        - The cleaned name.
+        """
+        cleaned = self._clean_names.get(name)
+        if cleaned is None:
+            cleaned = self._clean_names[name] = self.clean_name(name)
+        return cleaned
+
+    def add_directory(self, subtitle_directory: str) -> int:
+        """
+        Index the subtitle files of a Subs directory.
+
+        Args:
+        - subtitle_directory (str): Path of the Subs directory.
+
+        Returns:
+        - Number of subtitle files indexed, 0 if the directory was indexed before.
+        """
+        subtitle_directory = os.path.normpath(subtitle_directory)
+        with self._lock:
+            if subtitle_directory in self._indexed:
+                return 0
+            self._indexed.add(subtitle_directory)
+        owner = os.path.basename(os.path.dirname(subtitle_directory))
+        identity = self._identity(subtitle_directory)
+        found: List[Tuple[str, SubtitleTrack]] = []
+        for directory, _, file_names in os.walk(subtitle_directory):
+            folder = os.path.relpath(directory, subtitle_directory)
+            folder = "" if folder == os.curdir else folder
+            for file_name in file_names:
+                extension = os.path.splitext(file_name)[1][1:].lower()
+                if extension not in SUBTITLE_EXTENSIONS:
+                    continue
+                if folder:
+                    name = folder.split(os.sep)[0]
+                elif re.search(EPISODE_PATTERN, file_name):
+                    name = os.path.splitext(file_name)[0]
+                else:
+                    name = owner
+                track = SubtitleTrack(
+                    subtitle_language(file_name) or "Unknown", folder, file_name
+                )
+                found.append((subtitle_key(self.cleaned(name)), track))
+        with self._lock:
+            if identity:
+                self._owners[identity] = subtitle_key(self.cleaned(owner))
+            for key, track in found:
+                self._tracks.setdefault(key, []).append(track)
+            for key in {key for key, _ in found}:
+                self._tracks[key].sort(
+                    key=lambda track: (track.folder, track.file_name)
+                )
+        return len(found)
+
+    def find(
+        self, name: str, subtitle_directory: str, languages: List[str]
+    ) -> List[Tuple[str, str]]:
+        """
+        Find the subtitles of a media file.
+
+        A movie whose name has no subtitles of its own gets the subtitles
+        directly inside the Subs directory of its folder, e.g. Subs/English.srt
+        for Movie.2010.1080p/grp-movie-1080p.mkv, also after the folder was
+        renamed.
+
+        Args:
+        - name (str): Cleaned name of the media file, without extension.
+        - subtitle_directory (str): Current path of its Subs directory.
+        - languages (List[str]): Languages wanted, in order of preference.
+
+        Returns:
+        - List of (language, path), at most one per language, in the order
+          of the languages wanted.
+        """
+        with self._lock:
+            tracks = list(self._tracks.get(subtitle_key(name), ()))
+        if not tracks and not re.search(EPISODE_PATTERN, name):
+            identity = self._identity(subtitle_directory)
+            with self._lock:
+                owner_key = self._owners.get(identity) if identity else None
+                tracks = [
+                    track
+                    for track in self._tracks.get(owner_key, ())
+                    if not track.folder
+                ]
+        subtitles = []
+        for language in languages:
+            for track in tracks:
+                if track.language != language:
+                    continue
+                path = self.locate(track, subtitle_directory)
+                if path:
+                    subtitles.append((language, path))
+                    break
+        return subtitles
+
+    @staticmethod
+    def _identity(subtitle_directory: str) -> Optional[Tuple[int, int]]:
+        # Device and inode of a Subs directory, which stay the same when the
+        # directory holding it is renamed
+        try:
+            stat = os.stat(subtitle_directory)
+        except OSError:
+            return None
+        return stat.st_dev, stat.st_ino
+
+    def locate(self, track: SubtitleTrack, subtitle_directory: str) -> Optional[str]:
+        """
+        Find the current path of a subtitle file, whose folder may have been
+        renamed to its cleaned name meanwhile.
+
+        Args:
+        - track (SubtitleTrack): Subtitle file.
+        - subtitle_directory (str): Current path of its Subs directory.
+
+        Returns:
+        - Path of the file, or None if it is gone.
+        """
+        folders = [track.folder]
+        if track.folder:
+            first, _, rest = track.folder.partition(os.sep)
+            folders.insert(0, os.path.join(self.cleaned(first), rest))
+        for folder in folders:
+            path = os.path.normpath(
+                os.path.join(subtitle_directory, folder, track.file_name)
+            )
+            if os.path.isfile(path):
+                return path
+        return None
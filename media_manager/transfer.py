@@ -0,0 +1,522 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import errno
+import shutil
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# ioctl cloning a file's extents into another file on btrfs, XFS and others
+FICLONE = 0x40049409
+
+# Errors telling that a hardlink can not be made between these paths
+UNLINKABLE = {errno.EXDEV, errno.EPERM, errno.EMLINK, errno.EOPNOTSUPP, errno.ENOTSUP}
+
+# Errors telling that a zero-copy system call does not support these files
+UNSUPPORTED = {
+    errno.EXDEV,
+    errno.ENOSYS,
+    errno.EINVAL,
+    errno.EOPNOTSUPP,
+    errno.ENOTSUP,
+}
+
+
+class TransferError(OSError):
+    """
+    Raised when a file can not be moved, or its copy does not match the source.
+    """
+
+
+class TransferEngine:
+    """
+    Moves files and directory trees across file systems.
+
+    Moves within a file system are renames. Otherwise files are copied
+    several at a time with copy_file_range(), falling back to sendfile() and
+    then to read and write, and hashed while they are copied. Each copy is
+    written next to its destination as a .part file, with a .part.json
+    journal recording how much of it is safely on disk, so an interrupted
+    move resumes where it stopped when it is run again. Copies are synced
+    and read back to check their hash, and a source file is only deleted
+    once its copy is verified and renamed into place.
+
+    Attributes:
+    - jobs: Number of files copied concurrently.
+    - chunk_size: Number of bytes copied per system call.
+    - checkpoint_size: Number of bytes copied between journal updates.
+    - verify: Flag indicating whether copies are hashed and read back.
+    - bytes_copied: Number of bytes copied.
+    - files_copied: Number of files copied.
+    - files_resumed: Number of files whose copy resumed from a journal.
+    - files_linked: Number of files placed by link_file() as hardlinks.
+    - files_reflinked: Number of files placed by link_file() as reflinks.
+    """
+
+    def __init__(
+        self,
+        jobs: int = 4,
+        chunk_size: int = 8 * 1024 * 1024,
+        checkpoint_size: int = 256 * 1024 * 1024,
+        verify: bool = True,
+    ):
+        """
+        Initialize the TransferEngine.
+
+        Args:
+        - jobs (int): Number of files copied concurrently.
+        - chunk_size (int): Number of bytes copied per system call.
+        - checkpoint_size (int): Number of bytes copied between journal updates.
+        - verify (bool): Hash copies and read them back before deleting the source.
+        """
+        self.jobs = max(1, int(jobs))
+        self.chunk_size = chunk_size
+        self.checkpoint_size = checkpoint_size
+        self.verify = verify
+        self.bytes_copied = 0
+        self.files_copied = 0
+        self.files_resumed = 0
+        self.files_linked = 0
+        self.files_reflinked = 0
+        self.lock = threading.Lock()
+        self._method = "copy_file_range" if hasattr(os, "copy_file_range") else None
+        if self._method is None and hasattr(os, "sendfile"):
+            self._method = "sendfile"
+
+    def move(self, source: str, destination: str) -> None:
+        """
+        Move a file or directory tree, like shutil.move().
+
+        When the destination is a directory, the source is moved into it. A
+        directory moved onto an existing directory is merged into it, which
+        also resumes an interrupted move.
+
+        Args:
+        - source (str): Path of the file or directory to move.
+        - destination (str): Path to move it to, or directory to move it into.
+        """
+        if os.path.isdir(destination):
+            destination = os.path.join(
+                destination, os.path.basename(os.path.normpath(source))
+            )
+        source_directory = os.path.isdir(source) and not os.path.islink(source)
+        if not source_directory:
+            self.move_file(source, destination)
+            return
+        if not os.path.lexists(destination):
+            try:
+                os.rename(source, destination)
+                return
+            except OSError as e:
+                if e.errno != errno.EXDEV:
+                    raise
+        elif not os.path.isdir(destination):
+            raise TransferError(
+                errno.EEXIST, "Destination path already exists", destination
+            )
+        self.move_tree(source, destination)
+
+    def move_tree(self, source: str, destination: str) -> None:
+        """
+        Move the files of a directory tree several at a time, then remove it.
+
+        Args:
+        - source (str): Path of the directory to move.
+        - destination (str): Path of the directory to move it to, merged into if it exists.
+        """
+        files: List[Tuple[str, str]] = []
+        for directory, directory_names, file_names in os.walk(source):
+            target = os.path.normpath(
+                os.path.join(destination, os.path.relpath(directory, source))
+            )
+            os.makedirs(target, exist_ok=True)
+            for name in list(directory_names):
+                # Links to directories are moved as links, not followed
+                if os.path.islink(os.path.join(directory, name)):
+                    directory_names.remove(name)
+                    file_names.append(name)
+            for name in file_names:
+                files.append(
+                    (os.path.join(directory, name), os.path.join(target, name))
+                )
+        errors = []
+        with ThreadPoolExecutor(
+            max_workers=self.jobs, thread_name_prefix="media-manager-transfer"
+        ) as executor:
+            futures = [
+                executor.submit(self.move_file, file_source, file_destination)
+                for file_source, file_destination in files
+            ]
+            for future in futures:
+                try:
+                    future.result()
+                except OSError as e:
+                    errors.append(e)
+        if errors:
+            raise TransferError(
+                errno.EIO,
+                f"{len(errors)} of {len(files)} files not moved, first error: {errors[0]}",
+                source,
+            )
+        for directory, _, _ in os.walk(source, topdown=False):
+            try:
+                shutil.copystat(
+                    directory,
+                    os.path.join(destination, os.path.relpath(directory, source)),
+                )
+            except OSError:
+                pass
+        shutil.rmtree(source)
+
+    def move_file(self, source: str, destination: str) -> None:
+        """
+        Move a single file, copying it when it is on another file system.
+
+        Args:
+        - source (str): Path of the file to move.
+        - destination (str): Path to move it to.
+        """
+        if os.path.islink(source):
+            if os.path.lexists(destination):
+                raise TransferError(
+                    errno.EEXIST, "Destination path already exists", destination
+                )
+            os.symlink(os.readlink(source), destination)
+            os.unlink(source)
+            return
+        if os.path.lexists(destination):
+            # A move interrupted after the copy was renamed into place
+            if self.verify and self.same_content(source, destination):
+                os.unlink(source)
+                return
+            raise TransferError(
+                errno.EEXIST, "Destination path already exists", destination
+            )
+        try:
+            os.rename(source, destination)
+            return
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+        self.copy_file(source, destination)
+        os.unlink(source)
+
+    def link_files(self, files: Iterable[Tuple[str, str]]) -> None:
+        """
+        Place files at new paths with link_file(), several at a time.
+
+        Args:
+        - files (Iterable[Tuple[str, str]]): Source and destination paths.
+        """
+        files = list(files)
+        errors = []
+        with ThreadPoolExecutor(
+            max_workers=self.jobs, thread_name_prefix="media-manager-transfer"
+        ) as executor:
+            futures = [
+                executor.submit(self.link_file, source, destination)
+                for source, destination in files
+            ]
+            for future in futures:
+                try:
+                    future.result()
+                except OSError as e:
+                    errors.append(e)
+        if errors:
+            raise TransferError(
+                errno.EIO,
+                f"{len(errors)} of {len(files)} files not linked, first error: {errors[0]}",
+            )
+
+    def link_file(self, source: str, destination: str) -> str:
+        """
+        Place a file at a new path without moving it or taking up more space.
+
+        The file is hardlinked when both paths are on the same file system,
+        reflinked when the file system can share extents between them, and
+        only copied when neither is possible.
+
+        Args:
+        - source (str): Path of the file, left in place.
+        - destination (str): Path to place it at.
+
+        Returns:
+        - How the file was placed: 'hardlink', 'reflink' or 'copy'.
+        """
+        if os.path.lexists(destination):
+            if os.path.samefile(source, destination):
+                return "hardlink"
+            raise TransferError(
+                errno.EEXIST, "Destination path already exists", destination
+            )
+        try:
+            os.link(source, destination)
+            with self.lock:
+                self.files_linked += 1
+            return "hardlink"
+        except OSError as e:
+            if e.errno not in UNLINKABLE:
+                raise
+        if self.reflink(source, destination):
+            with self.lock:
+                self.files_reflinked += 1
+            return "reflink"
+        self.copy_file(source, destination)
+        return "copy"
+
+    def reflink(self, source: str, destination: str) -> bool:
+        """
+        Clone a file, sharing its data until either copy is written to.
+
+        Args:
+        - source (str): Path of the file.
+        - destination (str): Path of the clone, which must not exist.
+
+        Returns:
+        - True if the clone was made, False if the file system does not support it.
+        """
+        if fcntl is None:
+            return False
+        with open(source, "rb") as source_file, open(
+            destination, "xb"
+        ) as destination_file:
+            try:
+                fcntl.ioctl(destination_file.fileno(), FICLONE, source_file.fileno())
+                cloned = True
+            except OSError:
+                cloned = False
+        if not cloned:
+            os.unlink(destination)
+            return False
+        shutil.copystat(source, destination)
+        return True
+
+    def unshare(self, path: str, copy: bool = True) -> bool:
+        """
+        Give a hardlinked file its own data, so writing to it leaves its other
+        links, e.g. a download that is still seeding, untouched.
+
+        Args:
+        - path (str): Path of the file.
+        - copy (bool): Copy the file when it can not be reflinked.
+
+        Returns:
+        - True if the file has no other links left.
+        """
+        if os.stat(path).st_nlink <= 1:
+            return True
+        temporary_path = f"{path}.unshare"
+        self._remove(temporary_path)
+        if not self.reflink(path, temporary_path):
+            if not copy:
+                return False
+            shutil.copy2(path, temporary_path)
+        os.replace(temporary_path, path)
+        return True
+
+    def copy_file(self, source: str, destination: str) -> Optional[str]:
+        """
+        Copy a file with its permissions and times, resuming an interrupted copy.
+
+        Args:
+        - source (str): Path of the file to copy.
+        - destination (str): Path of the copy.
+
+        Returns:
+        - Hex digest of the content, or None when verification is disabled.
+        """
+        part = f"{destination}.part"
+        journal = f"{part}.json"
+        status = os.stat(source)
+        identity = {
+            "source": os.path.abspath(source),
+            "size": status.st_size,
+            "mtime_ns": status.st_mtime_ns,
+        }
+        for attempt in range(2):
+            offset = 0
+            if attempt == 0:
+                offset = self._resume_offset(part, journal, identity)
+            digest = hashlib.sha256() if self.verify else None
+            with open(source, "rb") as source_file, open(
+                part, "r+b" if offset else "wb"
+            ) as part_file:
+                source_descriptor = source_file.fileno()
+                part_descriptor = part_file.fileno()
+                if offset:
+                    os.ftruncate(part_descriptor, offset)
+                    with self.lock:
+                        self.files_resumed += 1
+                    if digest is not None:
+                        self._hash_range(source_descriptor, 0, offset, digest)
+                self._copy_range(
+                    source_descriptor,
+                    part_descriptor,
+                    offset,
+                    status.st_size,
+                    digest,
+                    journal,
+                    identity,
+                )
+                os.fsync(part_descriptor)
+                if digest is not None and hasattr(os, "posix_fadvise"):
+                    # Read the copy back from the disk rather than from the cache
+                    os.posix_fadvise(part_descriptor, 0, 0, os.POSIX_FADV_DONTNEED)
+            if digest is None:
+                if os.path.getsize(part) == status.st_size:
+                    break
+            elif self.file_hash(part) == digest.hexdigest():
+                break
+            os.unlink(part)
+            self._remove(journal)
+        else:
+            raise TransferError(
+                errno.EIO, "Copy does not match the source after a retry", source
+            )
+        shutil.copystat(source, part)
+        os.replace(part, destination)
+        self._sync_directory(os.path.dirname(os.path.abspath(destination)))
+        self._remove(journal)
+        with self.lock:
+            self.files_copied += 1
+        return digest.hexdigest() if digest is not None else None
+
+    def same_content(self, first: str, second: str) -> bool:
+        """
+        Check if two files have the same size and content.
+
+        Args:
+        - first (str): Path of a file.
+        - second (str): Path of another file.
+
+        Returns:
+        - True if the files are identical.
+        """
+        try:
+            if os.path.getsize(first) != os.path.getsize(second):
+                return False
+            return self.file_hash(first) == self.file_hash(second)
+        except OSError:
+            return False
+
+    def file_hash(self, path: str) -> str:
+        """
+        Hash the content of a file.
+
+        Args:
+        - path (str): Path of the file.
+
+        Returns:
+        - Hex digest of the content.
+        """
+        digest = hashlib.sha256()
+        with open(path, "rb") as hashed_file:
+            self._hash_range(
+                hashed_file.fileno(), 0, os.fstat(hashed_file.fileno()).st_size, digest
+            )
+        return digest.hexdigest()
+
+    def _hash_range(self, descriptor: int, start: int, end: int, digest: Any) -> None:
+        while start < end:
+            data = os.pread(descriptor, min(self.chunk_size, end - start), start)
+            if not data:
+                raise TransferError(errno.EIO, "File truncated while reading")
+            digest.update(data)
+            start += len(data)
+
+    def _copy_range(
+        self,
+        source: int,
+        destination: int,
+        offset: int,
+        size: int,
+        digest: Any,
+        journal: str,
+        identity: Dict[str, Any],
+    ) -> None:
+        checkpoint = offset + self.checkpoint_size
+        method = self._method
+        while offset < size:
+            count = min(self.chunk_size, size - offset)
+            data = None
+            try:
+                if method == "copy_file_range":
+                    copied = os.copy_file_range(
+                        source, destination, count, offset, offset
+                    )
+                elif method == "sendfile":
+                    os.lseek(destination, offset, os.SEEK_SET)
+                    copied = os.sendfile(destination, source, offset, count)
+                else:
+                    data = os.pread(source, count, offset)
+                    copied = os.pwrite(destination, data, offset)
+            except OSError as e:
+                if method is None or e.errno not in UNSUPPORTED:
+                    raise
+                # Fall back for the rest of this copy, e.g. across file systems
+                # on kernels without cross-device copy_file_range()
+                method = "sendfile" if method == "copy_file_range" else None
+                continue
+            if not copied:
+                raise TransferError(errno.EIO, "File truncated while copying")
+            if digest is not None:
+                if data is None or len(data) != copied:
+                    data = os.pread(source, copied, offset)
+                digest.update(data)
+            offset += copied
+            with self.lock:
+                self.bytes_copied += copied
+            if offset >= checkpoint and offset < size:
+                os.fdatasync(destination)
+                self._write_journal(journal, dict(identity, offset=offset))
+                checkpoint = offset + self.checkpoint_size
+
+    def _resume_offset(self, part: str, journal: str, identity: Dict[str, Any]) -> int:
+        try:
+            with open(journal, "r") as journal_file:
+                entry = json.load(journal_file)
+            offset = int(entry["offset"])
+            part_size = os.path.getsize(part)
+        except (OSError, ValueError, KeyError, TypeError):
+            return 0
+        if any(entry.get(key) != value for key, value in identity.items()):
+            return 0
+        return offset if 0 < offset <= part_size else 0
+
+    @staticmethod
+    def _write_journal(journal: str, entry: Dict[str, Any]) -> None:
+        temporary_journal = f"{journal}.tmp"
+        with open(temporary_journal, "w") as journal_file:
+            json.dump(entry, journal_file)
+            journal_file.flush()
+            os.fsync(journal_file.fileno())
+        os.replace(temporary_journal, journal)
+
+    @staticmethod
+    def _remove(path: str) -> None:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def _sync_directory(directory: str) -> None:
+        try:
+            descriptor = os.open(directory, os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(descriptor)
+        except OSError:
+            pass
+        finally:
+            os.close(descriptor)
@@ -0,0 +1,382 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import errno
+import ctypes
+import ctypes.util
+import select
+import struct
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# inotify event masks, see inotify(7)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+# Writes are not watched, a download being written is caught by its
+# signature changing while it settles, which costs far fewer wakeups
+WATCH_MASK = (
+    IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_ONLYDIR
+)
+EVENT_HEADER = struct.Struct("iIII")
+
+# Extensions download clients give files they are still writing
+INCOMPLETE_EXTENSIONS = ("part", "partial", "!qb", "!ut", "crdownload", "aria2")
+
+
+def download_signature(path: str) -> Optional[Tuple[Tuple[str, int, int], ...]]:
+    """
+    Get the size and mtime of every file of a download.
+
+    Args:
+    - path (str): Path of the download, a file or a directory.
+
+    Returns:
+    - Tuple of (relative path, size, mtime in nanoseconds), or None if the
+      download has files the download client marks as incomplete.
+    """
+    if os.path.isdir(path):
+        paths = [
+            os.path.join(directory, file_name)
+            for directory, _, file_names in os.walk(path)
+            for file_name in file_names
+        ]
+    else:
+        paths = [path]
+    signature = []
+    for file_path in paths:
+        if os.path.splitext(file_path)[1][1:].lower() in INCOMPLETE_EXTENSIONS:
+            return None
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            continue
+        signature.append(
+            (os.path.relpath(file_path, path), stat.st_size, stat.st_mtime_ns)
+        )
+    return tuple(sorted(signature))
+
+
+class Inotify:
+    """
+    Recursive inotify watch of a directory tree, through ctypes.
+
+    Directories created or moved into the tree are watched as they appear.
+
+    Attributes:
+    - directory: Root directory watched.
+    """
+
+    def __init__(self, directory: str):
+        """
+        Start watching a directory tree.
+
+        Args:
+        - directory (str): Root directory to watch.
+
+        Raises:
+        - OSError: If inotify is not available, or the tree cannot be watched,
+          e.g. because it has more directories than fs.inotify.max_user_watches.
+        """
+        self.directory = os.path.normpath(directory)
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        if not hasattr(self._libc, "inotify_init1"):
+            raise OSError(errno.ENOSYS, "inotify is not available")
+        self.fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+        self._watches: Dict[int, str] = {}
+        try:
+            self.add_tree(self.directory)
+        except OSError:
+            self.close()
+            raise
+
+    def add_tree(self, directory: str) -> None:
+        """
+        Watch a directory and every directory beneath it.
+
+        Args:
+        - directory (str): Directory to watch.
+        """
+        for path, directories, _ in os.walk(directory):
+            self._add(path)
+
+    def _add(self, path: str) -> None:
+        watch = self._libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if watch < 0:
+            error = ctypes.get_errno()
+            if error in (errno.ENOENT, errno.ENOTDIR):
+                # Removed or renamed meanwhile
+                return
+            raise OSError(error, f"Unable to watch {path}: {os.strerror(error)}")
+        self._watches[watch] = path
+
+    def read(self, timeout: float) -> List[Tuple[str, bool]]:
+        """
+        Wait for events.
+
+        Args:
+        - timeout (float): Seconds to wait for an event.
+
+        Returns:
+        - List of (path, finished) events, finished if a file was closed after
+          writing or moved into place. An event for the root directory means
+          events were lost and anything may have changed.
+        """
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                watch, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                name = os.fsdecode(data[offset : offset + length].rstrip(b"\0"))
+                offset += length
+                if mask & IN_Q_OVERFLOW:
+                    events.append((self.directory, False))
+                    continue
+                if mask & IN_IGNORED:
+                    self._watches.pop(watch, None)
+                    continue
+                directory = self._watches.get(watch)
+                if directory is None:
+                    continue
+                path = os.path.join(directory, name) if name else directory
+                if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                    try:
+                        self.add_tree(path)
+                    except OSError:
+                        # Its download still settles through its signature
+                        pass
+                events.append((path, bool(mask & (IN_CLOSE_WRITE | IN_MOVED_TO))))
+        return events
+
+    def close(self) -> None:
+        """
+        Stop watching.
+        """
+        os.close(self.fd)
+
+
+class Poller:
+    """
+    Polling stand-in for Inotify, for file systems whose changes inotify does
+    not see, such as NFS and SMB mounts, and for other platforms.
+
+    Attributes:
+    - directory: Root directory watched.
+    - interval: Seconds between polls.
+    """
+
+    def __init__(self, directory: str, interval: float = 30.0):
+        """
+        Start polling a directory tree.
+
+        Args:
+        - directory (str): Root directory to poll.
+        - interval (float): Seconds between polls.
+        """
+        self.directory = os.path.normpath(directory)
+        self.interval = interval
+        self._signatures: Dict[str, Optional[Tuple]] = {}
+        self._polled = 0.0
+
+    def read(self, timeout: float) -> List[Tuple[str, bool]]:
+        """
+        Wait for the next poll, then report the downloads that changed.
+
+        Args:
+        - timeout (float): Seconds to wait at most.
+
+        Returns:
+        - List of (path, finished) events, see Inotify.read().
+        """
+        remaining = self._polled + self.interval - time.monotonic()
+        if remaining > 0:
+            time.sleep(min(timeout, remaining))
+            return []
+        self._polled = time.monotonic()
+        signatures = {}
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return []
+        for name in names:
+            if not name.startswith("."):
+                signatures[name] = download_signature(
+                    os.path.join(self.directory, name)
+                )
+        events = [
+            (os.path.join(self.directory, name), False)
+            for name, signature in signatures.items()
+            if signature is None or self._signatures.get(name) != signature
+        ]
+        self._signatures = signatures
+        return events
+
+    def close(self) -> None:
+        """
+        Stop polling.
+        """
+
+
+class PendingDownload:
+    """
+    A download waiting for its files to settle.
+
+    Attributes:
+    - changed: time.monotonic() of the last change seen.
+    - finished: Flag indicating whether the last change finished writing a file.
+    - signature: Signature of the download when last checked, see download_signature().
+    """
+
+    __slots__ = ("changed", "finished", "signature")
+
+    def __init__(self):
+        """
+        Initialize the PendingDownload.
+        """
+        self.changed = time.monotonic()
+        self.finished = False
+        self.signature: Optional[Tuple] = None
+
+
+class DownloadWatcher:
+    """
+    Watches a downloads directory and reports downloads once they settle.
+
+    A download is an entry directly inside the directory, a file or a
+    folder. Processing renames the folder of a download, so a download is
+    only reported once all of its files settled: none changed size or mtime
+    for settle_seconds, or for finished_settle_seconds after a file was
+    closed after writing or moved into place. Downloads with files the
+    download client marks as incomplete are held back. Downloads present
+    when watching starts are reported as they settle too.
+
+    Changes are read from inotify, or polled on file systems and platforms
+    without it.
+
+    Attributes:
+    - directory: Downloads directory watched.
+    - settle_seconds: Seconds a download must stay unchanged.
+    - finished_settle_seconds: Seconds a download must stay unchanged after
+      a file in it finished writing.
+    - source: Inotify, or Poller, reading the changes.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        settle_seconds: float = 60.0,
+        finished_settle_seconds: float = 5.0,
+        poll_interval: Optional[float] = None,
+    ):
+        """
+        Start watching a downloads directory.
+
+        Args:
+        - directory (str): Downloads directory to watch.
+        - settle_seconds (float): Seconds a download must stay unchanged.
+        - finished_settle_seconds (float): Seconds a download must stay
+          unchanged after a file in it finished writing.
+        - poll_interval (Optional[float]): Poll every this many seconds
+          instead of using inotify, e.g. for a network mount.
+        """
+        self.directory = os.path.normpath(directory)
+        self.settle_seconds = settle_seconds
+        self.finished_settle_seconds = finished_settle_seconds
+        self.source = None
+        if poll_interval is None:
+            try:
+                self.source = Inotify(self.directory)
+            except (OSError, AttributeError, TypeError):
+                poll_interval = 30.0
+        if self.source is None:
+            self.source = Poller(self.directory, poll_interval)
+        self._pending: Dict[str, PendingDownload] = {}
+        self._touch_all()
+
+    def _touch(self, name: str, finished: bool) -> None:
+        download = self._pending.get(name)
+        if download is None:
+            download = self._pending[name] = PendingDownload()
+            download.signature = download_signature(os.path.join(self.directory, name))
+        download.changed = time.monotonic()
+        download.finished = finished
+
+    def _touch_all(self) -> None:
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return
+        for name in names:
+            if not name.startswith("."):
+                self._touch(name, False)
+
+    def _settled(self) -> List[str]:
+        now = time.monotonic()
+        settled = []
+        for name, download in list(self._pending.items()):
+            wait = (
+                self.finished_settle_seconds
+                if download.finished
+                else self.settle_seconds
+            )
+            if now - download.changed < wait:
+                continue
+            path = os.path.join(self.directory, name)
+            if not os.path.lexists(path):
+                del self._pending[name]
+                continue
+            signature = download_signature(path)
+            if signature is None or signature != download.signature:
+                # Still being written, check again once it had time to settle
+                download.signature = signature
+                download.changed = now
+                download.finished = False
+                continue
+            del self._pending[name]
+            settled.append(name)
+        return sorted(settled)
+
+    def batches(self) -> Iterator[List[str]]:
+        """
+        Wait for downloads to settle.
+
+        Returns:
+        - Iterator of lists of downloads, by name in the downloads directory,
+          each yielded as soon as they settle.
+        """
+        while True:
+            for path, finished in self.source.read(timeout=1.0):
+                if path == self.directory:
+                    self._touch_all()
+                    continue
+                name = os.path.relpath(path, self.directory).split(os.sep)[0]
+                if name.startswith("."):
+                    continue
+                self._touch(name, finished)
+            settled = self._settled()
+            if settled:
+                yield settled
+
+    def close(self) -> None:
+        """
+        Stop watching.
+        """
+        self.source.close()
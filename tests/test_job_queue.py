@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import signal
+import socket
+import shutil
+import subprocess
+import sys
+import time
+
+import pytest
+
+from media_manager.containers import read_container
+from media_manager.job_queue import JobQueue
+from media_manager.media_manager import MediaManager
+
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LEASE_TIMEOUT = 2.0
+
+needs_ffmpeg = pytest.mark.skipif(
+    shutil.which("ffmpeg") is None, reason="ffmpeg is not installed"
+)
+
+
+def wait_for(condition, timeout: float = 60.0, interval: float = 0.05) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("Timed out")
+        time.sleep(interval)
+
+
+def queue_files(queue: JobQueue, state: str):
+    return sorted(os.listdir(os.path.join(queue.directory, state)))
+
+
+def temporary_files(directory):
+    return [name for name in os.listdir(directory) if name.startswith("temp-")]
+
+
+@pytest.fixture
+def video(tmp_path):
+    directory = tmp_path / "library" / "Test Movie 2020"
+    directory.mkdir(parents=True)
+    path = directory / "Test Movie 2020.mkv"
+    subprocess.run(
+        [
+            "ffmpeg",
+            "-v",
+            "error",
+            "-f",
+            "lavfi",
+            "-i",
+            "testsrc2=size=640x360:rate=24",
+            "-f",
+            "lavfi",
+            "-i",
+            "sine=frequency=440",
+            "-t",
+            "15",
+            "-c:v",
+            "libx264",
+            "-preset",
+            "ultrafast",
+            "-c:a",
+            "aac",
+            str(path),
+        ],
+        check=True,
+    )
+    return str(path)
+
+
+def submit(queue: JobQueue, path: str) -> str:
+    manager = MediaManager()
+    manager.set_optimize(True)
+    manager.set_preset("ultrafast")
+    # Always encode the video, however little the test pattern takes up
+    manager.set_bits_per_pixel(0.0)
+    return queue.submit(
+        {
+            "path": os.path.relpath(path, queue.directory),
+            "name": "Test Movie 2020",
+            "folder_name": "Test Movie 2020",
+            "media_type": "media",
+            "settings": manager.queue_settings(),
+        }
+    )
+
+
+def start_worker(queue: JobQueue, log_path: str) -> subprocess.Popen:
+    with open(log_path, "w") as log_file:
+        # A session of its own, so the worker can be stopped along with ffmpeg
+        return subprocess.Popen(
+            [
+                sys.executable,
+                "-m",
+                "media_manager.media_manager",
+                "--queue",
+                queue.directory,
+                "--worker",
+                "--lease-timeout",
+                str(LEASE_TIMEOUT),
+                "--idle-timeout",
+                "5",
+            ],
+            cwd=REPOSITORY,
+            stdout=log_file,
+            stderr=subprocess.STDOUT,
+            start_new_session=True,
+        )
+
+
+def worker_id(process: subprocess.Popen) -> str:
+    return f"{socket.gethostname()}-{process.pid}"
+
+
+def test_lost_lease_drops_outcome(tmp_path):
+    queue = JobQueue(str(tmp_path / "queue"), lease_timeout=LEASE_TIMEOUT)
+    job_id = queue.submit({"path": "a.mkv"})
+    lease = queue.lease()
+    assert lease.job_id == job_id
+    # Another host reclaims the lease once it expired
+    old = time.time() - 10 * LEASE_TIMEOUT
+    os.utime(lease.path, (old, old))
+    assert queue.reclaim_expired() == 1
+    assert not queue.heartbeat(lease)
+    assert lease.lost.is_set()
+    assert not queue.complete(lease, {"failed": False})
+    assert queue.result(job_id) is None
+    assert queue_files(queue, "pending") == [f"{job_id}.json"]
+
+
+def test_release_returns_job(tmp_path):
+    queue = JobQueue(str(tmp_path / "queue"), lease_timeout=LEASE_TIMEOUT)
+    job_id = queue.submit({"path": "a.mkv"})
+    lease = queue.lease()
+    queue.release(lease)
+    assert queue_files(queue, "leased") == []
+    assert queue.lease().job_id == job_id
+
+
+@needs_ffmpeg
+def test_crashed_worker_job_is_reclaimed_and_finished_once(tmp_path, video):
+    queue = JobQueue(str(tmp_path / "queue"), lease_timeout=LEASE_TIMEOUT)
+    job_id = submit(queue, video)
+    crashed = start_worker(queue, str(tmp_path / "crashed.log"))
+    workers = []
+    try:
+        # Kill the worker and its ffmpeg in the middle of the job
+        wait_for(lambda: temporary_files(os.path.dirname(video)))
+        os.killpg(crashed.pid, signal.SIGKILL)
+        crashed.wait()
+        assert queue_files(queue, "leased") == [f"{job_id}@{worker_id(crashed)}.json"]
+
+        workers = [
+            start_worker(queue, str(tmp_path / f"worker-{index}.log"))
+            for index in range(3)
+        ]
+        wait_for(lambda: queue.result(job_id) is not None)
+        for worker in workers:
+            assert worker.wait(timeout=60) == 0
+    finally:
+        for process in [crashed] + workers:
+            if process.poll() is None:
+                os.killpg(process.pid, signal.SIGKILL)
+
+    result = queue.result(job_id)
+    assert not result["failed"]
+    assert result["worker"] in [worker_id(worker) for worker in workers]
+    assert queue_files(queue, "results") == [f"{job_id}.json"]
+    assert queue_files(queue, "leased") == []
+    assert queue_files(queue, "pending") == []
+    runs = 0
+    for index in range(3):
+        with open(tmp_path / f"worker-{index}.log") as log_file:
+            runs += log_file.read().count("Processing ")
+    assert runs == 1
+    streams = read_container(video)["streams"]
+    assert [s["codec_name"] for s in streams if s["codec_type"] == "video"] == ["hevc"]
+
+
+@needs_ffmpeg
+def test_worker_stops_job_when_lease_is_lost(tmp_path, video):
+    queue = JobQueue(str(tmp_path / "queue"), lease_timeout=LEASE_TIMEOUT)
+    job_id = submit(queue, video)
+    stalled = start_worker(queue, str(tmp_path / "stalled.log"))
+    other = None
+    try:
+        # Freeze the worker and its ffmpeg, like a host cut off from the mount
+        wait_for(lambda: temporary_files(os.path.dirname(video)))
+        os.killpg(stalled.pid, signal.SIGSTOP)
+        other = start_worker(queue, str(tmp_path / "other.log"))
+        wait_for(
+            lambda: any(
+                worker_id(other) in name for name in queue_files(queue, "leased")
+            )
+        )
+        os.killpg(stalled.pid, signal.SIGCONT)
+        assert stalled.wait(timeout=60) == 0
+        wait_for(lambda: queue.result(job_id) is not None)
+        assert other.wait(timeout=60) == 0
+    finally:
+        for process in (stalled, other):
+            if process and process.poll() is None:
+                os.killpg(process.pid, signal.SIGKILL)
+
+    with open(tmp_path / "stalled.log") as log_file:
+        assert "was lost" in log_file.read()
+    result = queue.result(job_id)
+    assert result["worker"] == worker_id(other)
+    assert not result["failed"]
+    assert queue_files(queue, "results") == [f"{job_id}.json"]
+    assert temporary_files(os.path.dirname(video)) == []
+    streams = read_container(video)["streams"]
+    assert [s["codec_name"] for s in streams if s["codec_type"] == "video"] == ["hevc"]
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+
+import pytest
+
+from media_manager.media_index import MediaEntry
+from media_manager.media_job import MediaJob
+from media_manager.media_manager import MediaManager
+from media_manager.music_cache import RecognitionCache
+from media_manager.music_pipeline import (
+    ExcerptRecognizer,
+    MusicPipeline,
+    ReplayRecognizer,
+)
+
+
+class TaggingManager(MediaManager):
+    """
+    MediaManager recording the tags it would write, so the pipeline runs
+    without the music modules.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.tagged = {}
+
+    def prepare_media_file(self, job: MediaJob) -> bool:
+        job.working_directory = os.path.normpath(job.directory)
+        with self.layout_lock:
+            self.directory_users[job.working_directory] = (
+                self.directory_users.get(job.working_directory, 0) + 1
+            )
+        return True
+
+    def audio_metadata_set(self, job: MediaJob) -> bool:
+        return False
+
+    def fetch_album_art(self, url: str) -> bytes:
+        return b""
+
+    def apply_audio_metadata(self, job: MediaJob, song, album_art: bytes) -> None:
+        self.tagged[job.entry.path] = song["track"]["title"]
+
+    def finish_media_file(self, job: MediaJob) -> None:
+        pass
+
+
+class FixedExcerptRecognizer(ExcerptRecognizer):
+    """
+    ExcerptRecognizer whose excerpts are derived from the file name, instead
+    of decoded by ffmpeg.
+    """
+
+    def decode(self, path: str, offset: float) -> bytes:
+        return f"{os.path.basename(path)}@{offset:.1f}".encode("utf-8")
+
+
+def song(title: str):
+    return {"track": {"title": title, "images": {"coverart": ""}}}
+
+
+@pytest.fixture
+def music(tmp_path):
+    directory = tmp_path / "Music"
+    directory.mkdir()
+    paths = []
+    for index in range(8):
+        path = directory / f"track-{index}.mp3"
+        path.write_bytes(os.urandom(4096))
+        paths.append(str(path))
+    return paths
+
+
+@pytest.fixture
+def replay(tmp_path, music):
+    recognizer = ReplayRecognizer(str(tmp_path / "results"), latency=0.05)
+    for path in music:
+        recognizer.save(path, song(os.path.basename(path)))
+    return recognizer
+
+
+def jobs(manager, paths):
+    return [MediaJob(MediaEntry(path), manager.movie_filters) for path in paths]
+
+
+def test_requests_are_bounded_by_the_concurrency(music, replay):
+    manager = TaggingManager()
+    MusicPipeline(manager, recognizer=replay, concurrency=3).run(jobs(manager, music))
+    assert replay.requests == len(music)
+    assert replay.max_in_flight == 3
+    assert manager.tagged == {path: os.path.basename(path) for path in music}
+
+
+def test_requests_are_spaced_by_the_rate_limit(music, replay):
+    manager = TaggingManager()
+    replay.latency = 0.0
+    MusicPipeline(manager, recognizer=replay, concurrency=8, rate_limit=20).run(
+        jobs(manager, music)
+    )
+    gaps = [b - a for a, b in zip(replay.started, replay.started[1:])]
+    assert len(gaps) == len(music) - 1
+    assert min(gaps) >= 0.05 * 0.9
+
+
+def test_excerpts_are_replayed(tmp_path, music):
+    replay = ReplayRecognizer(str(tmp_path / "results"))
+    for path in music:
+        # Only the second window matches
+        replay.save(f"{os.path.basename(path)}@60.0".encode("utf-8"), song(path))
+    recognizer = FixedExcerptRecognizer(
+        replay, duration=10.0, probe=lambda path: {"format": {"duration": "100"}}
+    )
+    manager = TaggingManager()
+    MusicPipeline(manager, recognizer=recognizer).run(jobs(manager, music))
+    assert replay.requests == 2 * len(music)
+    assert manager.tagged == {path: path for path in music}
+
+
+def test_recorded_results_are_replayed(tmp_path, music, replay):
+    recorder = ReplayRecognizer(str(tmp_path / "recorded"), recognizer=replay)
+    manager = TaggingManager()
+    MusicPipeline(manager, recognizer=recorder).run(jobs(manager, music))
+    offline = ReplayRecognizer(str(tmp_path / "recorded"))
+    manager = TaggingManager()
+    MusicPipeline(manager, recognizer=offline).run(jobs(manager, music))
+    assert replay.requests == len(music)
+    assert manager.tagged == {path: os.path.basename(path) for path in music}
+
+
+def test_recognized_files_are_answered_from_the_cache(tmp_path, music, replay):
+    cache = RecognitionCache(str(tmp_path / "cache"))
+    for _ in range(2):
+        manager = TaggingManager()
+        manager.set_recognition_cache(cache)
+        MusicPipeline(manager, recognizer=replay).run(jobs(manager, music))
+        assert manager.tagged == {path: os.path.basename(path) for path in music}
+    assert replay.requests == len(music)
+    assert cache.hits == len(music)